@@ -10,6 +10,7 @@ from os import listdir
 import os
 
 import datetime
+import numpy
 from django.shortcuts import render, redirect
 from django.http import HttpResponse, JsonResponse
 from global_methods import *
@@ -183,6 +184,58 @@ def replay(request, sim_code, step):
   return render(request, template, context)
 
 
+def load_binary_nodes(a_mem_folder): 
+  """
+  Reads the node metadata of an associative memory saved in the backend's 
+  binary format (nodes.npz; see AssociativeMemory.save_binary) and returns 
+  it in the same layout as nodes.json. 
+  """
+  columns = numpy.load(a_mem_folder + "/nodes.npz")
+
+  def unpack(column): 
+    raw = columns[column + "_data"].tobytes()
+    offsets = columns[column + "_offsets"].tolist()
+    return [raw[offsets[i]:offsets[i+1]].decode("utf-8") 
+            for i in range(len(offsets) - 1)]
+
+  def to_str(seconds): 
+    return ((datetime.datetime(1970, 1, 1) 
+             + datetime.timedelta(seconds=seconds))
+            .strftime('%Y-%m-%d %H:%M:%S'))
+
+  strings = {i: unpack(i) for i in ["subject", "predicate", "object", 
+                                    "description", "embedding_key", 
+                                    "keywords", "filling"]}
+  node_types = ["event", "chat", "thought"]
+  type_count = columns["type_count"].tolist()
+  types = columns["type"].tolist()
+  depth = columns["depth"].tolist()
+  created = columns["created"].tolist()
+  has_expiration = columns["has_expiration"].tolist()
+  expiration = columns["expiration"].tolist()
+  poignancy = columns["poignancy"].tolist()
+
+  nodes = dict()
+  for count in range(len(types), 0, -1): 
+    i = count - 1
+    nodes[f"node_{str(count)}"] = {
+      "node_count": count, 
+      "type_count": type_count[i], 
+      "type": node_types[types[i]], 
+      "depth": depth[i], 
+      "created": to_str(created[i]), 
+      "expiration": to_str(expiration[i]) if has_expiration[i] else None, 
+      "subject": strings["subject"][i], 
+      "predicate": strings["predicate"][i], 
+      "object": strings["object"][i], 
+      "description": strings["description"][i], 
+      "embedding_key": strings["embedding_key"][i], 
+      "poignancy": poignancy[i], 
+      "keywords": json.loads(strings["keywords"][i]), 
+      "filling": json.loads(strings["filling"][i])}
+  return nodes
+
+
 def replay_persona_state(request, sim_code, step, persona_name): 
   sim_code = sim_code
   step = int(step)
@@ -199,8 +252,11 @@ def replay_persona_state(request, sim_code, step, persona_name):
   with open(memory + "/spatial_memory.json") as json_file:  
     spatial = json.load(json_file)
 
-  with open(memory + "/associative_memory/nodes.json") as json_file:  
-    associative = json.load(json_file)
+  if os.path.exists(memory + "/associative_memory/nodes.json"): 
+    with open(memory + "/associative_memory/nodes.json") as json_file:  
+      associative = json.load(json_file)
+  else: 
+    associative = load_binary_nodes(memory + "/associative_memory")
 
   a_mem_event = []
   a_mem_chat = []
@@ -286,9 +342,12 @@ def update_environment(request):
   step = data["step"]
   sim_code = data["sim_code"]
 
+  # Steps from before a lineage fork live in the parent simulation (see 
+  # copy_sim_lineage). 
   response_data = {"<step>": -1}
-  if (check_if_file_exists(f"storage/{sim_code}/movement/{step}.json")):
-    with open(f"storage/{sim_code}/movement/{step}.json") as json_file: 
+  move_file = resolve_sim_step_file(f"storage/{sim_code}", "movement", step)
+  if move_file: 
+    with open(move_file) as json_file: 
       response_data = json.load(json_file)
       response_data["<step>"] = step
 
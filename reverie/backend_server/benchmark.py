@@ -9,6 +9,21 @@ Usage:
   cd reverie/backend_server
   uv run python benchmark.py
 
+  To rerun without API calls, record the responses once and replay them:
+  LLM_CACHE=on uv run python benchmark.py
+  LLM_CACHE=replay uv run python benchmark.py
+
+  To run offline against the local stand-in (llm_backend.py), with ~800ms of
+  simulated latency per request:
+  LLM_BACKEND=local LOCAL_LLM_LATENCY_MS=800 uv run python benchmark.py
+
+  To skip the steps in which every persona is asleep (fast_forward.py):
+  HEADLESS_FAST_FORWARD=on uv run python benchmark.py
+
+  To fuse the same-template requests of the persona threads (llm_batcher.py)
+  and print the requests and upstream calls of each template:
+  LLM_BATCH_WINDOW_MS=5 uv run python benchmark.py
+
 Measures three phases:
   1. First day init (steps 0-10): hourly schedule batch generation effect
   2. Skip sleeping (2900 steps): fast-forward baseline
@@ -25,6 +40,8 @@ from concurrent.futures import ThreadPoolExecutor
 sys.path.insert(0, ".")
 
 from reverie import ReverieServer
+from fast_forward import fast_forward_enabled, skip_dormant_steps
+from persona.prompt_template.gpt_structure import get_request_batcher
 
 # ---------- Configuration ----------
 SIM_ORIGIN = "base_the_ville_isabella_maria_klaus"
@@ -43,8 +60,18 @@ def run_headless_sequential(rs, n_steps):
     Phase A runs in a for-loop (no ThreadPoolExecutor).
     """
     game_obj_cleanup = dict()
+    fast_forward = fast_forward_enabled()
+
+    step = 0
+    while step < n_steps:
+        if fast_forward:
+            skipped = skip_dormant_steps(rs, n_steps - step)
+            if skipped:
+                step += skipped
+                print(f"    [SEQ] fast-forward {skipped} steps "
+                      f"(time: {rs.curr_time.strftime('%H:%M:%S')})")
+                continue
 
-    for step in range(n_steps):
         # Clean up object actions from previous cycle
         for key, val in game_obj_cleanup.items():
             rs.maze.turn_event_from_tile_idle(key, val)
@@ -90,9 +117,10 @@ def run_headless_sequential(rs, n_steps):
         # Advance time
         rs.step += 1
         rs.curr_time += datetime.timedelta(seconds=rs.sec_per_step)
+        step += 1
 
-        if (step + 1) % 100 == 0:
-            print(f"    [SEQ] step {step + 1}/{n_steps} "
+        if step % 100 == 0:
+            print(f"    [SEQ] step {step}/{n_steps} "
                   f"(time: {rs.curr_time.strftime('%H:%M:%S')})")
 
 
@@ -102,10 +130,20 @@ def run_headless_parallel(rs, n_steps):
     Phase A runs in ThreadPoolExecutor (created once, reused across steps).
     """
     game_obj_cleanup = dict()
+    fast_forward = fast_forward_enabled()
 
     with ThreadPoolExecutor(
             max_workers=min(len(rs.personas), 8)) as executor:
-        for step in range(n_steps):
+        step = 0
+        while step < n_steps:
+            if fast_forward:
+                skipped = skip_dormant_steps(rs, n_steps - step)
+                if skipped:
+                    step += skipped
+                    print(f"    [PAR] fast-forward {skipped} steps "
+                          f"(time: {rs.curr_time.strftime('%H:%M:%S')})")
+                    continue
+
             # Clean up object actions from previous cycle
             for key, val in game_obj_cleanup.items():
                 rs.maze.turn_event_from_tile_idle(key, val)
@@ -155,9 +193,10 @@ def run_headless_parallel(rs, n_steps):
             # Advance time
             rs.step += 1
             rs.curr_time += datetime.timedelta(seconds=rs.sec_per_step)
+            step += 1
 
-            if (step + 1) % 100 == 0:
-                print(f"    [PAR] step {step + 1}/{n_steps} "
+            if step % 100 == 0:
+                print(f"    [PAR] step {step}/{n_steps} "
                       f"(time: {rs.curr_time.strftime('%H:%M:%S')})")
 
 
@@ -189,6 +228,10 @@ def run_benchmark(label, sim_name, run_fn, phases):
     print(f"  Start time: {rs.curr_time.strftime('%B %d, %Y, %H:%M:%S')}")
     print()
 
+    batcher = get_request_batcher()
+    if batcher:
+        batcher.reset_stats()
+
     results = {}
     for phase_name, n_steps in phases:
         print(f"  --- Phase: {phase_name} ({n_steps} steps) ---")
@@ -201,6 +244,12 @@ def run_benchmark(label, sim_name, run_fn, phases):
               f"[game time: {rs.curr_time.strftime('%H:%M:%S')}]")
         print()
 
+    if batcher:
+        print("  Request batching (LLM_BATCH_WINDOW_MS):")
+        for line in batcher.report():
+            print(f"    {line}")
+        print()
+
     # Save and return
     rs.save()
     results["total"] = sum(results.values())
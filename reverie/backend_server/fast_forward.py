@@ -0,0 +1,137 @@
+"""
+File: fast_forward.py
+Description: Skips the headless loop ahead through quiet stretches of the
+simulation, e.g., the night.
+
+From about 11pm to 6am every persona is asleep: the action is "sleeping",
+which plan.py never decomposes, the persona stands still by its bed, and
+nothing new happens around it. The headless loop still runs the whole
+perceive -> retrieve -> plan -> reflect -> execute cycle for every persona on
+every one of those steps (about 2,900 steps a night at 10 seconds a step).
+
+skip_dormant_steps checks whether every persona is dormant:
+  - it is in the middle of an action that determine_decomp would not
+    decompose (sleeping and the like),
+  - it has no planned path left to walk and is not chatting,
+  - no other persona is within the vision radius of either of them,
+  - its last step was on the same day (the new-day planning is not due).
+If so, nothing can happen until the first of these boundaries:
+  - the end of a persona's current action (act_check_finished),
+  - the end of the current item of its f_daily_schedule,
+  - midnight, when the long-term planning of the new day starts.
+It moves <step> and <curr_time> straight to the last step at or before that
+boundary, so the step at the boundary itself runs normally. The only
+per-step state that changes in a dormant persona, its chatting_with_buffer
+countdown, is advanced by the number of skipped steps.
+
+Skipped steps are not perceived, so a sleeping persona does not re-perceive
+the objects around it during the night. Fast-forwarding is opt-in
+(HEADLESS_FAST_FORWARD=on).
+"""
+import datetime
+import os
+
+from persona.cognitive_modules.plan import determine_decomp
+
+
+def fast_forward_enabled():
+  return os.getenv("HEADLESS_FAST_FORWARD", "off").strip().lower() == "on"
+
+
+def is_dormant(persona, curr_time):
+  """
+  Returns True if <persona> is in a long, non-decomposed action (e.g.,
+  sleeping) that nothing but the clock can end.
+
+  INPUT
+    persona: A <Persona> instance.
+    curr_time: The time of the step that is about to run.
+  OUTPUT
+    A boolean.
+  """
+  scratch = persona.scratch
+  if not scratch.act_address or not scratch.act_description:
+    return False
+  if scratch.planned_path or scratch.chatting_with:
+    return False
+  if not scratch.curr_time or scratch.curr_time.date() != curr_time.date():
+    return False
+  return not determine_decomp(scratch.act_description, scratch.act_duration)
+
+
+def next_boundary(persona, curr_time):
+  """
+  Returns the first time after <curr_time> at which <persona>'s dormant
+  action can end: the end of the action, the end of the current schedule
+  item, or midnight, whichever comes first. If the action should already
+  have ended, returns <curr_time>.
+  """
+  act_end = persona.scratch.get_act_end_time()
+  if act_end <= curr_time:
+    # An action that should have ended already; let the normal loop deal
+    # with it.
+    return curr_time
+  midnight = (curr_time.replace(hour=0, minute=0, second=0, microsecond=0)
+              + datetime.timedelta(days=1))
+  boundary = min(act_end, midnight)
+
+  elapsed = 0
+  today = midnight - datetime.timedelta(days=1)
+  for task, duration in persona.scratch.f_daily_schedule:
+    elapsed += duration
+    end = today + datetime.timedelta(minutes=elapsed)
+    if end > curr_time:
+      boundary = min(boundary, end)
+      break
+  return boundary
+
+
+def fast_forward_steps(server):
+  """
+  Returns how many steps <server> can skip from its current step, which is
+  0 unless every persona is dormant and none can see another.
+  """
+  curr_time = server.curr_time
+  names = list(server.personas.keys())
+  for name in names:
+    if not is_dormant(server.personas[name], curr_time):
+      return 0
+
+  for count, name_1 in enumerate(names):
+    for name_2 in names[count + 1:]:
+      tile_1 = server.personas_tile[name_1]
+      tile_2 = server.personas_tile[name_2]
+      reach = max(server.personas[name_1].scratch.vision_r,
+                  server.personas[name_2].scratch.vision_r)
+      if (abs(tile_1[0] - tile_2[0]) <= reach
+          and abs(tile_1[1] - tile_2[1]) <= reach):
+        return 0
+
+  boundary = min(next_boundary(server.personas[name], curr_time)
+                 for name in names)
+  seconds = (boundary - curr_time).total_seconds()
+  return max(0, int(seconds // server.sec_per_step))
+
+
+def skip_dormant_steps(server, max_steps):
+  """
+  Skips <server> ahead by fast_forward_steps(server) steps, at most
+  <max_steps>.
+
+  INPUT
+    server: A <ReverieServer> (its personas, personas_tile, step, curr_time
+            and sec_per_step).
+    max_steps: The number of steps left in the current run.
+  OUTPUT
+    The number of steps skipped.
+  """
+  n_steps = min(fast_forward_steps(server), max_steps)
+  if n_steps <= 0:
+    return 0
+  for persona in server.personas.values():
+    buffer = persona.scratch.chatting_with_buffer
+    for p_name in list(buffer.keys()):
+      buffer[p_name] -= n_steps
+  server.step += n_steps
+  server.curr_time += datetime.timedelta(seconds=server.sec_per_step * n_steps)
+  return n_steps
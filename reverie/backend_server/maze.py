@@ -11,10 +11,48 @@ import datetime
 import pickle
 import time
 import math
+import os
+from collections import OrderedDict
 
 from global_methods import *
+from path_finder import (occupancy_grid, distance_field,
+                         descend_distance_field, PathCache)
 from utils import *
 
+# The events of a tile without any (see Maze.access_tile). 
+NO_EVENTS = frozenset()
+
+# The side, in tiles, of the square cells that <Maze.arena_event_tiles> 
+# splits each arena into. 
+EVENT_CELL = 8
+
+
+def intern_layer(code_maze, code_names): 
+  """
+  Turns a maze of Tiled color codes into a numpy array of name ids. 
+
+  INPUT
+    code_maze: A 2-d list of color code strings, accessed by [y][x]. 
+    code_names: A dictionary from color code to the name of the block.
+      e.g., {"32135": "bedroom 2", ...}
+  OUTPUT
+    names: A list of the distinct names, where names[0] is "" (no block).
+    layer: A numpy uint16 array of the same shape as <code_maze> holding 
+           the index into <names> of every tile. 
+  """
+  names = [""]
+  name_ids = {"": 0}
+  code_ids = dict()
+  for code, name in code_names.items(): 
+    if name not in name_ids: 
+      name_ids[name] = len(names)
+      names += [name]
+    code_ids[code] = name_ids[name]
+  layer = numpy.array([[code_ids.get(code, 0) for code in row] 
+                       for row in code_maze], dtype=numpy.uint16)
+  return names, layer
+
+
 class Maze: 
   def __init__(self, maze_name): 
     # READING IN THE BASIC META INFORMATION ABOUT THE MAP
@@ -109,69 +147,72 @@ class Maze:
       game_object_maze += [game_object_maze_raw[i:i+tw]]
       spawning_location_maze += [spawning_location_maze_raw[i:i+tw]]
 
-    # Once we are done loading in the maze, we now set up self.tiles. This is
-    # a matrix accessed by row:col where each access point is a dictionary
-    # that contains all the things that are taking place in that tile. 
-    # More specifically, it contains information about its "world," "sector,"
-    # "arena," "game_object," "spawning_location," as well as whether it is a
-    # collision block, and a set of all events taking place in it. 
-    # e.g., self.tiles[32][59] = {'world': 'double studio', 
-    #            'sector': '', 'arena': '', 'game_object': '', 
-    #            'spawning_location': '', 'collision': False, 'events': set()}
-    # e.g., self.tiles[9][58] = {'world': 'double studio', 
-    #         'sector': 'double studio', 'arena': 'bedroom 2', 
-    #         'game_object': 'bed', 'spawning_location': 'bedroom-2-a', 
-    #         'collision': False,
-    #         'events': {('double studio:double studio:bedroom 2:bed',
-    #                    None, None)}} 
-    self.tiles = []
-    for i in range(self.maze_height): 
-      row = []
-      for j in range(self.maze_width):
-        tile_details = dict()
-        tile_details["world"] = wb
-        
-        tile_details["sector"] = ""
-        if sector_maze[i][j] in sb_dict: 
-          tile_details["sector"] = sb_dict[sector_maze[i][j]]
-        
-        tile_details["arena"] = ""
-        if arena_maze[i][j] in ab_dict: 
-          tile_details["arena"] = ab_dict[arena_maze[i][j]]
-        
-        tile_details["game_object"] = ""
-        if game_object_maze[i][j] in gob_dict: 
-          tile_details["game_object"] = gob_dict[game_object_maze[i][j]]
-        
-        tile_details["spawning_location"] = ""
-        if spawning_location_maze[i][j] in slb_dict: 
-          tile_details["spawning_location"] = slb_dict[spawning_location_maze[i][j]]
-        
-        tile_details["collision"] = False
-        if self.collision_maze[i][j] != "0": 
-          tile_details["collision"] = True
-
-        tile_details["events"] = set()
-        
-        row += [tile_details]
-      self.tiles += [row]
+    # <collision_grid> is a numpy boolean version of the collision maze (True
+    # on collision blocks) that path_finder searches over. We build it once
+    # here rather than on every path_finder call.
+    self.collision_grid = occupancy_grid(self.collision_maze,
+                                         collision_block_id)
+    # <collision_version> goes up every time the collision maze changes (see
+    # set_collision), which invalidates the paths cached in <path_cache>.
+    self.collision_version = 0
+    self.path_cache = PathCache(int(os.getenv("MAZE_PATH_CACHE", "4096")))
+
+    # Once we are done loading in the maze, we now set up the tile layers. 
+    # Every tile has a "world," "sector," "arena," "game_object," and 
+    # "spawning_location," whether it is a collision block, and a set of all
+    # events taking place in it. Rather than a dictionary per tile holding 
+    # the same strings over and over, we intern the names of each level in a
+    # list (index 0 is the empty name "") and keep a (maze_height, maze_width)
+    # numpy array of name ids per level, accessed by [y][x]. 
+    # e.g., self.arena_names[self.arena_layer[9][58]] == 'bedroom 2'
+    # The whole map is a single world, so that is just a string. 
+    self.world = wb
+    self.sector_names, self.sector_layer = intern_layer(sector_maze, 
+                                                        sb_dict)
+    self.arena_names, self.arena_layer = intern_layer(arena_maze, ab_dict)
+    (self.game_object_names, 
+     self.game_object_layer) = intern_layer(game_object_maze, gob_dict)
+    (self.spawning_location_names, 
+     self.spawning_location_layer) = intern_layer(spawning_location_maze, 
+                                                  slb_dict)
+
+    # <self.tile_events> holds the set of events of each tile, but only for 
+    # tiles that have any (most tiles are empty floor or walls). 
+    # e.g., self.tile_events[(58, 9)] = 
+    #         {('double studio:double studio:bedroom 2:bed', 
+    #           None, None, None)}
     # Each game object occupies an event in the tile. We are setting up the 
     # default event value here. 
-    for i in range(self.maze_height):
-      for j in range(self.maze_width): 
-        if self.tiles[i][j]["game_object"]:
-          object_name = ":".join([self.tiles[i][j]["world"], 
-                                  self.tiles[i][j]["sector"], 
-                                  self.tiles[i][j]["arena"], 
-                                  self.tiles[i][j]["game_object"]])
-          go_event = (object_name, None, None, None)
-          self.tiles[i][j]["events"].add(go_event)
+    # The events are also indexed three more ways, all kept up to date by 
+    # add_event_from_tile and friends: 
+    # <self.event_tiles> -- event -> set of tiles it is on (a game object 
+    #   may stretch over many tiles). 
+    # <self.subject_tiles> -- subject -> {tile: set of the subject's events
+    #   on that tile}. 
+    # e.g., self.subject_tiles['Isabella Rodriguez'] = 
+    #         {(72, 14): {('Isabella Rodriguez', 'is', 'idle', 'idle')}}
+    # <self.arena_event_tiles> -- (sector id, arena id, cell x, cell y) -> 
+    #   set of the tiles of that arena that have events, and lie in that 
+    #   EVENT_CELL x EVENT_CELL cell of the map. This is what perception 
+    #   looks at. The cells keep a lookup inside the vision window: the 
+    #   streets of the Ville are one arena of ~10,000 tiles. 
+    self.tile_events = dict()
+    self.event_tiles = dict()
+    self.subject_tiles = dict()
+    self.arena_event_tiles = dict()
+    for i, j in zip(*numpy.nonzero(self.game_object_layer)): 
+      i = int(i)
+      j = int(j)
+      object_name = self.get_tile_path((j, i), "game_object")
+      go_event = (object_name, None, None, None)
+      self.add_event_from_tile(go_event, (j, i))
 
     # Reverse tile access. 
     # <self.address_tiles> -- given a string address, we return a set of all 
     # tile coordinates belonging to that address (this is opposite of  
-    # self.tiles that give you the string address given a coordinate). This is
-    # an optimization component for finding paths for the personas' movement. 
+    # access_tile that gives you the string address given a coordinate). This
+    # is an optimization component for finding paths for the personas' 
+    # movement. 
     # self.address_tiles['<spawn_loc>bedroom-2-a'] == {(58, 9)}
     # self.address_tiles['double studio:recreation:pool table'] 
     #   == {(29, 14), (31, 11), (30, 14), (32, 11), ...}, 
@@ -179,24 +220,16 @@ class Maze:
     for i in range(self.maze_height):
       for j in range(self.maze_width): 
         addresses = []
-        if self.tiles[i][j]["sector"]: 
-          add = f'{self.tiles[i][j]["world"]}:'
-          add += f'{self.tiles[i][j]["sector"]}'
-          addresses += [add]
-        if self.tiles[i][j]["arena"]: 
-          add = f'{self.tiles[i][j]["world"]}:'
-          add += f'{self.tiles[i][j]["sector"]}:'
-          add += f'{self.tiles[i][j]["arena"]}'
-          addresses += [add]
-        if self.tiles[i][j]["game_object"]: 
-          add = f'{self.tiles[i][j]["world"]}:'
-          add += f'{self.tiles[i][j]["sector"]}:'
-          add += f'{self.tiles[i][j]["arena"]}:'
-          add += f'{self.tiles[i][j]["game_object"]}'
-          addresses += [add]
-        if self.tiles[i][j]["spawning_location"]: 
-          add = f'<spawn_loc>{self.tiles[i][j]["spawning_location"]}'
-          addresses += [add]
+        if self.sector_layer[i][j]: 
+          addresses += [self.get_tile_path((j, i), "sector")]
+        if self.arena_layer[i][j]: 
+          addresses += [self.get_tile_path((j, i), "arena")]
+        if self.game_object_layer[i][j]: 
+          addresses += [self.get_tile_path((j, i), "game_object")]
+        if self.spawning_location_layer[i][j]: 
+          spawn = self.spawning_location_names[
+                    self.spawning_location_layer[i][j]]
+          addresses += [f'<spawn_loc>{spawn}']
 
         for add in addresses: 
           if add in self.address_tiles: 
@@ -204,6 +237,13 @@ class Maze:
           else: 
             self.address_tiles[add] = set([(j, i)])
 
+    # <self.distance_fields> -- for each address that personas have walked to
+    # recently, the number of steps from every tile to the nearest tile of
+    # that address (see address_distance_field). The set of addresses is
+    # fixed, but we only keep the <max_distance_fields> most recently used.
+    self.distance_fields = OrderedDict()
+    self.max_distance_fields = int(os.getenv("MAZE_DISTANCE_FIELDS", "256"))
+
 
   def turn_coordinate_to_tile(self, px_coordinate): 
     """
@@ -225,25 +265,37 @@ class Maze:
 
   def access_tile(self, tile): 
     """
-    Returns the tiles details dictionary that is stored in self.tiles of the 
-    designated x, y location. 
+    Returns the tile details dictionary of the designated x, y location, 
+    assembled from the tile layers. 
 
     INPUT
       tile: The tile coordinate of our interest in (x, y) form.
     OUTPUT
-      The tile detail dictionary for the designated tile. 
+      The tile detail dictionary for the designated tile. Its "events" is the
+      tile's own event set (a read-only empty set if the tile has no events);
+      use add_event_from_tile and friends to change it. 
     EXAMPLE OUTPUT
       Given (58, 9), 
-      self.tiles[9][58] = {'world': 'double studio', 
-            'sector': 'double studio', 'arena': 'bedroom 2', 
-            'game_object': 'bed', 'spawning_location': 'bedroom-2-a', 
-            'collision': False,
-            'events': {('double studio:double studio:bedroom 2:bed',
-                       None, None)}} 
+      {'world': 'double studio', 
+       'sector': 'double studio', 'arena': 'bedroom 2', 
+       'game_object': 'bed', 'spawning_location': 'bedroom-2-a', 
+       'collision': False,
+       'events': {('double studio:double studio:bedroom 2:bed',
+                  None, None, None)}} 
     """
     x = tile[0]
     y = tile[1]
-    return self.tiles[y][x]
+    tile_details = dict()
+    tile_details["world"] = self.world
+    tile_details["sector"] = self.sector_names[self.sector_layer[y][x]]
+    tile_details["arena"] = self.arena_names[self.arena_layer[y][x]]
+    tile_details["game_object"] = (self.game_object_names
+                                   [self.game_object_layer[y][x]])
+    tile_details["spawning_location"] = (self.spawning_location_names
+                                         [self.spawning_location_layer[y][x]])
+    tile_details["collision"] = bool(self.collision_grid[y][x])
+    tile_details["events"] = self.tile_events.get((x, y), NO_EVENTS)
+    return tile_details
 
 
   def get_tile_path(self, tile, level): 
@@ -262,23 +314,22 @@ class Maze:
     """
     x = tile[0]
     y = tile[1]
-    tile = self.tiles[y][x]
 
-    path = f"{tile['world']}"
+    path = f"{self.world}"
     if level == "world": 
       return path
     else: 
-      path += f":{tile['sector']}"
+      path += f":{self.sector_names[self.sector_layer[y][x]]}"
     
     if level == "sector": 
       return path
     else: 
-      path += f":{tile['arena']}"
+      path += f":{self.arena_names[self.arena_layer[y][x]]}"
 
     if level == "arena": 
       return path
     else: 
-      path += f":{tile['game_object']}"
+      path += f":{self.game_object_names[self.game_object_layer[y][x]]}"
 
     return path
 
@@ -301,6 +352,22 @@ class Maze:
     OUTPUT: 
       nearby_tiles: a list of tiles that are within the radius. 
     """
+    left_end, right_end, top_end, bottom_end = self.vision_window(tile, 
+                                                                  vision_r)
+    nearby_tiles = []
+    for i in range(left_end, right_end): 
+      for j in range(top_end, bottom_end): 
+        nearby_tiles += [(i, j)]
+    return nearby_tiles
+
+
+  def vision_window(self, tile, vision_r): 
+    """
+    Returns the bounds of the square that get_nearby_tiles covers, as 
+    half-open ranges: x in [left_end, right_end), y in [top_end, bottom_end).
+    (Note that, as it always has, the window stops one short of the last 
+    column and row of the map.)
+    """
     left_end = 0
     if tile[0] - vision_r > left_end: 
       left_end = tile[0] - vision_r
@@ -317,11 +384,201 @@ class Maze:
     if tile[1] - vision_r > top_end: 
       top_end = tile[1] - vision_r 
 
-    nearby_tiles = []
-    for i in range(left_end, right_end): 
-      for j in range(top_end, bottom_end): 
-        nearby_tiles += [(i, j)]
-    return nearby_tiles
+    return left_end, right_end, top_end, bottom_end
+
+
+  def get_nearby_spaces(self, tile, vision_r, explored=None): 
+    """
+    Returns the distinct places within the radius of get_nearby_tiles, 
+    computed over the tile layers rather than tile by tile. 
+
+    INPUT: 
+      tile: The tile coordinate of our interest in (x, y) form.
+      vision_r: The radius of the persona's vision. 
+      explored: Optional (maze_height, maze_width) numpy boolean array of 
+                tiles to skip. The tiles of the window are marked True in 
+                it. 
+    OUTPUT: 
+      A list of (world, sector, arena, game_object) name tuples, in the 
+      order in which get_nearby_tiles first reaches them. Levels a tile does
+      not have are "". 
+    """
+    left_end, right_end, top_end, bottom_end = self.vision_window(tile, 
+                                                                  vision_r)
+    # We transpose the windows so that they are flattened x-major, in the 
+    # same order as get_nearby_tiles. 
+    window = numpy.stack(
+      [self.sector_layer[top_end:bottom_end, left_end:right_end].T, 
+       self.arena_layer[top_end:bottom_end, left_end:right_end].T, 
+       self.game_object_layer[top_end:bottom_end, left_end:right_end].T], 
+      axis=-1).reshape(-1, 3)
+    if explored is not None: 
+      unseen = ~explored[top_end:bottom_end, left_end:right_end]
+      explored[top_end:bottom_end, left_end:right_end] = True
+      window = window[unseen.T.reshape(-1)]
+    if len(window) == 0: 
+      return []
+    ids, first = numpy.unique(window, axis=0, return_index=True)
+    spaces = []
+    for sector, arena, game_object in ids[numpy.argsort(first)].tolist(): 
+      spaces += [(self.world, 
+                  self.sector_names[sector], 
+                  self.arena_names[arena], 
+                  self.game_object_names[game_object])]
+    return spaces
+
+
+  def get_nearby_arena_events(self, tile, vision_r): 
+    """
+    Returns the events within the radius of get_nearby_tiles that take place
+    in the same arena as <tile>, closest first. Only the arena's tiles that 
+    have events (see <self.arena_event_tiles>) in the cells that overlap 
+    the window are looked at. 
+
+    Perception may run on a worker thread (HEADLESS_SCHEDULER=pipelined) 
+    while the main thread adds and removes events outside the window. So 
+    we loop over a snapshot of each cell's tile set, and only read the 
+    events of the tiles inside the window. 
+
+    INPUT: 
+      tile: The tile coordinate of our interest in (x, y) form.
+      vision_r: The radius of the persona's vision. 
+    OUTPUT: 
+      A list of (distance, event set) pairs, one per tile with events, 
+      sorted by the straight-line distance from <tile>. Ties keep the order
+      of get_nearby_tiles. 
+    """
+    left_end, right_end, top_end, bottom_end = self.vision_window(tile, 
+                                                                  vision_r)
+    sector, arena = self._event_cell_key(tile)[:2]
+    nearby = []
+    for cell_x in range(left_end // EVENT_CELL, 
+                        (right_end - 1) // EVENT_CELL + 1): 
+      for cell_y in range(top_end // EVENT_CELL, 
+                          (bottom_end - 1) // EVENT_CELL + 1): 
+        cell = self.arena_event_tiles.get((sector, arena, cell_x, cell_y), 
+                                          NO_EVENTS)
+        for t in tuple(cell): 
+          if left_end <= t[0] < right_end and top_end <= t[1] < bottom_end: 
+            nearby += [(math.dist(t, tile), t)]
+    # Sorting on (distance, (x, y)) breaks ties in get_nearby_tiles order. 
+    nearby.sort()
+    ret = []
+    for dist, t in nearby: 
+      events = self.tile_events.get(t)
+      if events: 
+        ret += [(dist, events)]
+    return ret
+
+
+  def _event_cell_key(self, tile): 
+    # The key of the tile's cell in <self.arena_event_tiles>. Arena names 
+    # repeat across sectors (every house has a "bedroom"), so the sector is
+    # part of it. 
+    return (int(self.sector_layer[tile[1]][tile[0]]), 
+            int(self.arena_layer[tile[1]][tile[0]]), 
+            tile[0] // EVENT_CELL, 
+            tile[1] // EVENT_CELL)
+
+
+  def address_distance_field(self, address): 
+    """
+    Returns the BFS distance field of an address: for every tile, the number
+    of steps to the nearest tile of that address. Fields are computed on 
+    first use and kept in a bounded LRU cache. 
+
+    INPUT
+      address: A key of self.address_tiles. 
+        e.g., "the Ville:Hobbs Cafe:cafe"
+    OUTPUT
+      A (maze_height, maze_width) numpy uint16 array, accessed by [y][x]. 
+      Tiles that cannot reach the address hold path_finder.UNREACHABLE.
+    """
+    if address in self.distance_fields: 
+      self.distance_fields.move_to_end(address)
+      return self.distance_fields[address]
+    sources = [(y, x) for x, y in self.address_tiles[address]]
+    field = distance_field(self.collision_grid, sources)
+    self.distance_fields[address] = field
+    while len(self.distance_fields) > self.max_distance_fields: 
+      self.distance_fields.popitem(last=False)
+    return field
+
+
+  def path_to_address(self, start, address, avoid=None): 
+    """
+    Returns the shortest path from <start> to the nearest tile of <address>,
+    by following the address's distance field downhill (no search). 
+
+    INPUT
+      start: The tile coordinate we start from, in (x, y) form.
+      address: A key of self.address_tiles. 
+      avoid: Optional function that takes an (x, y) tile and returns True if
+             we should rather not end up there (e.g., another persona is 
+             standing on it). If the nearest tile is to be avoided, we walk 
+             on to the closest tile of the address that is not. 
+    OUTPUT
+      A list of (x, y) tiles from <start> to the chosen tile of the address.
+      If the address cannot be reached, [start]. 
+    """
+    field = self.address_distance_field(address)
+    path = descend_distance_field(field, (start[1], start[0]))
+    if path is None: 
+      return [tuple(start)]
+    path = [(x, y) for y, x in path]
+    if avoid and avoid(path[-1]): 
+      path += self._step_aside(path[-1], address, avoid)
+    return path
+
+
+  def _step_aside(self, tile, address, avoid): 
+    # Breadth-first search over the tiles of <address> for the nearest one
+    # that <avoid> does not reject. Returns the steps after <tile>, or [] if
+    # every tile of the address is to be avoided.
+    tiles = self.address_tiles[address]
+    parent = {tile: None}
+    frontier = [tile]
+    while frontier: 
+      next_frontier = []
+      for x, y in frontier: 
+        for t in ((x, y - 1), (x - 1, y), (x, y + 1), (x + 1, y)): 
+          if (t in parent or t not in tiles 
+              or self.collision_grid[t[1]][t[0]]): 
+            continue
+          parent[t] = (x, y)
+          if not avoid(t): 
+            steps = []
+            while t != tile: 
+              steps += [t]
+              t = parent[t]
+            return steps[::-1]
+          next_frontier += [t]
+      frontier = next_frontier
+    return []
+
+
+  def set_collision(self, tile, collision): 
+    """
+    Makes a tile a collision block, or clears one (e.g., a door that is 
+    locked at night). Paths and distance fields computed before the change
+    may be wrong now, so we bump <collision_version> and drop the distance
+    fields. 
+
+    INPUT
+      tile: The tile coordinate of our interest in (x, y) form.
+      collision: True to block the tile, False to open it. 
+    OUTPUT
+      None
+    """
+    x = tile[0]
+    y = tile[1]
+    if collision: 
+      self.collision_maze[y][x] = collision_block_id
+    else: 
+      self.collision_maze[y][x] = "0"
+    self.collision_grid[y][x] = bool(collision)
+    self.collision_version += 1
+    self.distance_fields.clear()
 
 
   def add_event_from_tile(self, curr_event, tile): 
@@ -336,7 +593,50 @@ class Maze:
     OUPUT: 
       None
     """
-    self.tiles[tile[1]][tile[0]]["events"].add(curr_event)
+    key = (tile[0], tile[1])
+    if key not in self.tile_events: 
+      self.tile_events[key] = set()
+      arena_key = self._event_cell_key(key)
+      if arena_key not in self.arena_event_tiles: 
+        self.arena_event_tiles[arena_key] = set()
+      self.arena_event_tiles[arena_key].add(key)
+    if curr_event in self.tile_events[key]: 
+      return
+    self.tile_events[key].add(curr_event)
+
+    if curr_event not in self.event_tiles: 
+      self.event_tiles[curr_event] = set()
+    self.event_tiles[curr_event].add(key)
+
+    subject = curr_event[0]
+    if subject not in self.subject_tiles: 
+      self.subject_tiles[subject] = dict()
+    if key not in self.subject_tiles[subject]: 
+      self.subject_tiles[subject][key] = set()
+    self.subject_tiles[subject][key].add(curr_event)
+
+
+  def _drop_event(self, curr_event, key): 
+    # Removes <curr_event>, which must be on tile <key>, from the tile and 
+    # from every index, dropping entries that become empty. 
+    self.tile_events[key].remove(curr_event)
+    if not self.tile_events[key]: 
+      del self.tile_events[key]
+      arena_key = self._event_cell_key(key)
+      self.arena_event_tiles[arena_key].remove(key)
+      if not self.arena_event_tiles[arena_key]: 
+        del self.arena_event_tiles[arena_key]
+
+    self.event_tiles[curr_event].remove(key)
+    if not self.event_tiles[curr_event]: 
+      del self.event_tiles[curr_event]
+
+    subject = curr_event[0]
+    self.subject_tiles[subject][key].remove(curr_event)
+    if not self.subject_tiles[subject][key]: 
+      del self.subject_tiles[subject][key]
+      if not self.subject_tiles[subject]: 
+        del self.subject_tiles[subject]
 
 
   def remove_event_from_tile(self, curr_event, tile):
@@ -351,19 +651,17 @@ class Maze:
     OUPUT: 
       None
     """
-    curr_tile_ev_cp = self.tiles[tile[1]][tile[0]]["events"].copy()
-    for event in curr_tile_ev_cp: 
-      if event == curr_event:  
-        self.tiles[tile[1]][tile[0]]["events"].remove(event)
+    key = (tile[0], tile[1])
+    if curr_event in self.tile_events.get(key, NO_EVENTS): 
+      self._drop_event(curr_event, key)
 
 
   def turn_event_from_tile_idle(self, curr_event, tile):
-    curr_tile_ev_cp = self.tiles[tile[1]][tile[0]]["events"].copy()
-    for event in curr_tile_ev_cp: 
-      if event == curr_event:  
-        self.tiles[tile[1]][tile[0]]["events"].remove(event)
-        new_event = (event[0], None, None, None)
-        self.tiles[tile[1]][tile[0]]["events"].add(new_event)
+    key = (tile[0], tile[1])
+    if curr_event in self.tile_events.get(key, NO_EVENTS): 
+      self._drop_event(curr_event, key)
+      new_event = (curr_event[0], None, None, None)
+      self.add_event_from_tile(new_event, key)
 
 
   def remove_subject_events_from_tile(self, subject, tile):
@@ -376,41 +674,7 @@ class Maze:
     OUPUT: 
       None
     """
-    curr_tile_ev_cp = self.tiles[tile[1]][tile[0]]["events"].copy()
-    for event in curr_tile_ev_cp: 
-      if event[0] == subject:  
-        self.tiles[tile[1]][tile[0]]["events"].remove(event)
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
+    key = (tile[0], tile[1])
+    events = self.subject_tiles.get(subject, dict()).get(key, NO_EVENTS)
+    for event in list(events): 
+      self._drop_event(event, key)
@@ -5,6 +5,8 @@ File: path_finder.py
 Description: Implements various path finding functions for generative agents.
 Some of the functions are defunct. 
 """
+from collections import OrderedDict, deque
+
 import numpy as np
 
 def print_maze(maze):
@@ -93,75 +95,215 @@ def path_finder_v1(maze, start, end, collision_block_char, verbose=False):
   return path
 
 
-def path_finder_v2(a, start, end, collision_block_char, verbose=False):
-  def make_step(m, k):
-    for i in range(len(m)):
-      for j in range(len(m[i])):
-        if m[i][j] == k:
-          if i>0 and m[i-1][j] == 0 and a[i-1][j] == 0:
-            m[i-1][j] = k + 1
-          if j>0 and m[i][j-1] == 0 and a[i][j-1] == 0:
-            m[i][j-1] = k + 1
-          if i<len(m)-1 and m[i+1][j] == 0 and a[i+1][j] == 0:
-            m[i+1][j] = k + 1
-          if j<len(m[i])-1 and m[i][j+1] == 0 and a[i][j+1] == 0:
-             m[i][j+1] = k + 1
+def occupancy_grid(maze, collision_block_char):
+  """
+  Turns a collision maze (a list of rows of block ids) into a NumPy boolean
+  grid that is True on collision blocks. Maze builds this once, so that path
+  finding does not have to re-scan the collision maze on every call.
 
-  new_maze = []
-  for row in a: 
-    new_row = []
-    for j in row:
-      if j == collision_block_char: 
-        new_row += [1]
-      else: 
-        new_row += [0]
-    new_maze += [new_row]
-  a = new_maze
-
-  m = []
-  for i in range(len(a)):
-      m.append([])
-      for j in range(len(a[i])):
-          m[-1].append(0)
-  i,j = start
-  m[i][j] = 1 
-
-  k = 0
-  except_handle = 150
-  while m[end[0]][end[1]] == 0:
-      k += 1
-      make_step(m, k)
-
-      if except_handle == 0: 
-        break
-      except_handle -= 1 
+  INPUT
+    maze: A 2-d list (or array) of block ids, accessed by [row][col].
+    collision_block_char: The block id of collision blocks.
+  OUTPUT
+    A (height, width) numpy bool array.
+  """
+  return np.array(maze, dtype=object) == collision_block_char
 
-  i, j = end
-  k = m[i][j]
-  the_path = [(i,j)]
+
+def path_finder_v2(a, start, end, collision_block_char, verbose=False):
+  # Breadth-first search from <start>, with a queue as the frontier. This
+  # used to grow the wavefront by scanning the whole grid once per step (and
+  # gave up after 150 steps); the labels are the same, so the path is too.
+  # <a> may be the collision maze itself or its occupancy_grid().
+  if isinstance(a, np.ndarray) and a.dtype == bool:
+    blocked = a
+  else:
+    blocked = occupancy_grid(a, collision_block_char)
+  height, width = blocked.shape
+
+  # We search over a flat copy of the grid with a blocked border around it,
+  # so the neighbors of tile p are p - w, p - 1, p + w and p + 1 with no
+  # bounds checks. Python lists are much faster than numpy for this kind of
+  # one-element-at-a-time access.
+  w = width + 2
+  free = (~np.pad(blocked, 1, constant_values=True)).ravel().tolist()
+  source = (start[0] + 1) * w + start[1] + 1
+  target = (end[0] + 1) * w + end[1] + 1
+
+  # m[p] is the number of steps from <start> to p plus one, and 0 for tiles
+  # we have not reached (as in the wavefront version).
+  m = [0] * len(free)
+  m[source] = 1
+  frontier = deque([source])
+  while frontier and not m[target]:
+    p = frontier.popleft()
+    k = m[p] + 1
+    for q in (p - w, p - 1, p + w, p + 1):
+      if free[q] and not m[q]:
+        m[q] = k
+        frontier.append(q)
+
+  # Walking back from <end>, we prefer up, left, down, right, as before. An
+  # unreachable <end> gives [end].
+  p = target
+  k = m[p]
+  the_path = [p]
   while k > 1:
-    if i > 0 and m[i - 1][j] == k-1:
-      i, j = i-1, j
-      the_path.append((i, j))
-      k-=1
-    elif j > 0 and m[i][j - 1] == k-1:
-      i, j = i, j-1
-      the_path.append((i, j))
-      k-=1
-    elif i < len(m) - 1 and m[i + 1][j] == k-1:
-      i, j = i+1, j
-      the_path.append((i, j))
-      k-=1
-    elif j < len(m[i]) - 1 and m[i][j + 1] == k-1:
-      i, j = i, j+1
-      the_path.append((i, j))
-      k -= 1
-        
+    for q in (p - w, p - 1, p + w, p + 1):
+      if m[q] == k - 1:
+        p = q
+        break
+    the_path.append(p)
+    k -= 1
+
   the_path.reverse()
-  return the_path
+  return [(p // w - 1, p % w - 1) for p in the_path]
+
+
+# The distance we store for tiles that cannot reach (or be reached from) the
+# sources of a distance field.
+UNREACHABLE = np.iinfo(np.uint16).max
+
+
+def distance_field(blocked, sources):
+  """
+  Multi-source breadth-first search: the number of steps from every tile to
+  the nearest of <sources>. Collision blocks are never entered, and sources
+  that are collision blocks are ignored.
+
+  INPUT
+    blocked: An occupancy_grid() (True on collision blocks).
+    sources: An iterable of (row, col) tiles.
+  OUTPUT
+    A (height, width) numpy uint16 array; UNREACHABLE where no source can be
+    reached.
+  """
+  height, width = blocked.shape
+  w = width + 2
+  free = (~np.pad(blocked, 1, constant_values=True)).ravel().tolist()
+  dist = [-1] * len(free)
+  frontier = deque()
+  for i, j in sources:
+    p = (i + 1) * w + j + 1
+    if free[p] and dist[p] < 0:
+      dist[p] = 0
+      frontier.append(p)
+  while frontier:
+    p = frontier.popleft()
+    k = dist[p] + 1
+    for q in (p - w, p - 1, p + w, p + 1):
+      if free[q] and dist[q] < 0:
+        dist[q] = k
+        frontier.append(q)
+
+  field = np.array(dist, dtype=np.int64).reshape(height + 2, w)[1:-1, 1:-1]
+  field[(field < 0) | (field > UNREACHABLE)] = UNREACHABLE
+  return field.astype(np.uint16)
+
+
+def descend_distance_field(field, start):
+  """
+  Follows a distance_field() downhill from <start> to one of its sources.
+  Each step costs O(1), so this is O(path length), with no search. Like
+  path_finder_v2, we may start on a collision block.
+
+  INPUT
+    field: A distance_field().
+    start: A (row, col) tile.
+  OUTPUT
+    The path as a list of (row, col) tiles from <start> to a source, or None
+    if no source can be reached from <start>.
+  """
+  height, width = field.shape
+
+  def neighbors(i, j):
+    # Up, left, down, right, the order path_finder_v2 prefers.
+    for ni, nj in ((i - 1, j), (i, j - 1), (i + 1, j), (i, j + 1)):
+      if 0 <= ni < height and 0 <= nj < width:
+        yield ni, nj
+
+  i, j = start
+  k = int(field[i, j])
+  if k == UNREACHABLE:
+    # <start> itself is blocked; step onto its nearest free neighbor.
+    options = [(int(field[t]), t) for t in neighbors(i, j)]
+    options = [o for o in options if o[0] != UNREACHABLE]
+    if not options:
+      return None
+    k, (ni, nj) = min(options, key=lambda o: o[0])
+    path = [(i, j), (ni, nj)]
+    i, j = ni, nj
+  else:
+    path = [(i, j)]
+  while k > 0:
+    for ni, nj in neighbors(i, j):
+      if field[ni, nj] == k - 1:
+        i, j = ni, nj
+        break
+    path.append((i, j))
+    k -= 1
+  return path
 
 
-def path_finder(maze, start, end, collision_block_char, verbose=False):
+class PathCache:
+  """
+  A bounded LRU cache of path_finder results, keyed by (start, end). Many
+  personas walk the same routes every day, and execute() asks for the same
+  path more than once when two personas meet. 
+
+  Every lookup comes with the version of the collision maze (see 
+  Maze.collision_version). When the version changes, the cached paths are
+  stale and we drop all of them.
+  """
+  def __init__(self, max_entries=4096):
+    self.max_entries = max_entries
+    self.version = 0
+    self.paths = OrderedDict()
+    # Counters, for tuning max_entries.
+    self.hits = 0
+    self.misses = 0
+
+
+  def get(self, start, end, version):
+    """
+    Returns a copy of the cached path from <start> to <end>, or None.
+    """
+    if version != self.version:
+      self.paths.clear()
+      self.version = version
+    key = (tuple(start), tuple(end))
+    path = self.paths.get(key)
+    if path is None:
+      self.misses += 1
+      return None
+    self.hits += 1
+    self.paths.move_to_end(key)
+    return list(path)
+
+
+  def put(self, start, end, version, path):
+    if version != self.version:
+      return
+    self.paths[(tuple(start), tuple(end))] = tuple(path)
+    while len(self.paths) > self.max_entries:
+      self.paths.popitem(last=False)
+
+
+  def hit_rate(self):
+    total = self.hits + self.misses
+    return self.hits / total if total else 0.0
+
+
+def path_finder(maze, start, end, collision_block_char, verbose=False,
+                cache=None, version=0):
+  # <cache> is an optional PathCache, and <version> the version of <maze>
+  # that it is checked against.
+  if cache is not None:
+    path = cache.get(start, end, version)
+    if path is not None:
+      return path
+  orig_start, orig_end = start, end
+
   # EMERGENCY PATCH
   start = (start[1], start[0])
   end = (end[1], end[0])
@@ -173,7 +315,9 @@ def path_finder(maze, start, end, collision_block_char, verbose=False):
   for i in path: 
     new_path += [(i[1], i[0])]
   path = new_path
-  
+
+  if cache is not None:
+    cache.put(orig_start, orig_end, version, path)
   return path
 
 
@@ -17,6 +17,7 @@ from persona.memory_structures.associative_memory import *
 from persona.memory_structures.scratch import *
 from persona.cognitive_modules.retrieve import *
 from persona.prompt_template.run_gpt_prompt import *
+from persona.prompt_template.llm_cache import LLMCacheMiss
 
 def generate_agent_chat_summarize_ideas(init_persona, 
                                         target_persona, 
@@ -34,6 +35,8 @@ def generate_agent_chat_summarize_ideas(init_persona,
     summarized_idea = run_gpt_prompt_agent_chat_summarize_ideas(init_persona,
                         target_persona, all_embedding_key_str, 
                         curr_context)[0]
+  except LLMCacheMiss:
+    raise
   except:
     summarized_idea = ""
   return summarized_idea
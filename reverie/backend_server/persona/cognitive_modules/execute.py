@@ -41,6 +41,8 @@ def execute(persona, maze, personas, plan):
     # <target_tiles> is a list of tile coordinates where the persona may go 
     # to execute the current action. The goal is to pick one of them.
     target_tiles = None
+    # <path> is the path to the chosen target tile, once we have one. 
+    path = None
 
     print ('aldhfoaf/????')
     print (plan)
@@ -49,21 +51,27 @@ def execute(persona, maze, personas, plan):
       # Executing persona-persona interaction.
       target_p_tile = (personas[plan.split("<persona>")[-1].strip()]
                        .scratch.curr_tile)
-      potential_path = path_finder(maze.collision_maze, 
+      potential_path = path_finder(maze.collision_grid, 
                                    persona.scratch.curr_tile, 
                                    target_p_tile, 
-                                   collision_block_id)
+                                   collision_block_id, 
+                                   cache=maze.path_cache, 
+                                   version=maze.collision_version)
       if len(potential_path) <= 2: 
         target_tiles = [potential_path[0]]
       else: 
-        potential_1 = path_finder(maze.collision_maze, 
+        potential_1 = path_finder(maze.collision_grid, 
                                 persona.scratch.curr_tile, 
                                 potential_path[int(len(potential_path)/2)], 
-                                collision_block_id)
-        potential_2 = path_finder(maze.collision_maze, 
+                                collision_block_id, 
+                                cache=maze.path_cache, 
+                                version=maze.collision_version)
+        potential_2 = path_finder(maze.collision_grid, 
                                 persona.scratch.curr_tile, 
                                 potential_path[int(len(potential_path)/2)+1], 
-                                collision_block_id)
+                                collision_block_id, 
+                                cache=maze.path_cache, 
+                                version=maze.collision_version)
         if len(potential_1) <= len(potential_2): 
           target_tiles = [potential_path[int(len(potential_path)/2)]]
         else: 
@@ -91,54 +99,65 @@ def execute(persona, maze, personas, plan):
       if plan not in maze.address_tiles: 
         maze.address_tiles["Johnson Park:park:park garden"] #ERRORRRRRRR
       else: 
-        target_tiles = maze.address_tiles[plan]
-
-    # There are sometimes more than one tile returned from this (e.g., a tabe
-    # may stretch many coordinates). So, we sample a few here. And from that 
-    # random sample, we will take the closest ones. 
-    if len(target_tiles) < 4: 
-      target_tiles = random.sample(list(target_tiles), len(target_tiles))
-    else:
-      target_tiles = random.sample(list(target_tiles), 4)
-    # If possible, we want personas to occupy different tiles when they are 
-    # headed to the same location on the maze. It is ok if they end up on the 
-    # same time, but we try to lower that probability. 
-    # We take care of that overlap here.  
-    persona_name_set = set(personas.keys())
-    new_target_tiles = []
-    for i in target_tiles: 
-      curr_event_set = maze.access_tile(i)["events"]
-      pass_curr_tile = False
-      for j in curr_event_set: 
-        if j[0] in persona_name_set: 
-          pass_curr_tile = True
-      if not pass_curr_tile: 
-        new_target_tiles += [i]
-    if len(new_target_tiles) == 0: 
-      new_target_tiles = target_tiles
-    target_tiles = new_target_tiles
-
-    # Now that we've identified the target tile, we find the shortest path to
-    # one of the target tiles. 
-    curr_tile = persona.scratch.curr_tile
-    collision_maze = maze.collision_maze
-    closest_target_tile = None
-    path = None
-    for i in target_tiles: 
-      # path_finder takes a collision_mze and the curr_tile coordinate as 
-      # an input, and returns a list of coordinate tuples that becomes the
-      # path. 
-      # e.g., [(0, 1), (1, 1), (1, 2), (1, 3), (1, 4)...]
-      curr_path = path_finder(maze.collision_maze, 
-                              curr_tile, 
-                              i, 
-                              collision_block_id)
-      if not closest_target_tile: 
-        closest_target_tile = i
-        path = curr_path
-      elif len(curr_path) < len(path): 
-        closest_target_tile = i
-        path = curr_path
+        # The maze keeps a distance field for each address, so we can walk
+        # straight to the nearest tile of the address without searching. As
+        # below, we try not to end up on a tile where another persona is. 
+        persona_name_set = set(personas.keys())
+        def occupied(tile): 
+          for j in maze.access_tile(tile)["events"]: 
+            if j[0] in persona_name_set: 
+              return True
+          return False
+        path = maze.path_to_address(persona.scratch.curr_tile, plan, 
+                                    occupied)
+
+    if path is None: 
+      # There are sometimes more than one tile returned from this (e.g., a tabe
+      # may stretch many coordinates). So, we sample a few here. And from that 
+      # random sample, we will take the closest ones. 
+      if len(target_tiles) < 4: 
+        target_tiles = random.sample(list(target_tiles), len(target_tiles))
+      else:
+        target_tiles = random.sample(list(target_tiles), 4)
+      # If possible, we want personas to occupy different tiles when they are 
+      # headed to the same location on the maze. It is ok if they end up on the 
+      # same time, but we try to lower that probability. 
+      # We take care of that overlap here.  
+      persona_name_set = set(personas.keys())
+      new_target_tiles = []
+      for i in target_tiles: 
+        curr_event_set = maze.access_tile(i)["events"]
+        pass_curr_tile = False
+        for j in curr_event_set: 
+          if j[0] in persona_name_set: 
+            pass_curr_tile = True
+        if not pass_curr_tile: 
+          new_target_tiles += [i]
+      if len(new_target_tiles) == 0: 
+        new_target_tiles = target_tiles
+      target_tiles = new_target_tiles
+
+      # Now that we've identified the target tile, we find the shortest path to
+      # one of the target tiles. 
+      curr_tile = persona.scratch.curr_tile
+      closest_target_tile = None
+      for i in target_tiles: 
+        # path_finder takes a collision_mze and the curr_tile coordinate as 
+        # an input, and returns a list of coordinate tuples that becomes the
+        # path. 
+        # e.g., [(0, 1), (1, 1), (1, 2), (1, 3), (1, 4)...]
+        curr_path = path_finder(maze.collision_grid, 
+                                curr_tile, 
+                                i, 
+                                collision_block_id, 
+                                cache=maze.path_cache, 
+                                version=maze.collision_version)
+        if not closest_target_tile: 
+          closest_target_tile = i
+          path = curr_path
+        elif len(curr_path) < len(path): 
+          closest_target_tile = i
+          path = curr_path
 
     # Actually setting the <planned_path> and <act_path_set>. We cut the 
     # first element in the planned_path because it includes the curr_tile. 
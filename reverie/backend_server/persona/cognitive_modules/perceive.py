@@ -7,6 +7,7 @@ Description: This defines the "Perceive" module for generative agents.
 import sys
 sys.path.append('../../')
 
+from concurrent.futures import ThreadPoolExecutor
 from operator import itemgetter
 from global_methods import *
 from persona.prompt_template.gpt_structure import *
@@ -22,6 +23,76 @@ def generate_poig_score(persona, event_type, description):
     return run_gpt_prompt_chat_poignancy(persona, 
                            persona.scratch.act_description)[0]
 
+
+def generate_poig_scores(requests):
+  """
+  Rates the poignancy of many (persona, event_type, description) requests at
+  once, possibly for different personas.
+
+  Idle events are 1, as in generate_poig_score. The remaining requests are
+  grouped by persona: a persona with several pending scores gets one
+  multi-item prompt (run_gpt_prompt_poignancy_batch), and a persona with
+  a single one gets the usual single-item prompt. The prompts of the
+  different personas are sent concurrently, so the whole set resolves in
+  about one round trip. Any item that the batch response left without a
+  valid score falls back to its own single-item prompt.
+
+  INPUT:
+    requests: a list of (persona, event_type, description), where event_type
+              is "event", "thought" or "chat".
+  OUTPUT:
+    a list of int scores, one per request, in order.
+  """
+  scores = [None] * len(requests)
+  groups = dict()
+  for count, (persona, event_type, description) in enumerate(requests):
+    if "is idle" in description:
+      scores[count] = 1
+    else:
+      groups.setdefault(id(persona), []).append(count)
+
+  def single(count):
+    persona, event_type, description = requests[count]
+    if event_type == "chat":
+      # Same as generate_poig_score: a chat is rated on the persona's
+      # current chat action.
+      return generate_poig_score(persona, "chat", description)
+    return generate_poig_score(persona, "event", description)
+
+  def batch(counts):
+    persona = requests[counts[0]][0]
+    items = [requests[count][1:] for count in counts]
+    return run_gpt_prompt_poignancy_batch(persona, items)[0]
+
+  def rate(counts):
+    if len(counts) == 1:
+      return [single(counts[0])]
+    return batch(counts)
+
+  if not groups:
+    return scores
+
+  # perceive and reflect rate the items of a single persona, which is one
+  # call: only several personas get a pool to run their prompts in.
+  ex = None
+  if len(groups) > 1:
+    ex = ThreadPoolExecutor(max_workers=min(len(groups), 8))
+  run = ex.map if ex else map
+  try:
+    for counts, result in zip(groups.values(), run(rate, groups.values())):
+      for count, score in zip(counts, result):
+        scores[count] = score
+
+    # Per-item fallback for the scores the batch responses did not give us.
+    missing = [count for count, score in enumerate(scores) if score is None]
+    for count, score in zip(missing, run(single, missing)):
+      scores[count] = score
+  finally:
+    if ex:
+      ex.shutdown()
+  return scores
+
+
 def perceive(persona, maze): 
   """
   Perceives events around the persona and saves it to the memory, both events 
@@ -41,58 +112,36 @@ def perceive(persona, maze):
     ret_events: a list of <ConceptNode> that are perceived and new. 
   """
   # PERCEIVE SPACE
-  # We get the nearby tiles given our current tile and the persona's vision
-  # radius. 
-  nearby_tiles = maze.get_nearby_tiles(persona.scratch.curr_tile, 
-                                       persona.scratch.vision_r)
+  # We get the distinct places (world, sector, arena, game object) within 
+  # the persona's vision radius of its current tile. The maze works this out
+  # on its tile layer arrays, and skips the tiles that the persona has 
+  # already explored (their places are in the spatial memory already). 
 
   # We then store the perceived space. Note that the s_mem of the persona is
   # in the form of a tree constructed using dictionaries. 
-  for i in nearby_tiles: 
-    i = maze.access_tile(i)
-    if i["world"]: 
-      if (i["world"] not in persona.s_mem.tree): 
-        persona.s_mem.tree[i["world"]] = {}
-    if i["sector"]: 
-      if (i["sector"] not in persona.s_mem.tree[i["world"]]): 
-        persona.s_mem.tree[i["world"]][i["sector"]] = {}
-    if i["arena"]: 
-      if (i["arena"] not in persona.s_mem.tree[i["world"]]
-                                              [i["sector"]]): 
-        persona.s_mem.tree[i["world"]][i["sector"]][i["arena"]] = []
-    if i["game_object"]: 
-      if (i["game_object"] not in persona.s_mem.tree[i["world"]]
-                                                    [i["sector"]]
-                                                    [i["arena"]]): 
-        persona.s_mem.tree[i["world"]][i["sector"]][i["arena"]] += [
-                                                             i["game_object"]]
+  explored = persona.s_mem.get_explored(maze.maze_height, maze.maze_width)
+  nearby_spaces = maze.get_nearby_spaces(persona.scratch.curr_tile, 
+                                         persona.scratch.vision_r, explored)
+  for world, sector, arena, game_object in nearby_spaces: 
+    persona.s_mem.add_place(world, sector, arena, game_object)
 
   # PERCEIVE EVENTS. 
   # We will perceive events that take place in the same arena as the
-  # persona's current arena. 
-  curr_arena_path = maze.get_tile_path(persona.scratch.curr_tile, "arena")
+  # persona's current arena. The maze hands us the event sets of the nearby
+  # tiles in that arena, along with their distance from the persona, closest
+  # first. 
   # We do not perceive the same event twice (this can happen if an object is
   # extended across multiple tiles).
   percept_events_set = set()
   # We will order our percept based on the distance, with the closest ones
   # getting priorities. 
   percept_events_list = []
-  # First, we put all events that are occuring in the nearby tiles into the
-  # percept_events_list
-  for tile in nearby_tiles: 
-    tile_details = maze.access_tile(tile)
-    if tile_details["events"]: 
-      if maze.get_tile_path(tile, "arena") == curr_arena_path:  
-        # This calculates the distance between the persona's current tile, 
-        # and the target tile.
-        dist = math.dist([tile[0], tile[1]], 
-                         [persona.scratch.curr_tile[0], 
-                          persona.scratch.curr_tile[1]])
-        # Add any relevant events to our temp set/list with the distant info. 
-        for event in tile_details["events"]: 
-          if event not in percept_events_set: 
-            percept_events_list += [[dist, event]]
-            percept_events_set.add(event)
+  for dist, events in maze.get_nearby_arena_events(persona.scratch.curr_tile,
+                                                   persona.scratch.vision_r): 
+    for event in events: 
+      if event not in percept_events_set: 
+        percept_events_list += [[dist, event]]
+        percept_events_set.add(event)
 
   # We sort, and perceive only persona.scratch.att_bandwidth of the closest
   # events. If the bandwidth is larger, then it means the persona can perceive
@@ -158,6 +207,15 @@ def perceive(persona, maze):
   else:
     embed_map = {}
 
+  # Rate the poignancy of all the new events (and of the chat, if the persona
+  # is in one) in one round trip, rather than one prompt per event.
+  poig_requests = []
+  for s, p, o, desc, desc_embedding_in, keywords, p_event in new_events:
+    poig_requests += [(persona, "event", desc_embedding_in)]
+    if p_event[0] == f"{persona.name}" and p_event[1] == "chat with":
+      poig_requests += [(persona, "chat", persona.scratch.act_description)]
+  poig_scores = iter(generate_poig_scores(poig_requests))
+
   # Second pass: create memory entries with pre-fetched embeddings
   ret_events = []
   for s, p, o, desc, desc_embedding_in, keywords, p_event in new_events:
@@ -169,7 +227,7 @@ def perceive(persona, maze):
       event_embedding = get_embedding(desc_embedding_in)
     event_embedding_pair = (desc_embedding_in, event_embedding)
 
-    event_poignancy = generate_poig_score(persona, "event", desc_embedding_in)
+    event_poignancy = next(poig_scores)
 
     chat_node_ids = []
     if p_event[0] == f"{persona.name}" and p_event[1] == "chat with":
@@ -183,8 +241,7 @@ def perceive(persona, maze):
         chat_embedding = get_embedding(persona.scratch.act_description)
       chat_embedding_pair = (persona.scratch.act_description,
                              chat_embedding)
-      chat_poignancy = generate_poig_score(persona, "chat",
-                                           persona.scratch.act_description)
+      chat_poignancy = next(poig_scores)
       chat_node = persona.a_mem.add_chat(persona.scratch.curr_time, None,
                     curr_event[0], curr_event[1], curr_event[2],
                     persona.scratch.act_description, keywords,
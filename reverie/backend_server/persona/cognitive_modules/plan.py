@@ -6,6 +6,7 @@ Description: This defines the "Plan" module for generative agents.
 """
 import datetime
 import math
+import os
 import random
 import sys
 import time
@@ -14,6 +15,7 @@ sys.path.append('../../')
 
 from global_methods import *
 from persona.prompt_template.run_gpt_prompt import *
+from persona.prompt_template.llm_cache import LLMCacheMiss
 from persona.cognitive_modules.retrieve import *
 from persona.cognitive_modules.converse import *
 
@@ -138,7 +140,7 @@ def generate_hourly_schedule(persona, wake_up_hour):
   return n_m1_hourly_compressed
 
 
-def generate_task_decomp(persona, task, duration): 
+def generate_task_decomp(persona, task, duration, org_index=None): 
   """
   A few shot decomposition of a task given the task description 
 
@@ -150,6 +152,8 @@ def generate_task_decomp(persona, task, duration):
           (e.g., "waking up and starting her morning routine")
     duration: an integer that indicates the number of minutes this task is 
               meant to last (e.g., 60)
+    org_index: the index of the hourly schedule block to treat as the current
+               one in the prompt; by default, the block of the current time.
   OUTPUT: 
     a list of list where the inner list contains the decomposed task 
     description and the number of minutes the task is supposed to last. 
@@ -161,7 +165,8 @@ def generate_task_decomp(persona, task, duration):
 
   """
   if debug: print ("GNS FUNCTION: <generate_task_decomp>")
-  return run_gpt_prompt_task_decomp(persona, task, duration)[0]
+  return run_gpt_prompt_task_decomp(persona, task, duration,
+                                    org_index=org_index)[0]
 
 
 def generate_action_sector(act_desp, persona, maze): 
@@ -241,6 +246,8 @@ def generate_action_pronunciatio(act_desp, persona):
   if debug: print ("GNS FUNCTION: <generate_action_pronunciatio>")
   try: 
     x = run_gpt_prompt_pronunciatio(act_desp, persona)[0]
+  except LLMCacheMiss: 
+    raise
   except: 
     x = "🙂"
 
@@ -496,6 +503,7 @@ def _long_term_planning(persona, new_day):
                                                               wake_up_hour)
   persona.scratch.f_daily_schedule_hourly_org = (persona.scratch
                                                    .f_daily_schedule[:])
+  _decompose_day_ahead(persona)
 
 
   # Added March 4 -- adding plan to the memory.
@@ -519,6 +527,223 @@ def _long_term_planning(persona, new_day):
 
 
 
+def determine_decomp(act_desp, act_dura):
+  """
+  Given an action description and its duration, we determine whether we need
+  to decompose it. If the action is about the agent sleeping, we generally
+  do not want to decompose it, so that's what we catch here. 
+
+  INPUT: 
+    act_desp: the description of the action (e.g., "sleeping")
+    act_dura: the duration of the action in minutes. 
+  OUTPUT: 
+    a boolean. True if we need to decompose, False otherwise. 
+  """
+  if "sleep" not in act_desp and "bed" not in act_desp: 
+    return True
+  elif "sleeping" in act_desp or "asleep" in act_desp or "in bed" in act_desp:
+    return False
+  elif "sleep" in act_desp or "bed" in act_desp: 
+    if act_dura > 60: 
+      return False
+  return True
+
+
+def _decomp_ahead_enabled(): 
+  return os.getenv("DECOMP_AHEAD", "off").strip().lower() == "on"
+
+
+def _decompose_day_ahead(persona): 
+  """
+  With DECOMP_AHEAD=on, starts decomposing every block of today's hourly 
+  schedule that _determine_action would decompose, all at once in a 
+  background pool, right after the schedule is made. _determine_action then
+  takes these results (see _task_decomp) instead of waiting for a 
+  decomposition prompt an hour or two before each block. 
+
+  The prompt of each block is made as if it were the hour before the block
+  (org_index is the block before it), which is when _determine_action 
+  usually decomposes it. The first block of the day is left out: it has no
+  block before it, and _determine_action decomposes it right away anyway. 
+
+  INPUT
+    persona: Current <Persona> instance, with its new hourly schedule. 
+  """
+  persona.scratch.decomp_ahead = dict()
+  if not _decomp_ahead_enabled(): 
+    return
+  blocks = [(count, act_desp, act_dura) for count, (act_desp, act_dura) 
+            in enumerate(persona.scratch.f_daily_schedule_hourly_org)
+            if count > 0 and act_dura >= 60 
+            and determine_decomp(act_desp, act_dura)]
+  if not blocks: 
+    return
+
+  ex = ThreadPoolExecutor(max_workers=min(len(blocks), 8))
+  for count, act_desp, act_dura in blocks: 
+    future = ex.submit(generate_task_decomp, persona, act_desp, act_dura, 
+                       count - 1)
+    persona.scratch.decomp_ahead.setdefault((act_desp, act_dura), []).append(
+      future)
+  # We do not wait; the pool's threads exit once they are done. 
+  ex.shutdown(wait=False)
+
+
+def _task_decomp(persona, act_desp, act_dura): 
+  """
+  Returns generate_task_decomp(persona, act_desp, act_dura), using the 
+  decomposition started at the start of the day (DECOMP_AHEAD) if there is 
+  one. A block that appears twice in a day takes its decompositions in 
+  order. 
+  """
+  if _decomp_ahead_enabled(): 
+    futures = persona.scratch.decomp_ahead.get((act_desp, act_dura))
+    if futures: 
+      try: 
+        return futures.pop(0).result()
+      except Exception as e: 
+        print ("DECOMP_AHEAD failed, decomposing again:", e)
+  return generate_task_decomp(persona, act_desp, act_dura)
+
+
+def _resolve_object(act_desp, act_address, persona, maze): 
+  """
+  Chooses the game object at <act_address> for the action, and describes 
+  the object's state during the action. 
+
+  OUTPUT: 
+    (act_game_object, act_obj_desp), e.g., ("bed", "being slept in")
+  """
+  act_game_object = generate_action_game_object(act_desp, act_address,
+                                                persona, maze)
+  act_obj_desp = generate_act_obj_desc(act_game_object, act_desp, persona)
+  return act_game_object, act_obj_desp
+
+
+def _speculative_addresses(persona, maze, act_world, n): 
+  """
+  Returns up to <n> "world:sector:arena" addresses where the persona is 
+  likely to do its next action: where it is now, where its last action took
+  place, and where it lives. Only the addresses in its spatial memory are 
+  kept, since the sector and arena prompts only offer those. 
+  """
+  curr_tile = maze.access_tile(persona.scratch.curr_tile)
+  guesses = [f"{act_world}:{curr_tile['sector']}:{curr_tile['arena']}",
+             persona.scratch.act_address or "",
+             persona.scratch.living_area or ""]
+  addresses = []
+  for address in guesses: 
+    world, sector, arena = (address.split(":") + ["", "", ""])[:3]
+    if world != act_world: 
+      continue
+    if arena not in persona.s_mem.tree.get(world, {}).get(sector, {}): 
+      continue
+    address = f"{world}:{sector}:{arena}"
+    if address not in addresses: 
+      addresses += [address]
+  return addresses[:n]
+
+
+def _resolve_action_address(act_desp, persona, maze, act_world): 
+  """
+  Finds where the action takes place: its sector, then its arena, then the 
+  game object in it and the object's state. Each step is an LLM call that 
+  needs the answer of the one before it. 
+
+  With ACTION_SPECULATION=n (n > 0), we do not wait for the sector before 
+  asking the next questions. For up to n likely addresses (see 
+  _speculative_addresses), we ask for the arena of their sector and the 
+  game object of their arena while the sector prompt is still running. Once
+  the sector is known, we keep the guess that matches, if any, and then 
+  keep the object of the guessed arena if the arena matches too. Wrong 
+  guesses are dropped. The prompts are the same as without speculation, so 
+  the answers are too; a right guess only saves round trips. 
+
+  OUTPUT: 
+    (act_sector, act_arena, act_game_object, act_obj_desp)
+  """
+  n_guesses = int(os.getenv("ACTION_SPECULATION", "0"))
+  guesses = []
+  if n_guesses > 0: 
+    guesses = _speculative_addresses(persona, maze, act_world, n_guesses)
+  if not guesses: 
+    act_sector = generate_action_sector(act_desp, persona, maze)
+    act_arena = generate_action_arena(act_desp, persona, maze, act_world,
+                                      act_sector)
+    act_address = f"{act_world}:{act_sector}:{act_arena}"
+    return (act_sector, act_arena) + _resolve_object(act_desp, act_address,
+                                                     persona, maze)
+
+  ex = ThreadPoolExecutor(max_workers=2 * len(guesses))
+  try: 
+    arena_guesses = dict()
+    object_guesses = dict()
+    for address in guesses: 
+      sector = address.split(":")[1]
+      if sector not in arena_guesses: 
+        arena_guesses[sector] = ex.submit(generate_action_arena, act_desp,
+                                          persona, maze, act_world, sector)
+      object_guesses[address] = ex.submit(_resolve_object, act_desp, address,
+                                          persona, maze)
+
+    act_sector = generate_action_sector(act_desp, persona, maze)
+    if act_sector in arena_guesses: 
+      act_arena = arena_guesses[act_sector].result()
+    else: 
+      act_arena = generate_action_arena(act_desp, persona, maze, act_world,
+                                        act_sector)
+    act_address = f"{act_world}:{act_sector}:{act_arena}"
+    if act_address in object_guesses: 
+      act_game_object, act_obj_desp = object_guesses[act_address].result()
+    else: 
+      act_game_object, act_obj_desp = _resolve_object(act_desp, act_address,
+                                                      persona, maze)
+  finally: 
+    # We do not wait for the wrong guesses. 
+    ex.shutdown(wait=False, cancel_futures=True)
+  return act_sector, act_arena, act_game_object, act_obj_desp
+
+
+def _act_memo_key(persona, act_world, act_desp): 
+  """
+  Returns the key of the action memo for doing <act_desp> in <act_world>: 
+  the normalized action description, the world, and the persona's home 
+  (the places the address prompts are built from). 
+  """
+  act_desp = " ".join(act_desp.lower().split()).strip(" .")
+  return f"{act_desp}|{act_world}|{persona.scratch.living_area}"
+
+
+def _recall_action(persona, maze, act_world, act_desp): 
+  """
+  Returns the memoized resolution of <act_desp> (see Scratch.act_memo) if 
+  the action memo is on (ACTION_MEMO_TTL_DAYS > 0), there is one younger 
+  than the TTL, its address still exists in the maze, and the draw of 
+  ACTION_MEMO_REUSE (the probability of reusing an entry) says so. 
+  Otherwise returns None and the action is resolved through the LLM. Not 
+  always reusing an entry keeps some variety in where and how the persona 
+  does its recurring actions. 
+  """
+  ttl_days = int(os.getenv("ACTION_MEMO_TTL_DAYS", "0"))
+  if ttl_days <= 0: 
+    return None
+  entry = persona.scratch.recall_act_memo(
+    _act_memo_key(persona, act_world, act_desp), ttl_days)
+  if entry is None or entry["act_address"] not in maze.address_tiles: 
+    return None
+  if random.random() >= float(os.getenv("ACTION_MEMO_REUSE", "1")): 
+    return None
+  return entry
+
+
+def _memorize_action(persona, act_world, act_desp, **entry): 
+  ttl_days = int(os.getenv("ACTION_MEMO_TTL_DAYS", "0"))
+  if ttl_days <= 0: 
+    return
+  persona.scratch.add_act_memo(_act_memo_key(persona, act_world, act_desp),
+                               ttl_days, **entry)
+
+
 def _determine_action(persona, maze): 
   """
   Creates the next action sequence for the persona. 
@@ -531,27 +756,6 @@ def _determine_action(persona, maze):
     persona: Current <Persona> instance whose action we are determining. 
     maze: Current <Maze> instance. 
   """
-  def determine_decomp(act_desp, act_dura):
-    """
-    Given an action description and its duration, we determine whether we need
-    to decompose it. If the action is about the agent sleeping, we generally
-    do not want to decompose it, so that's what we catch here. 
-
-    INPUT: 
-      act_desp: the description of the action (e.g., "sleeping")
-      act_dura: the duration of the action in minutes. 
-    OUTPUT: 
-      a boolean. True if we need to decompose, False otherwise. 
-    """
-    if "sleep" not in act_desp and "bed" not in act_desp: 
-      return True
-    elif "sleeping" in act_desp or "asleep" in act_desp or "in bed" in act_desp:
-      return False
-    elif "sleep" in act_desp or "bed" in act_desp: 
-      if act_dura > 60: 
-        return False
-    return True
-
   # The goal of this function is to get us the action associated with 
   # <curr_index>. As a part of this, we may need to decompose some large 
   # chunk actions. 
@@ -571,13 +775,13 @@ def _determine_action(persona, maze):
       # criteria described in determine_decomp.
       if determine_decomp(act_desp, act_dura): 
         persona.scratch.f_daily_schedule[curr_index:curr_index+1] = (
-                            generate_task_decomp(persona, act_desp, act_dura))
+                            _task_decomp(persona, act_desp, act_dura))
     if curr_index_60 + 1 < len(persona.scratch.f_daily_schedule):
       act_desp, act_dura = persona.scratch.f_daily_schedule[curr_index_60+1]
       if act_dura >= 60: 
         if determine_decomp(act_desp, act_dura): 
           persona.scratch.f_daily_schedule[curr_index_60+1:curr_index_60+2] = (
-                            generate_task_decomp(persona, act_desp, act_dura))
+                            _task_decomp(persona, act_desp, act_dura))
 
   if curr_index_60 < len(persona.scratch.f_daily_schedule):
     # If it is not the first hour of the day, this is always invoked (it is
@@ -590,7 +794,7 @@ def _determine_action(persona, maze):
       if act_dura >= 60: 
         if determine_decomp(act_desp, act_dura): 
           persona.scratch.f_daily_schedule[curr_index_60:curr_index_60+1] = (
-                              generate_task_decomp(persona, act_desp, act_dura))
+                              _task_decomp(persona, act_desp, act_dura))
   # * End of Decompose * 
 
   # Generate an <Action> instance from the action description and duration. By
@@ -624,19 +828,33 @@ def _determine_action(persona, maze):
   # variables.
   act_world = maze.access_tile(persona.scratch.curr_tile)["world"]
 
+  # A recurring action may have been resolved before (ACTION_MEMO_TTL_DAYS).
+  memo = _recall_action(persona, maze, act_world, act_desp)
+  if memo: 
+    persona.scratch.add_new_action(memo["act_address"], 
+                                   int(act_dura), 
+                                   act_desp, 
+                                   memo["act_pronunciatio"], 
+                                   tuple(memo["act_event"]),
+                                   None,
+                                   None,
+                                   None,
+                                   None,
+                                   memo["act_obj_description"], 
+                                   memo["act_obj_pronunciatio"], 
+                                   tuple(memo["act_obj_event"]))
+    return
+
   with ThreadPoolExecutor(max_workers=3) as ex:
     # act_pron, act_event depend only on act_desp → run in parallel
     f_pron = ex.submit(generate_action_pronunciatio, act_desp, persona)
     f_event = ex.submit(generate_action_event_triple, act_desp, persona)
 
-    # Dependency chain (sequential on main thread)
-    act_sector = generate_action_sector(act_desp, persona, maze)
-    act_arena = generate_action_arena(act_desp, persona, maze, act_world, act_sector)
-    act_address = f"{act_world}:{act_sector}:{act_arena}"
-    act_game_object = generate_action_game_object(act_desp, act_address,
-                                                  persona, maze)
+    # Dependency chain (sector -> arena -> game object -> object state), on 
+    # the main thread, possibly speculative (ACTION_SPECULATION). 
+    act_sector, act_arena, act_game_object, act_obj_desp = (
+      _resolve_action_address(act_desp, persona, maze, act_world))
     new_address = f"{act_world}:{act_sector}:{act_arena}:{act_game_object}"
-    act_obj_desp = generate_act_obj_desc(act_game_object, act_desp, persona)
 
     # After act_obj_desp is ready, submit remaining parallel calls
     f_obj_pron = ex.submit(generate_action_pronunciatio, act_obj_desp, persona)
@@ -648,6 +866,14 @@ def _determine_action(persona, maze):
     act_obj_pron = f_obj_pron.result()
     act_obj_event = f_obj_event.result()
 
+  _memorize_action(persona, act_world, act_desp, 
+                   act_address=new_address, 
+                   act_pronunciatio=act_pron, 
+                   act_event=list(act_event), 
+                   act_obj_description=act_obj_desp, 
+                   act_obj_pronunciatio=act_obj_pron, 
+                   act_obj_event=list(act_obj_event))
+
   # Adding the action to persona's queue. 
   persona.scratch.add_new_action(new_address, 
                                  int(act_dura), 
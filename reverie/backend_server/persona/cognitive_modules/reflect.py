@@ -17,6 +17,7 @@ from global_methods import *
 from persona.prompt_template.run_gpt_prompt import *
 from persona.prompt_template.gpt_structure import *
 from persona.cognitive_modules.retrieve import *
+from persona.cognitive_modules.perceive import generate_poig_scores
 
 def generate_focal_points(persona, n=3): 
   if debug: print ("GNS FUNCTION: <generate_focal_points>")
@@ -112,34 +113,40 @@ def run_reflect(persona):
   # <retrieved> has keys of focal points, and values of the associated Nodes. 
   retrieved = new_retrieve(persona, focal_points)
 
-  # For each of the focal points, generate thoughts and save it in the
-  # agent's memory.
+  # For each of the focal points, generate thoughts. We generate the 
+  # thoughts of all the focal points first, so that their poignancy can be 
+  # rated in one round trip, and then save them in the agent's memory. 
+  all_thoughts = []
   for focal_pt, nodes in retrieved.items():
     xx = [i.embedding_key for i in nodes]
     for xxx in xx: print (xxx)
 
     thoughts = generate_insights_and_evidence(persona, nodes, 5)
+    all_thoughts += list(thoughts.items())
 
-    # Batch-fetch embeddings for all thoughts at once
-    thought_texts = list(thoughts.keys())
-    if thought_texts:
-      thought_embeddings = get_embeddings_batch(thought_texts)
-      thought_embed_map = dict(zip(thought_texts, thought_embeddings))
-    else:
-      thought_embed_map = {}
+  # Batch-fetch embeddings for all thoughts at once
+  thought_texts = list(dict.fromkeys(thought for thought, _ in all_thoughts))
+  if thought_texts:
+    thought_embeddings = get_embeddings_batch(thought_texts)
+    thought_embed_map = dict(zip(thought_texts, thought_embeddings))
+  else:
+    thought_embed_map = {}
 
-    for thought, evidence in thoughts.items():
-      created = persona.scratch.curr_time
-      expiration = persona.scratch.curr_time + datetime.timedelta(days=30)
-      s, p, o = generate_action_event_triple(thought, persona)
-      keywords = set([s, p, o])
-      thought_poignancy = generate_poig_score(persona, "thought", thought)
-      thought_embedding_pair = (thought, thought_embed_map.get(thought,
-                                          get_embedding(thought)))
+  thought_poignancies = generate_poig_scores(
+    [(persona, "thought", thought) for thought, _ in all_thoughts])
 
-      persona.a_mem.add_thought(created, expiration, s, p, o,
-                                thought, keywords, thought_poignancy,
-                                thought_embedding_pair, evidence)
+  for count, (thought, evidence) in enumerate(all_thoughts):
+    created = persona.scratch.curr_time
+    expiration = persona.scratch.curr_time + datetime.timedelta(days=30)
+    s, p, o = generate_action_event_triple(thought, persona)
+    keywords = set([s, p, o])
+    thought_poignancy = thought_poignancies[count]
+    thought_embedding_pair = (thought, thought_embed_map.get(thought,
+                                        get_embedding(thought)))
+
+    persona.a_mem.add_thought(created, expiration, s, p, o,
+                              thought, keywords, thought_poignancy,
+                              thought_embedding_pair, evidence)
 
 
 def reflection_trigger(persona): 
@@ -226,11 +233,19 @@ def reflect(persona):
       planning_thought = generate_planning_thought_on_convo(persona, all_utt)
       planning_thought = f"For {persona.scratch.name}'s planning: {planning_thought}"
 
+      memo_thought = generate_memo_on_convo(persona, all_utt)
+      memo_thought = f"{persona.scratch.name} {memo_thought}"
+
+      # Rate the poignancy of both thoughts in one round trip. 
+      planning_poignancy, memo_poignancy = generate_poig_scores(
+        [(persona, "thought", planning_thought), 
+         (persona, "thought", memo_thought)])
+
       created = persona.scratch.curr_time
       expiration = persona.scratch.curr_time + datetime.timedelta(days=30)
       s, p, o = generate_action_event_triple(planning_thought, persona)
       keywords = set([s, p, o])
-      thought_poignancy = generate_poig_score(persona, "thought", planning_thought)
+      thought_poignancy = planning_poignancy
       thought_embedding_pair = (planning_thought, get_embedding(planning_thought))
 
       persona.a_mem.add_thought(created, expiration, s, p, o, 
@@ -239,14 +254,11 @@ def reflect(persona):
 
 
 
-      memo_thought = generate_memo_on_convo(persona, all_utt)
-      memo_thought = f"{persona.scratch.name} {memo_thought}"
-
       created = persona.scratch.curr_time
       expiration = persona.scratch.curr_time + datetime.timedelta(days=30)
       s, p, o = generate_action_event_triple(memo_thought, persona)
       keywords = set([s, p, o])
-      thought_poignancy = generate_poig_score(persona, "thought", memo_thought)
+      thought_poignancy = memo_poignancy
       thought_embedding_pair = (memo_thought, get_embedding(memo_thought))
 
       persona.a_mem.add_thought(created, expiration, s, p, o, 
@@ -10,6 +10,7 @@ sys.path.append('../../')
 from global_methods import *
 from persona.prompt_template.gpt_structure import *
 
+import numpy as np
 from numpy import dot
 from numpy.linalg import norm
 
@@ -196,12 +197,68 @@ def extract_relevance(persona, nodes, focal_pt):
   return relevance_out
 
 
+def normalize_array_floats(x, target_min, target_max): 
+  """
+  Vectorized counterpart of normalize_dict_floats. Normalizes the values of
+  the array 'x' along its first axis (i.e., every column of a 2-D array is
+  normalized on its own) to the range between target_min and target_max. As 
+  in normalize_dict_floats, a column whose values are all identical is set to
+  (target_max - target_min)/2. 
+
+  INPUT: 
+    x: 1-D or 2-D NumPy float array. 
+    target_min: Integer or float. The minimum value of the output. 
+    target_max: Integer or float. The maximum value of the output. 
+  OUTPUT: 
+    A new float array of the same shape as 'x' with normalized values. 
+  """
+  min_val = x.min(axis=0)
+  range_val = x.max(axis=0) - min_val
+  flat = range_val == 0
+  safe_range = np.where(flat, 1, range_val)
+  out = (x - min_val) * (target_max - target_min) / safe_range + target_min
+  return np.where(flat, (target_max - target_min)/2, out)
+
+
+def top_highest_x_indices(scores, x): 
+  """
+  Vectorized counterpart of top_highest_x_values. Returns the indices of the
+  'x' highest values of 'scores' in descending order of value. As with the 
+  stable sort in top_highest_x_values, ties keep their original order. 
+  argpartition is used so that only the candidates at or above the x-th 
+  highest value are fully sorted. 
+
+  INPUT: 
+    scores: 1-D NumPy float array. 
+    x: Integer. The number of indices to return. 
+  OUTPUT: 
+    A 1-D NumPy integer array of at most 'x' indices into 'scores'. 
+  """
+  if x <= 0: 
+    return np.array([], dtype=np.intp)
+  if x < len(scores): 
+    threshold = scores[np.argpartition(-scores, x - 1)[x - 1]]
+    candidates = np.flatnonzero(scores >= threshold)
+  else: 
+    candidates = np.arange(len(scores))
+  order = np.argsort(-scores[candidates], kind="stable")
+  return candidates[order][:x]
+
+
 def new_retrieve(persona, focal_points, n_count=30): 
   """
   Given the current persona and focal points (focal points are events or 
   thoughts for which we are retrieving), we retrieve a set of nodes for each
   of the focal points and return a dictionary. 
 
+  The scoring is vectorized over the arrays kept by the persona's associative
+  memory (see AssociativeMemory.get_retrieval_arrays). The relevance of every
+  node to every focal point is computed with a single matrix product. Since 
+  retrieving a node for one focal point updates its <last_accessed> (and so
+  the recency order seen by the next focal point), the recency ordering and 
+  the top-k selection are still done focal point by focal point, which keeps
+  the ranking identical to the original dictionary based implementation. 
+
   INPUT: 
     persona: The current persona object whose memory we are retrieving. 
     focal_points: A list of focal points (string description of the events or
@@ -217,54 +274,58 @@ def new_retrieve(persona, focal_points, n_count=30):
   """
   # <retrieved> is the main dictionary that we are returning
   retrieved = dict() 
-  for focal_pt in focal_points: 
-    # Getting all nodes from the agent's memory (both thoughts and events) and
-    # sorting them by the datetime of creation.
-    # You could also imagine getting the raw conversation, but for now. 
-    nodes = [[i.last_accessed, i]
-              for i in persona.a_mem.seq_event + persona.a_mem.seq_thought
-              if "idle" not in i.embedding_key]
-    nodes = sorted(nodes, key=lambda x: x[0])
-    nodes = [i for created, i in nodes]
-
-    # Calculating the component dictionaries and normalizing them.
-    recency_out = extract_recency(persona, nodes)
-    recency_out = normalize_dict_floats(recency_out, 0, 1)
-    importance_out = extract_importance(persona, nodes)
-    importance_out = normalize_dict_floats(importance_out, 0, 1)  
-    relevance_out = extract_relevance(persona, nodes, focal_pt)
-    relevance_out = normalize_dict_floats(relevance_out, 0, 1)
+  if not focal_points: 
+    return retrieved
+
+  # Getting all nodes from the agent's memory (both thoughts and events). 
+  # You could also imagine getting the raw conversation, but for now. 
+  arrays = persona.a_mem.get_retrieval_arrays()
+  rows = np.flatnonzero(~arrays["idle"])
+  if len(rows) == 0: 
+    for focal_pt in focal_points: 
+      retrieved[focal_pt] = []
+    return retrieved
+  embedding_rows = arrays["embedding_rows"][rows]
+
+  # Calculating the component arrays and normalizing them. Importance and 
+  # relevance do not depend on the order of the nodes, so they are computed
+  # for all focal points at once. Recency depends only on the position of a 
+  # node in the <last_accessed> order. 
+  recency = persona.scratch.recency_decay ** np.arange(1, len(rows) + 1, 
+                                                       dtype=np.float64)
+  recency = normalize_array_floats(recency, 0, 1)
+  importance = normalize_array_floats(arrays["poignancy"][rows], 0, 1)
+
+  focal_embeddings = np.array(get_embeddings_batch(list(focal_points)), 
+                              dtype=np.float32)
+  relevance = (arrays["embeddings"] @ focal_embeddings.T)[embedding_rows]
+  relevance = (relevance 
+               / (arrays["norms"][embedding_rows][:, None] 
+                  * norm(focal_embeddings, axis=1)[None, :]))
+  relevance = normalize_array_floats(relevance.astype(np.float64), 0, 1)
+
+  # Nodes are ordered by <last_accessed>; ties keep the order of 
+  # seq_event + seq_thought (events before thoughts, newest first). 
+  type_rank = arrays["type_rank"][rows]
+
+  # Note to self: test out different weights. [1, 1, 1] tends to work
+  # decently, but in the future, these weights should likely be learned, 
+  # perhaps through an RL-like process.
+  # gw = [1, 1, 1]
+  # gw = [1, 2, 1]
+  gw = [0.5, 3, 2]
+  for count, focal_pt in enumerate(focal_points): 
+    order = np.lexsort((-rows, type_rank, arrays["last_accessed"][rows]))
 
     # Computing the final scores that combines the component values. 
-    # Note to self: test out different weights. [1, 1, 1] tends to work
-    # decently, but in the future, these weights should likely be learned, 
-    # perhaps through an RL-like process.
-    # gw = [1, 1, 1]
-    # gw = [1, 2, 1]
-    gw = [0.5, 3, 2]
-    master_out = dict()
-    for key in recency_out.keys(): 
-      master_out[key] = (persona.scratch.recency_w*recency_out[key]*gw[0] 
-                     + persona.scratch.relevance_w*relevance_out[key]*gw[1] 
-                     + persona.scratch.importance_w*importance_out[key]*gw[2])
-
-    master_out = top_highest_x_values(master_out, len(master_out.keys()))
-    for key, val in master_out.items(): 
-      print (persona.a_mem.id_to_node[key].embedding_key, val)
-      print (persona.scratch.recency_w*recency_out[key]*1, 
-             persona.scratch.relevance_w*relevance_out[key]*1, 
-             persona.scratch.importance_w*importance_out[key]*1)
-
-    # Extracting the highest x values.
-    # <master_out> has the key of node.id and value of float. Once we get the 
-    # highest x values, we want to translate the node.id into nodes and return
-    # the list of nodes.
-    master_out = top_highest_x_values(master_out, n_count)
-    master_nodes = [persona.a_mem.id_to_node[key] 
-                    for key in list(master_out.keys())]
-
-    for n in master_nodes: 
-      n.last_accessed = persona.scratch.curr_time
+    master_out = (persona.scratch.recency_w*recency*gw[0] 
+               + persona.scratch.relevance_w*relevance[order, count]*gw[1] 
+               + persona.scratch.importance_w*importance[order]*gw[2])
+
+    # Extracting the highest x values and translating them back into nodes.
+    top_rows = rows[order[top_highest_x_indices(master_out, n_count)]]
+    master_nodes = [arrays["nodes"][row] for row in top_rows]
+    persona.a_mem.mark_accessed(top_rows, persona.scratch.curr_time)
       
     retrieved[focal_pt] = master_nodes
 
@@ -10,12 +10,78 @@ agents paper.
 import sys
 sys.path.append('../../')
 
+import os
 import json
 import datetime
 
+import numpy as np
+
 from global_methods import *
 
 
+# Reference point for turning <last_accessed> datetimes into float seconds so
+# that they can be sorted as a NumPy array. 
+_RETRIEVAL_EPOCH = datetime.datetime(1970, 1, 1)
+
+# Binary on-disk format (see AssociativeMemory.save_binary). The embeddings 
+# are stored as a float32 .npy matrix with one row per node (row i holds 
+# node_{i+1}) that is opened with mmap on load, and the node metadata is 
+# stored column by column in an .npz file so that loading does not need to
+# parse or strptime anything per node. 
+BINARY_EMBEDDINGS_FILE = "embeddings.npy"
+BINARY_NODES_FILE = "nodes.npz"
+_NODE_TYPES = ["event", "chat", "thought"]
+_STRING_COLUMNS = ["subject", "predicate", "object", "description", 
+                   "embedding_key"]
+_JSON_COLUMNS = ["keywords", "filling"]
+
+
+def get_memory_format(): 
+  """
+  Returns the on-disk format that AssociativeMemory.save writes by default:
+  "json" (the original nodes.json/embeddings.json layout) or "binary". It is
+  set with the MEMORY_FORMAT environment variable. 
+  """
+  return os.getenv("MEMORY_FORMAT", "json").strip().lower()
+
+
+def _pack_strings(strings): 
+  """
+  Packs a list of strings into a single uint8 array of UTF-8 bytes and an 
+  int64 offset array, where string i is data[offsets[i]:offsets[i+1]]. 
+  """
+  blobs = [i.encode("utf-8") for i in strings]
+  offsets = np.zeros(len(blobs) + 1, dtype=np.int64)
+  offsets[1:] = np.cumsum([len(i) for i in blobs], dtype=np.int64)
+  data = np.frombuffer(b"".join(blobs), dtype=np.uint8)
+  return data, offsets
+
+
+def _unpack_strings(data, offsets): 
+  raw = data.tobytes()
+  offsets = offsets.tolist()
+  return [raw[offsets[i]:offsets[i+1]].decode("utf-8") 
+          for i in range(len(offsets) - 1)]
+
+
+def _replace_file(path, write_fn): 
+  """
+  Writes a file through a temporary file and renames it into place. The 
+  rename keeps an embeddings.npy that is still memory-mapped by a loaded 
+  AssociativeMemory valid until that mapping is dropped. 
+  """
+  tmp_path = path + ".tmp"
+  with open(tmp_path, "wb") as outfile: 
+    write_fn(outfile)
+  os.replace(tmp_path, path)
+
+
+def _remove_files(folder, file_names): 
+  for file_name in file_names: 
+    if os.path.exists(f"{folder}/{file_name}"): 
+      os.remove(f"{folder}/{file_name}")
+
+
 class ConceptNode: 
   def __init__(self,
                node_id, node_count, type_count, node_type, depth,
@@ -47,6 +113,133 @@ class ConceptNode:
     return (self.subject, self.predicate, self.object)
 
 
+class EmbeddingStore: 
+  """
+  Append-only, array-backed store of the node embeddings. Row i holds the 
+  embedding of node_{i+1}, so every add_event/add_thought/add_chat appends 
+  exactly one row. The rows live in a float32 matrix whose capacity doubles
+  whenever it fills up, which keeps appends amortized O(1) and lets 
+  vectorized consumers (e.g., new_retrieve) use the matrix without 
+  rebuilding it. The L2 norm of each row is computed once on append so that
+  cosine similarity becomes a dot product divided by precomputed norms. 
+
+  The store also behaves like the old text -> embedding dictionary: 
+  <key in store> and <store[key]> look up the most recent row appended with
+  that embedding key. 
+  """
+  def __init__(self, capacity=64): 
+    # <capacity> is the number of rows allocated; <size> is the number of
+    # rows in use. The matrix itself is allocated on the first append, once
+    # we know the embedding dimension. 
+    self.capacity = capacity
+    self.size = 0
+    self.matrix = None
+    self.norms = np.zeros(capacity, dtype=np.float32)
+
+    # <row_keys> is the embedding key of every row, and <key_to_row> maps an
+    # embedding key to the latest row that holds it. 
+    self.row_keys = []
+    self.key_to_row = dict()
+
+
+  @classmethod
+  def from_arrays(cls, matrix, norms, row_keys): 
+    """
+    Builds a store around existing rows, e.g., the read-only memory map of 
+    embeddings.npy. The rows are not copied; the first append that needs 
+    more room copies them into a regular (writable) matrix. 
+
+    INPUT: 
+      matrix: (n, dim) float32 array. 
+      norms: (n,) float32 array of the row norms. 
+      row_keys: the embedding key of each of the n rows. 
+    OUTPUT: 
+      An EmbeddingStore of size n. 
+    """
+    store = cls()
+    if not row_keys: 
+      return store
+    store.capacity = len(row_keys)
+    store.size = len(row_keys)
+    store.matrix = matrix
+    store.norms = np.asarray(norms, dtype=np.float32)
+    store.row_keys = list(row_keys)
+    store.key_to_row = {key: row for row, key in enumerate(row_keys)}
+    return store
+
+
+  def _grow(self): 
+    self.capacity *= 2
+    matrix = np.zeros((self.capacity, self.matrix.shape[1]), dtype=np.float32)
+    matrix[:self.size] = self.matrix[:self.size]
+    self.matrix = matrix
+    norms = np.zeros(self.capacity, dtype=np.float32)
+    norms[:self.size] = self.norms[:self.size]
+    self.norms = norms
+
+
+  def append(self, key, embedding): 
+    """
+    Appends an embedding as a new row. 
+
+    INPUT: 
+      key: the embedding key (the text that was embedded). 
+      embedding: a 1-D sequence of floats. 
+    OUTPUT: 
+      The row index of the new embedding. 
+    """
+    vec = np.asarray(embedding, dtype=np.float32)
+    if self.matrix is None: 
+      self.matrix = np.zeros((self.capacity, len(vec)), dtype=np.float32)
+    if self.size == self.capacity: 
+      self._grow()
+
+    row = self.size
+    self.matrix[row] = vec
+    self.norms[row] = np.linalg.norm(vec)
+    self.row_keys += [key]
+    self.key_to_row[key] = row
+    self.size += 1
+    return row
+
+
+  def get_matrix(self): 
+    """
+    Returns a view of the rows in use as a (size, dim) float32 matrix. 
+    """
+    if self.matrix is None: 
+      return np.zeros((0, 0), dtype=np.float32)
+    return self.matrix[:self.size]
+
+
+  def get_norms(self): 
+    """
+    Returns a view of the precomputed L2 norms of the rows in use. 
+    """
+    return self.norms[:self.size]
+
+
+  def to_dict(self): 
+    """
+    Returns the store in the embeddings.json layout: a dictionary of 
+    embedding key -> list of floats. 
+    """
+    return {key: self.matrix[row].tolist() 
+            for key, row in self.key_to_row.items()}
+
+
+  def __contains__(self, key): 
+    return key in self.key_to_row
+
+
+  def __getitem__(self, key): 
+    return self.matrix[self.key_to_row[key]]
+
+
+  def __len__(self): 
+    return len(self.key_to_row)
+
+
 class AssociativeMemory: 
   def __init__(self, f_saved): 
     self.id_to_node = dict()
@@ -62,45 +255,32 @@ class AssociativeMemory:
     self.kw_strength_event = dict()
     self.kw_strength_thought = dict()
 
-    self.embeddings = json.load(open(f_saved + "/embeddings.json"))
-
-    nodes_load = json.load(open(f_saved + "/nodes.json"))
-    for count in range(len(nodes_load.keys())): 
-      node_id = f"node_{str(count+1)}"
-      node_details = nodes_load[node_id]
-
-      node_count = node_details["node_count"]
-      type_count = node_details["type_count"]
-      node_type = node_details["type"]
-      depth = node_details["depth"]
-
-      created = datetime.datetime.strptime(node_details["created"], 
-                                           '%Y-%m-%d %H:%M:%S')
-      expiration = None
-      if node_details["expiration"]: 
-        expiration = datetime.datetime.strptime(node_details["expiration"],
-                                                '%Y-%m-%d %H:%M:%S')
-
-      s = node_details["subject"]
-      p = node_details["predicate"]
-      o = node_details["object"]
-
-      description = node_details["description"]
-      embedding_pair = (node_details["embedding_key"], 
-                        self.embeddings[node_details["embedding_key"]])
-      poignancy =node_details["poignancy"]
-      keywords = set(node_details["keywords"])
-      filling = node_details["filling"]
-      
-      if node_type == "event": 
-        self.add_event(created, expiration, s, p, o, 
-                   description, keywords, poignancy, embedding_pair, filling)
-      elif node_type == "chat": 
-        self.add_chat(created, expiration, s, p, o, 
-                   description, keywords, poignancy, embedding_pair, filling)
-      elif node_type == "thought": 
-        self.add_thought(created, expiration, s, p, o, 
-                   description, keywords, poignancy, embedding_pair, filling)
+    # <embeddings> holds one embedding row per node (see EmbeddingStore). 
+    self.embeddings = EmbeddingStore()
+
+    # Vectorized retrieval state (see retrieve.py's new_retrieve). Every event
+    # and thought node is a retrieval node, in insertion order, with parallel
+    # arrays holding its poignancy and last access time. The arrays are 
+    # materialized lazily by get_retrieval_arrays(). 
+    self.retrieval_nodes = []
+    self._retrieval_last_accessed = []
+    self._retrieval_arrays = None
+
+    # The binary format is loaded when MEMORY_FORMAT asks for it, or when it
+    # is the only format present in <f_saved>. 
+    has_binary = os.path.exists(f"{f_saved}/{BINARY_NODES_FILE}")
+    has_json = os.path.exists(f"{f_saved}/nodes.json")
+    if has_binary and (get_memory_format() == "binary" or not has_json): 
+      self._load_binary(f_saved)
+    else: 
+      embeddings_load = json.load(open(f_saved + "/embeddings.json"))
+
+      nodes_load = json.load(open(f_saved + "/nodes.json"))
+      for count in range(len(nodes_load.keys())): 
+        node_id = f"node_{str(count+1)}"
+        node_details = nodes_load[node_id]
+        self.add_node(node_details, 
+                      embeddings_load[node_details["embedding_key"]])
 
     kw_strength_load = json.load(open(f_saved + "/kw_strength.json"))
     if kw_strength_load["kw_strength_event"]: 
@@ -109,33 +289,23 @@ class AssociativeMemory:
       self.kw_strength_thought = kw_strength_load["kw_strength_thought"]
 
     
-  def save(self, out_json): 
+  def save(self, out_json, memory_format=None): 
+    """
+    Saves the memory to the <out_json> folder in <memory_format> ("json" or
+    "binary"; defaults to get_memory_format()). Only one format is kept in 
+    the folder: saving in one format removes the node files of the other. 
+    kw_strength.json is written in both formats. 
+    """
+    if not memory_format: 
+      memory_format = get_memory_format()
+    if memory_format == "binary": 
+      self.save_binary(out_json)
+      return
+
     r = dict()
     for count in range(len(self.id_to_node.keys()), 0, -1): 
       node_id = f"node_{str(count)}"
-      node = self.id_to_node[node_id]
-
-      r[node_id] = dict()
-      r[node_id]["node_count"] = node.node_count
-      r[node_id]["type_count"] = node.type_count
-      r[node_id]["type"] = node.type
-      r[node_id]["depth"] = node.depth
-
-      r[node_id]["created"] = node.created.strftime('%Y-%m-%d %H:%M:%S')
-      r[node_id]["expiration"] = None
-      if node.expiration: 
-        r[node_id]["expiration"] = (node.expiration
-                                        .strftime('%Y-%m-%d %H:%M:%S'))
-
-      r[node_id]["subject"] = node.subject
-      r[node_id]["predicate"] = node.predicate
-      r[node_id]["object"] = node.object
-
-      r[node_id]["description"] = node.description
-      r[node_id]["embedding_key"] = node.embedding_key
-      r[node_id]["poignancy"] = node.poignancy
-      r[node_id]["keywords"] = list(node.keywords)
-      r[node_id]["filling"] = node.filling
+      r[node_id] = self.node_to_dict(self.id_to_node[node_id])
 
     with open(out_json+"/nodes.json", "w") as outfile:
       json.dump(r, outfile)
@@ -147,7 +317,191 @@ class AssociativeMemory:
       json.dump(r, outfile)
 
     with open(out_json+"/embeddings.json", "w") as outfile:
-      json.dump(self.embeddings, outfile)
+      json.dump(self.embeddings.to_dict(), outfile)
+
+    _remove_files(out_json, [BINARY_NODES_FILE, BINARY_EMBEDDINGS_FILE])
+
+
+  def node_to_dict(self, node): 
+    """
+    Returns the nodes.json entry of a <ConceptNode>. 
+    """
+    r = dict()
+    r["node_count"] = node.node_count
+    r["type_count"] = node.type_count
+    r["type"] = node.type
+    r["depth"] = node.depth
+
+    r["created"] = node.created.strftime('%Y-%m-%d %H:%M:%S')
+    r["expiration"] = None
+    if node.expiration: 
+      r["expiration"] = node.expiration.strftime('%Y-%m-%d %H:%M:%S')
+
+    r["subject"] = node.subject
+    r["predicate"] = node.predicate
+    r["object"] = node.object
+
+    r["description"] = node.description
+    r["embedding_key"] = node.embedding_key
+    r["poignancy"] = node.poignancy
+    r["keywords"] = list(node.keywords)
+    r["filling"] = node.filling
+    return r
+
+
+  def add_node(self, node_details, embedding): 
+    """
+    Adds a node from its nodes.json entry (see node_to_dict). The node gets
+    the next node count, so entries must be added in node_count order. 
+
+    INPUT: 
+      node_details: a nodes.json entry. 
+      embedding: the embedding of node_details["embedding_key"]. 
+    OUTPUT: 
+      The new <ConceptNode>. 
+    """
+    node_type = node_details["type"]
+
+    created = datetime.datetime.strptime(node_details["created"], 
+                                         '%Y-%m-%d %H:%M:%S')
+    expiration = None
+    if node_details["expiration"]: 
+      expiration = datetime.datetime.strptime(node_details["expiration"],
+                                              '%Y-%m-%d %H:%M:%S')
+
+    s = node_details["subject"]
+    p = node_details["predicate"]
+    o = node_details["object"]
+
+    description = node_details["description"]
+    embedding_pair = (node_details["embedding_key"], embedding)
+    poignancy =node_details["poignancy"]
+    keywords = set(node_details["keywords"])
+    filling = node_details["filling"]
+  
+    if node_type == "event": 
+      return self.add_event(created, expiration, s, p, o, 
+                 description, keywords, poignancy, embedding_pair, filling)
+    elif node_type == "chat": 
+      return self.add_chat(created, expiration, s, p, o, 
+                 description, keywords, poignancy, embedding_pair, filling)
+    elif node_type == "thought": 
+      return self.add_thought(created, expiration, s, p, o, 
+                 description, keywords, poignancy, embedding_pair, filling)
+
+
+  def save_binary(self, out_json): 
+    """
+    Saves the memory in the binary format: <BINARY_EMBEDDINGS_FILE> holds the
+    embedding matrix (one row per node) and <BINARY_NODES_FILE> holds the 
+    node metadata as one array per field. Timestamps are stored as integer 
+    seconds, and strings as packed UTF-8 bytes with offsets. 
+
+    INPUT: 
+      out_json: the associative_memory folder to save to. 
+    OUTPUT: 
+      None
+    """
+    nodes = [self.id_to_node[f"node_{str(count+1)}"] 
+             for count in range(len(self.id_to_node))]
+    epoch = _RETRIEVAL_EPOCH
+
+    columns = dict()
+    columns["type_count"] = np.array([i.type_count for i in nodes], 
+                                     dtype=np.int64)
+    columns["type"] = np.array([_NODE_TYPES.index(i.type) for i in nodes], 
+                               dtype=np.int8)
+    columns["depth"] = np.array([i.depth for i in nodes], dtype=np.int64)
+    columns["created"] = np.array(
+      [int((i.created - epoch).total_seconds()) for i in nodes], 
+      dtype=np.int64)
+    columns["has_expiration"] = np.array([bool(i.expiration) for i in nodes],
+                                         dtype=bool)
+    columns["expiration"] = np.array(
+      [int((i.expiration - epoch).total_seconds()) if i.expiration else 0
+       for i in nodes], dtype=np.int64)
+    poignancy = [i.poignancy for i in nodes]
+    if all(type(i) == int for i in poignancy): 
+      columns["poignancy"] = np.array(poignancy, dtype=np.int64)
+    else: 
+      columns["poignancy"] = np.array(poignancy, dtype=np.float64)
+    for column in _STRING_COLUMNS + _JSON_COLUMNS: 
+      if column == "keywords": 
+        values = [json.dumps(list(i.keywords)) for i in nodes]
+      elif column in _JSON_COLUMNS: 
+        values = [json.dumps(getattr(i, column)) for i in nodes]
+      else: 
+        values = [getattr(i, column) for i in nodes]
+      data, offsets = _pack_strings(values)
+      columns[f"{column}_data"] = data
+      columns[f"{column}_offsets"] = offsets
+
+    # Row i of the matrix must be node_{i+1}'s embedding. This holds for 
+    # every node added through add_event/add_thought/add_chat. 
+    rows = [i.embedding_row for i in nodes]
+    matrix = self.embeddings.get_matrix()
+    norms = self.embeddings.get_norms()
+    if rows != list(range(len(rows))): 
+      matrix = matrix[rows]
+      norms = norms[rows]
+    columns["embedding_norms"] = np.asarray(norms, dtype=np.float32)
+
+    _replace_file(f"{out_json}/{BINARY_EMBEDDINGS_FILE}", 
+                  lambda f: np.save(f, np.asarray(matrix, dtype=np.float32)))
+    _replace_file(f"{out_json}/{BINARY_NODES_FILE}", 
+                  lambda f: np.savez(f, **columns))
+
+    r = dict()
+    r["kw_strength_event"] = self.kw_strength_event
+    r["kw_strength_thought"] = self.kw_strength_thought
+    with open(out_json+"/kw_strength.json", "w") as outfile:
+      json.dump(r, outfile)
+
+    _remove_files(out_json, ["nodes.json", "embeddings.json"])
+
+
+  def _load_binary(self, f_saved): 
+    """
+    Loads the nodes saved by save_binary. The embedding matrix is 
+    memory-mapped read-only, so only the rows that are actually used get 
+    read from disk. 
+    """
+    columns = np.load(f"{f_saved}/{BINARY_NODES_FILE}")
+    strings = dict()
+    for column in _STRING_COLUMNS + _JSON_COLUMNS: 
+      strings[column] = _unpack_strings(columns[f"{column}_data"], 
+                                        columns[f"{column}_offsets"])
+    for column in _JSON_COLUMNS: 
+      strings[column] = [json.loads(i) for i in strings[column]]
+
+    matrix = np.load(f"{f_saved}/{BINARY_EMBEDDINGS_FILE}", mmap_mode="r")
+    self.embeddings = EmbeddingStore.from_arrays(
+      matrix, columns["embedding_norms"], strings["embedding_key"])
+
+    node_types = columns["type"].tolist()
+    created = columns["created"].tolist()
+    has_expiration = columns["has_expiration"].tolist()
+    expiration = columns["expiration"].tolist()
+    poignancy = columns["poignancy"].tolist()
+    add_fns = [self.add_event, self.add_chat, self.add_thought]
+    for count in range(len(node_types)): 
+      node_created = _RETRIEVAL_EPOCH + datetime.timedelta(
+                                          seconds=created[count])
+      node_expiration = None
+      if has_expiration[count]: 
+        node_expiration = _RETRIEVAL_EPOCH + datetime.timedelta(
+                                               seconds=expiration[count])
+      # The embedding row of this node is already in the store, which the 
+      # add functions signal with a None embedding. 
+      add_fns[node_types[count]](node_created, node_expiration, 
+                                 strings["subject"][count], 
+                                 strings["predicate"][count], 
+                                 strings["object"][count], 
+                                 strings["description"][count], 
+                                 set(strings["keywords"][count]), 
+                                 poignancy[count], 
+                                 (strings["embedding_key"][count], None), 
+                                 strings["filling"][count])
 
 
   def add_event(self, created, expiration, s, p, o, 
@@ -191,7 +545,8 @@ class AssociativeMemory:
         else: 
           self.kw_strength_event[kw] = 1
 
-    self.embeddings[embedding_pair[0]] = embedding_pair[1]
+    node.embedding_row = self._append_embedding(node, embedding_pair)
+    self._add_retrieval_row(node)
 
     return node
 
@@ -235,7 +590,8 @@ class AssociativeMemory:
         else: 
           self.kw_strength_thought[kw] = 1
 
-    self.embeddings[embedding_pair[0]] = embedding_pair[1]
+    node.embedding_row = self._append_embedding(node, embedding_pair)
+    self._add_retrieval_row(node)
 
     return node
 
@@ -266,11 +622,89 @@ class AssociativeMemory:
         self.kw_to_chat[kw] = [node]
     self.id_to_node[node_id] = node 
 
-    self.embeddings[embedding_pair[0]] = embedding_pair[1]
+    node.embedding_row = self._append_embedding(node, embedding_pair)
+    self._retrieval_arrays = None
         
     return node
 
 
+  def _append_embedding(self, node, embedding_pair): 
+    # A None embedding means the row was preloaded by _load_binary, where row
+    # i holds node_{i+1}. 
+    if embedding_pair[1] is None: 
+      return node.node_count - 1
+    return self.embeddings.append(*embedding_pair)
+
+
+  def _add_retrieval_row(self, node): 
+    node.retrieval_row = len(self.retrieval_nodes)
+    self.retrieval_nodes += [node]
+    self._retrieval_last_accessed += [
+      (node.last_accessed - _RETRIEVAL_EPOCH).total_seconds()]
+    self._retrieval_arrays = None
+
+
+  def get_retrieval_arrays(self): 
+    """
+    Returns the event and thought nodes along with the parallel NumPy arrays
+    that new_retrieve scores in one go. The per-node arrays are rebuilt only
+    when new nodes were added since the last call; the embeddings themselves
+    are never copied. 
+
+    INPUT: 
+      None
+    OUTPUT: 
+      A dictionary with the following keys (all arrays except "embeddings"
+      and "norms" have one entry per node in <retrieval_nodes>): 
+        "nodes": the list of <ConceptNode>s. 
+        "embeddings": the float32 matrix of the embedding store (one row per
+                      node of any type, including chats). 
+        "norms": the precomputed L2 norms of the "embeddings" rows. 
+        "embedding_rows": the "embeddings" row looked up by every node's 
+                          embedding key (the latest row for that key). 
+        "poignancy": float64 array of the node poignancy. 
+        "last_accessed": float64 array of last access times in seconds. 
+        "type_rank": 0 for events and 1 for thoughts. 
+        "idle": True for nodes whose embedding key mentions "idle". 
+    """
+    if self._retrieval_arrays is None: 
+      nodes = self.retrieval_nodes
+      self._retrieval_arrays = {
+        "nodes": nodes, 
+        "embeddings": self.embeddings.get_matrix(), 
+        "norms": self.embeddings.get_norms(), 
+        "embedding_rows": np.array(
+          [self.embeddings.key_to_row[i.embedding_key] for i in nodes], 
+          dtype=np.intp), 
+        "poignancy": np.array([i.poignancy for i in nodes], dtype=np.float64),
+        "last_accessed": np.array(self._retrieval_last_accessed, 
+                                  dtype=np.float64),
+        "type_rank": np.array([i.type == "thought" for i in nodes], 
+                              dtype=np.int8),
+        "idle": np.array(["idle" in i.embedding_key for i in nodes], 
+                         dtype=bool)}
+    return self._retrieval_arrays
+
+
+  def mark_accessed(self, rows, curr_time): 
+    """
+    Sets the last access time of the retrieval rows <rows> to <curr_time>, 
+    keeping the nodes and the last_accessed array in sync. 
+
+    INPUT: 
+      rows: an iterable of row indices into <retrieval_nodes>. 
+      curr_time: datetime of the access. 
+    OUTPUT: 
+      None
+    """
+    seconds = (curr_time - _RETRIEVAL_EPOCH).total_seconds()
+    for row in rows: 
+      self.retrieval_nodes[row].last_accessed = curr_time
+      self._retrieval_last_accessed[row] = seconds
+      if self._retrieval_arrays is not None: 
+        self._retrieval_arrays["last_accessed"][row] = seconds
+
+
   def get_summarized_latest_events(self, retention): 
     ret_set = set()
     for e_node in self.seq_event[:retention]: 
@@ -333,28 +767,21 @@ class AssociativeMemory:
       return False
 
 
+def convert_memory_format(f_saved, memory_format): 
+  """
+  Converts a saved associative memory folder in place between the JSON 
+  layout (nodes.json/embeddings.json, which the frontend's replay views 
+  read) and the binary layout. 
 
+  INPUT: 
+    f_saved: the associative_memory folder. 
+    memory_format: "json" or "binary". 
+  OUTPUT: 
+    None
+  """
+  AssociativeMemory(f_saved).save(f_saved, memory_format)
 
 
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
+if __name__ == '__main__':
+  # Usage: python associative_memory.py <associative_memory folder> json|binary
+  convert_memory_format(sys.argv[1], sys.argv[2])
@@ -11,8 +11,36 @@ sys.path.append('../../')
 
 from global_methods import *
 
+
+# The fields that the memoized prompt strings (get_str_iss, act_summary_str)
+# are built from. Setting any of them bumps Scratch.version. 
+PROMPT_CONTEXT_FIELDS = {"name", "age", "innate", "learned", "currently", 
+                         "lifestyle", "daily_plan_req", "act_start_time", 
+                         "act_description", "act_address", "act_duration"}
+
+
 class Scratch: 
+  def __setattr__(self, key, val): 
+    # Every assignment to a prompt context field (including the ones made 
+    # by add_new_action and load_dict, or by plan.py updating <currently>)
+    # invalidates the memoized prompt strings. 
+    if key in PROMPT_CONTEXT_FIELDS: 
+      object.__setattr__(self, "version", self.__dict__.get("version", 0) + 1)
+    object.__setattr__(self, key, val)
+
+
   def __init__(self, f_saved): 
+    # <version> counts the changes to the prompt context fields, and 
+    # <prompt_strs> holds the memoized prompt strings as 
+    # name -> (key it was built for, string). 
+    self.version = 0
+    self.prompt_strs = dict()
+    # <decomp_ahead> holds the task decompositions of today's hourly schedule
+    # blocks that are being made in the background (see 
+    # plan._decompose_day_ahead), as (act_desp, act_dura) -> [<Future>, ...].
+    # Like the memoized prompt strings, it is not saved. 
+    self.decomp_ahead = dict()
+
     # PERSONA HYPERPARAMETERS
     # <vision_r> denotes the number of tiles that the persona can see around 
     # them. 
@@ -158,80 +186,106 @@ class Scratch:
     # e.g., [(50, 10), (49, 10), (48, 10), ...]
     self.planned_path = []
 
+    # ACTION MEMO
+    # <act_memo> remembers how the persona's past actions were resolved (the
+    # address, emojis, event triples and object description that the LLM 
+    # gave for them), so a recurring action like "having breakfast" can skip
+    # those prompts. See plan._determine_action. 
+    # e.g., {"having breakfast|the Ville|the Ville:Isabella's house:bedroom": 
+    #          {"date": "February 13, 2023", 
+    #           "act_address": "the Ville:Isabella's house:kitchen:stove", 
+    #           "act_pronunciatio": "🍳", ...}}
+    self.act_memo = dict()
+
     if check_if_file_exists(f_saved): 
       # If we have a bootstrap file, load that here. 
       scratch_load = json.load(open(f_saved))
+      self.load_dict(scratch_load)
+
+
+  def load_dict(self, scratch_load): 
+    """
+    Loads the scratch from its scratch.json dictionary (see to_dict). 
+
+    INPUT: 
+      scratch_load: The dictionary loaded from scratch.json. 
+    OUTPUT: 
+      None
+    """
 
-      self.vision_r = scratch_load["vision_r"]
-      self.att_bandwidth = scratch_load["att_bandwidth"]
-      self.retention = scratch_load["retention"]
-
-      if scratch_load["curr_time"]: 
-        self.curr_time = datetime.datetime.strptime(scratch_load["curr_time"],
-                                                  "%B %d, %Y, %H:%M:%S")
-      else: 
-        self.curr_time = None
-      self.curr_tile = scratch_load["curr_tile"]
-      self.daily_plan_req = scratch_load["daily_plan_req"]
-
-      self.name = scratch_load["name"]
-      self.first_name = scratch_load["first_name"]
-      self.last_name = scratch_load["last_name"]
-      self.age = scratch_load["age"]
-      self.innate = scratch_load["innate"]
-      self.learned = scratch_load["learned"]
-      self.currently = scratch_load["currently"]
-      self.lifestyle = scratch_load["lifestyle"]
-      self.living_area = scratch_load["living_area"]
-
-      self.concept_forget = scratch_load["concept_forget"]
-      self.daily_reflection_time = scratch_load["daily_reflection_time"]
-      self.daily_reflection_size = scratch_load["daily_reflection_size"]
-      self.overlap_reflect_th = scratch_load["overlap_reflect_th"]
-      self.kw_strg_event_reflect_th = scratch_load["kw_strg_event_reflect_th"]
-      self.kw_strg_thought_reflect_th = scratch_load["kw_strg_thought_reflect_th"]
-
-      self.recency_w = scratch_load["recency_w"]
-      self.relevance_w = scratch_load["relevance_w"]
-      self.importance_w = scratch_load["importance_w"]
-      self.recency_decay = scratch_load["recency_decay"]
-      self.importance_trigger_max = scratch_load["importance_trigger_max"]
-      self.importance_trigger_curr = scratch_load["importance_trigger_curr"]
-      self.importance_ele_n = scratch_load["importance_ele_n"]
-      self.thought_count = scratch_load["thought_count"]
-
-      self.daily_req = scratch_load["daily_req"]
-      self.f_daily_schedule = scratch_load["f_daily_schedule"]
-      self.f_daily_schedule_hourly_org = scratch_load["f_daily_schedule_hourly_org"]
-
-      self.act_address = scratch_load["act_address"]
-      if scratch_load["act_start_time"]: 
-        self.act_start_time = datetime.datetime.strptime(
-                                              scratch_load["act_start_time"],
-                                              "%B %d, %Y, %H:%M:%S")
-      else: 
-        self.curr_time = None
-      self.act_duration = scratch_load["act_duration"]
-      self.act_description = scratch_load["act_description"]
-      self.act_pronunciatio = scratch_load["act_pronunciatio"]
-      self.act_event = tuple(scratch_load["act_event"])
-
-      self.act_obj_description = scratch_load["act_obj_description"]
-      self.act_obj_pronunciatio = scratch_load["act_obj_pronunciatio"]
-      self.act_obj_event = tuple(scratch_load["act_obj_event"])
-
-      self.chatting_with = scratch_load["chatting_with"]
-      self.chat = scratch_load["chat"]
-      self.chatting_with_buffer = scratch_load["chatting_with_buffer"]
-      if scratch_load["chatting_end_time"]: 
-        self.chatting_end_time = datetime.datetime.strptime(
-                                            scratch_load["chatting_end_time"],
+    self.vision_r = scratch_load["vision_r"]
+    self.att_bandwidth = scratch_load["att_bandwidth"]
+    self.retention = scratch_load["retention"]
+
+    if scratch_load["curr_time"]: 
+      self.curr_time = datetime.datetime.strptime(scratch_load["curr_time"],
+                                                "%B %d, %Y, %H:%M:%S")
+    else: 
+      self.curr_time = None
+    self.curr_tile = scratch_load["curr_tile"]
+    self.daily_plan_req = scratch_load["daily_plan_req"]
+
+    self.name = scratch_load["name"]
+    self.first_name = scratch_load["first_name"]
+    self.last_name = scratch_load["last_name"]
+    self.age = scratch_load["age"]
+    self.innate = scratch_load["innate"]
+    self.learned = scratch_load["learned"]
+    self.currently = scratch_load["currently"]
+    self.lifestyle = scratch_load["lifestyle"]
+    self.living_area = scratch_load["living_area"]
+
+    self.concept_forget = scratch_load["concept_forget"]
+    self.daily_reflection_time = scratch_load["daily_reflection_time"]
+    self.daily_reflection_size = scratch_load["daily_reflection_size"]
+    self.overlap_reflect_th = scratch_load["overlap_reflect_th"]
+    self.kw_strg_event_reflect_th = scratch_load["kw_strg_event_reflect_th"]
+    self.kw_strg_thought_reflect_th = scratch_load["kw_strg_thought_reflect_th"]
+
+    self.recency_w = scratch_load["recency_w"]
+    self.relevance_w = scratch_load["relevance_w"]
+    self.importance_w = scratch_load["importance_w"]
+    self.recency_decay = scratch_load["recency_decay"]
+    self.importance_trigger_max = scratch_load["importance_trigger_max"]
+    self.importance_trigger_curr = scratch_load["importance_trigger_curr"]
+    self.importance_ele_n = scratch_load["importance_ele_n"]
+    self.thought_count = scratch_load["thought_count"]
+
+    self.daily_req = scratch_load["daily_req"]
+    self.f_daily_schedule = scratch_load["f_daily_schedule"]
+    self.f_daily_schedule_hourly_org = scratch_load["f_daily_schedule_hourly_org"]
+
+    self.act_address = scratch_load["act_address"]
+    if scratch_load["act_start_time"]: 
+      self.act_start_time = datetime.datetime.strptime(
+                                            scratch_load["act_start_time"],
                                             "%B %d, %Y, %H:%M:%S")
-      else:
-        self.chatting_end_time = None
+    else: 
+      self.act_start_time = None
+    self.act_duration = scratch_load["act_duration"]
+    self.act_description = scratch_load["act_description"]
+    self.act_pronunciatio = scratch_load["act_pronunciatio"]
+    self.act_event = tuple(scratch_load["act_event"])
+
+    self.act_obj_description = scratch_load["act_obj_description"]
+    self.act_obj_pronunciatio = scratch_load["act_obj_pronunciatio"]
+    self.act_obj_event = tuple(scratch_load["act_obj_event"])
 
-      self.act_path_set = scratch_load["act_path_set"]
-      self.planned_path = scratch_load["planned_path"]
+    self.chatting_with = scratch_load["chatting_with"]
+    self.chat = scratch_load["chat"]
+    self.chatting_with_buffer = scratch_load["chatting_with_buffer"]
+    if scratch_load["chatting_end_time"]: 
+      self.chatting_end_time = datetime.datetime.strptime(
+                                          scratch_load["chatting_end_time"],
+                                          "%B %d, %Y, %H:%M:%S")
+    else:
+      self.chatting_end_time = None
+
+    self.act_path_set = scratch_load["act_path_set"]
+    self.planned_path = scratch_load["planned_path"]
+
+    # Older scratch.json files do not have an action memo. 
+    self.act_memo = scratch_load.get("act_memo", dict())
 
 
   def save(self, out_json):
@@ -243,12 +297,28 @@ class Scratch:
     OUTPUT: 
       None
     """
+    with open(out_json, "w") as outfile:
+      json.dump(self.to_dict(), outfile, indent=2) 
+
+
+  def to_dict(self): 
+    """
+    Returns the scratch as the dictionary that is saved to scratch.json. 
+
+    INPUT: 
+      None
+    OUTPUT: 
+      A JSON-serializable dictionary of the scratch fields. 
+    """
     scratch = dict() 
     scratch["vision_r"] = self.vision_r
     scratch["att_bandwidth"] = self.att_bandwidth
     scratch["retention"] = self.retention
 
-    scratch["curr_time"] = self.curr_time.strftime("%B %d, %Y, %H:%M:%S")
+    if self.curr_time: 
+      scratch["curr_time"] = self.curr_time.strftime("%B %d, %Y, %H:%M:%S")
+    else: 
+      scratch["curr_time"] = None
     scratch["curr_tile"] = self.curr_tile
     scratch["daily_plan_req"] = self.daily_plan_req
 
@@ -283,8 +353,11 @@ class Scratch:
     scratch["f_daily_schedule_hourly_org"] = self.f_daily_schedule_hourly_org
 
     scratch["act_address"] = self.act_address
-    scratch["act_start_time"] = (self.act_start_time
-                                     .strftime("%B %d, %Y, %H:%M:%S"))
+    if self.act_start_time: 
+      scratch["act_start_time"] = (self.act_start_time
+                                       .strftime("%B %d, %Y, %H:%M:%S"))
+    else: 
+      scratch["act_start_time"] = None
     scratch["act_duration"] = self.act_duration
     scratch["act_description"] = self.act_description
     scratch["act_pronunciatio"] = self.act_pronunciatio
@@ -306,8 +379,8 @@ class Scratch:
     scratch["act_path_set"] = self.act_path_set
     scratch["planned_path"] = self.planned_path
 
-    with open(out_json, "w") as outfile:
-      json.dump(scratch, outfile, indent=2) 
+    scratch["act_memo"] = self.act_memo
+    return scratch
 
 
   def get_f_daily_schedule_index(self, advance=0):
@@ -402,16 +475,37 @@ class Scratch:
        Daily plan requirement: Dolores is planning to stay at home all day and 
          never go out."
     """
-    commonset = ""
-    commonset += f"Name: {self.name}\n"
-    commonset += f"Age: {self.age}\n"
-    commonset += f"Innate traits: {self.innate}\n"
-    commonset += f"Learned traits: {self.learned}\n"
-    commonset += f"Currently: {self.currently}\n"
-    commonset += f"Lifestyle: {self.lifestyle}\n"
-    commonset += f"Daily plan requirement: {self.daily_plan_req}\n"
-    commonset += f"Current Date: {self.curr_time.strftime('%A %B %d')}\n"
-    return commonset
+    def build(): 
+      commonset = ""
+      commonset += f"Name: {self.name}\n"
+      commonset += f"Age: {self.age}\n"
+      commonset += f"Innate traits: {self.innate}\n"
+      commonset += f"Learned traits: {self.learned}\n"
+      commonset += f"Currently: {self.currently}\n"
+      commonset += f"Lifestyle: {self.lifestyle}\n"
+      commonset += f"Daily plan requirement: {self.daily_plan_req}\n"
+      commonset += f"Current Date: {self.curr_time.strftime('%A %B %d')}\n"
+      return commonset
+    return self.memoized("iss", (self.version, self.curr_time.date()), build)
+
+
+  def memoized(self, name, key, build): 
+    """
+    Returns the prompt string <name> built for <key>, calling build() only 
+    if it has not been built for that key yet. 
+
+    INPUT
+      name: The name of the prompt string, e.g., "iss". 
+      key: Everything the string depends on, e.g., (self.version, date).
+      build: A function that builds the string. 
+    OUTPUT
+      The string. 
+    """
+    memo = self.prompt_strs.get(name)
+    if memo is None or memo[0] != key: 
+      memo = (key, build())
+      self.prompt_strs[name] = memo
+    return memo[1]
 
 
   def get_str_name(self): 
@@ -530,6 +624,57 @@ class Scratch:
     return self.act_start_time.strftime("%H:%M %p")
 
 
+  def get_act_end_time(self): 
+    """
+    Returns the time at which the current action ends: the end of the chat
+    if the persona is chatting, and otherwise the action's start time 
+    (rounded up to the minute) plus its duration. 
+    """
+    if self.chatting_with: 
+      return self.chatting_end_time
+    x = self.act_start_time
+    if x.second != 0: 
+      x = x.replace(second=0)
+      x = (x + datetime.timedelta(minutes=1))
+    return (x + datetime.timedelta(minutes=self.act_duration))
+
+
+  def recall_act_memo(self, key, ttl_days): 
+    """
+    Returns the memoized resolution of the action <key>, or None if there is
+    none that is younger than <ttl_days> simulated days. Expired entries are
+    dropped. 
+
+    INPUT
+      key: The memo key of the action (see plan._act_memo_key). 
+      ttl_days: How many simulated days an entry stays valid. 
+    OUTPUT 
+      The memo entry (a dictionary of the act_* fields of add_new_action), or
+      None. 
+    """
+    entry = self.act_memo.get(key)
+    if entry is None: 
+      return None
+    date = datetime.datetime.strptime(entry["date"], "%B %d, %Y").date()
+    if (self.curr_time.date() - date).days >= ttl_days: 
+      del self.act_memo[key]
+      return None
+    return entry
+
+
+  def add_act_memo(self, key, ttl_days, **entry): 
+    """
+    Memoizes the resolution <entry> of the action <key>, dated today, and 
+    drops the entries older than <ttl_days> simulated days. 
+    """
+    today = self.curr_time.date()
+    self.act_memo = {k: v for k, v in self.act_memo.items() 
+                     if (today - datetime.datetime.strptime(
+                           v["date"], "%B %d, %Y").date()).days < ttl_days}
+    entry["date"] = self.curr_time.strftime("%B %d, %Y")
+    self.act_memo[key] = entry
+
+
   def act_check_finished(self): 
     """
     Checks whether the self.Action instance has finished.  
@@ -544,15 +689,7 @@ class Scratch:
     if not self.act_address: 
       return True
       
-    if self.chatting_with: 
-      end_time = self.chatting_end_time
-    else: 
-      x = self.act_start_time
-      if x.second != 0: 
-        x = x.replace(second=0)
-        x = (x + datetime.timedelta(minutes=1))
-      end_time = (x + datetime.timedelta(minutes=self.act_duration))
-
+    end_time = self.get_act_end_time()
     if end_time.strftime("%H:%M:%S") == self.curr_time.strftime("%H:%M:%S"): 
       return True
     return False
@@ -587,12 +724,14 @@ class Scratch:
     OUTPUT 
       ret: A human readable summary of the action.
     """
-    start_datetime_str = self.act_start_time.strftime("%A %B %d -- %H:%M %p")
-    ret = f"[{start_datetime_str}]\n"
-    ret += f"Activity: {self.name} is {self.act_description}\n"
-    ret += f"Address: {self.act_address}\n"
-    ret += f"Duration in minutes (e.g., x min): {str(self.act_duration)} min\n"
-    return ret
+    def build(): 
+      start_datetime_str = self.act_start_time.strftime("%A %B %d -- %H:%M %p")
+      ret = f"[{start_datetime_str}]\n"
+      ret += f"Activity: {self.name} is {self.act_description}\n"
+      ret += f"Address: {self.act_address}\n"
+      ret += f"Duration in minutes (e.g., x min): {str(self.act_duration)} min\n"
+      return ret
+    return self.memoized("act_summary", self.version, build)
 
 
   def get_str_daily_schedule_summary(self): 
@@ -9,16 +9,98 @@ import json
 import sys
 sys.path.append('../../')
 
+import numpy
+
 from utils import *
 from global_methods import *
 
 class MemoryTree: 
   def __init__(self, f_saved): 
+    # <tree> is the nested world -> sector -> arena -> [game objects] 
+    # dictionary that we save and print. Its lists keep the order in which 
+    # the persona came across the objects. 
+    # <places> is the set of every path in the tree as a tuple, e.g., 
+    # ("the Ville", "Hobbs Cafe", "cafe", "refrigerator"), so that we can 
+    # tell whether the persona knows a place without walking the tree or 
+    # scanning its lists. 
+    # <explored> is a (maze_height, maze_width) numpy boolean array that is
+    # True on the tiles whose places are already in the tree, so perception
+    # only needs to look at tiles the persona has not seen before. It is 
+    # not saved; a loaded persona starts with nothing explored. 
+    # <prompt_strs> memoizes the get_str_accessible_* strings, as 
+    # (method name, argument) -> string. It is emptied whenever a place is 
+    # added to the tree. 
     self.tree = {}
     if check_if_file_exists(f_saved): 
       self.tree = json.load(open(f_saved))
 
 
+  @property
+  def tree(self): 
+    return self._tree
+
+
+  @tree.setter
+  def tree(self, tree): 
+    # The tree is replaced as a whole when it is loaded or restored from a 
+    # checkpoint, so we rebuild everything that is derived from it. 
+    self._tree = tree
+    self.prompt_strs = dict()
+    self.places = set()
+    for world, sectors in tree.items(): 
+      self.places.add((world,))
+      for sector, arenas in sectors.items(): 
+        self.places.add((world, sector))
+        for arena, game_objects in arenas.items(): 
+          self.places.add((world, sector, arena))
+          for game_object in game_objects: 
+            self.places.add((world, sector, arena, game_object))
+    self.explored = None
+
+
+  def add_place(self, world, sector, arena, game_object): 
+    """
+    Adds a place the persona has perceived to the tree. Levels that are "" 
+    (e.g., a tile with no game object) are skipped. 
+
+    INPUT
+      world, sector, arena, game_object: The names of the place. 
+    OUTPUT
+      None
+    """
+    if world: 
+      if (world,) not in self.places: 
+        self.places.add((world,))
+        self._tree[world] = {}
+        self.prompt_strs.clear()
+    if sector: 
+      if (world, sector) not in self.places: 
+        self.places.add((world, sector))
+        self._tree[world][sector] = {}
+        self.prompt_strs.clear()
+    if arena: 
+      if (world, sector, arena) not in self.places: 
+        self.places.add((world, sector, arena))
+        self._tree[world][sector][arena] = []
+        self.prompt_strs.clear()
+    if game_object: 
+      if (world, sector, arena, game_object) not in self.places: 
+        self.places.add((world, sector, arena, game_object))
+        self._tree[world][sector][arena] += [game_object]
+        self.prompt_strs.clear()
+
+
+  def get_explored(self, maze_height, maze_width): 
+    """
+    Returns the persona's explored-tiles array for a maze of the given size,
+    creating it if need be. 
+    """
+    if (self.explored is None 
+        or self.explored.shape != (maze_height, maze_width)): 
+      self.explored = numpy.zeros((maze_height, maze_width), dtype=bool)
+    return self.explored
+
+
   def print_tree(self): 
     def _print_tree(tree, depth):
       dash = " >" * depth
@@ -56,8 +138,11 @@ class MemoryTree:
     EXAMPLE STR OUTPUT
       "bedroom, kitchen, dining room, office, bathroom"
     """
-    x = ", ".join(list(self.tree[curr_world].keys()))
-    return x
+    key = ("sectors", curr_world)
+    if key not in self.prompt_strs: 
+      x = ", ".join(list(self.tree[curr_world].keys()))
+      self.prompt_strs[key] = x
+    return self.prompt_strs[key]
 
 
   def get_str_accessible_sector_arenas(self, sector): 
@@ -75,10 +160,14 @@ class MemoryTree:
     EXAMPLE STR OUTPUT
       "bedroom, kitchen, dining room, office, bathroom"
     """
+    key = ("sector_arenas", sector)
+    if key in self.prompt_strs: 
+      return self.prompt_strs[key]
     curr_world, curr_sector = sector.split(":")
     if not curr_sector: 
       return ""
     x = ", ".join(list(self.tree[curr_world][curr_sector].keys()))
+    self.prompt_strs[key] = x
     return x
 
 
@@ -96,6 +185,9 @@ class MemoryTree:
     EXAMPLE STR OUTPUT
       "phone, charger, bed, nightstand"
     """
+    key = ("arena_game_objects", arena)
+    if key in self.prompt_strs: 
+      return self.prompt_strs[key]
     curr_world, curr_sector, curr_arena = arena.split(":")
 
     if not curr_arena: 
@@ -105,6 +197,7 @@ class MemoryTree:
       x = ", ".join(list(self.tree[curr_world][curr_sector][curr_arena]))
     except: 
       x = ", ".join(list(self.tree[curr_world][curr_sector][curr_arena.lower()]))
+    self.prompt_strs[key] = x
     return x
 
 
@@ -10,6 +10,8 @@ paper.
 """
 import math
 import sys
+import os
+import json
 import datetime
 import random
 sys.path.append('../')
@@ -27,6 +29,10 @@ from persona.cognitive_modules.reflect import *
 from persona.cognitive_modules.execute import *
 from persona.cognitive_modules.converse import *
 
+# <JOURNAL_FILE> is the append-only checkpoint journal that Persona.save_delta
+# writes next to the full snapshot in the bootstrap_memory folder. 
+JOURNAL_FILE = "journal.jsonl"
+
 class Persona: 
   def __init__(self, name, folder_mem_saved=False):
     # PERSONA BASE STATE 
@@ -47,6 +53,11 @@ class Persona:
     scratch_saved = f"{folder_mem_saved}/bootstrap_memory/scratch.json"
     self.scratch = Scratch(scratch_saved)
 
+    # CHECKPOINT JOURNAL 
+    # Changes saved since the last full snapshot live in the journal; we 
+    # replay them on top of the snapshot we just loaded. 
+    self.replay_journal(f"{folder_mem_saved}/bootstrap_memory")
+
 
   def save(self, save_folder): 
     """
@@ -77,6 +88,115 @@ class Persona:
     f_scratch = f"{save_folder}/scratch.json"
     self.scratch.save(f_scratch)
 
+    # A full save is a compaction: everything in the journal is now part of 
+    # the snapshot. 
+    if os.path.exists(f"{save_folder}/{JOURNAL_FILE}"): 
+      os.remove(f"{save_folder}/{JOURNAL_FILE}")
+    self.journal_size = 0
+    self.mark_checkpoint()
+
+
+  def save_delta(self, save_folder): 
+    """
+    Appends what changed since the last checkpoint to the journal in 
+    save_folder: the new associative memory nodes (with their embeddings), 
+    the scratch fields whose values changed, and the spatial memory tree if
+    it changed. Unlike save, the cost scales with the size of the change 
+    rather than the size of the persona's memory. The folder must hold the 
+    snapshot this persona was loaded from or last saved to. 
+
+    INPUT: 
+      save_folder: The folder where we wil be saving our persona's state. 
+    OUTPUT: 
+      None
+    """
+    entry = dict()
+    entry["nodes"] = []
+    matrix = self.a_mem.embeddings.get_matrix()
+    for count in range(self.checkpoint_node_count + 1, 
+                       len(self.a_mem.id_to_node) + 1): 
+      node = self.a_mem.id_to_node[f"node_{str(count)}"]
+      node_details = self.a_mem.node_to_dict(node)
+      node_details["embedding"] = matrix[node.embedding_row].tolist()
+      entry["nodes"] += [node_details]
+
+    scratch = self.scratch.to_dict()
+    entry["scratch"] = dict()
+    for key, val in scratch.items(): 
+      if json.dumps(val) != self.checkpoint_scratch.get(key): 
+        entry["scratch"][key] = val
+
+    if json.dumps(self.s_mem.tree) != self.checkpoint_s_mem: 
+      entry["spatial_memory"] = self.s_mem.tree
+
+    with open(f"{save_folder}/{JOURNAL_FILE}", "a") as outfile: 
+      outfile.write(json.dumps(entry) + "\n")
+    self.journal_size += 1
+    self.mark_checkpoint()
+
+
+  def checkpoint(self, save_folder, compact_every): 
+    """
+    Saves the persona's state incrementally. Every <compact_every>-th 
+    checkpoint compacts the journal into a full snapshot. 
+
+    INPUT: 
+      save_folder: The folder where we wil be saving our persona's state. 
+      compact_every: Number of journal entries to keep before compacting. 
+    OUTPUT: 
+      None
+    """
+    if self.journal_size >= compact_every: 
+      self.save(save_folder)
+    else: 
+      self.save_delta(save_folder)
+
+
+  def mark_checkpoint(self): 
+    """
+    Records the current state as the baseline that the next save_delta 
+    diffs against. The scratch fields and the spatial memory are kept as 
+    JSON strings so that in-place edits of lists are still detected. 
+    """
+    self.checkpoint_node_count = len(self.a_mem.id_to_node)
+    self.checkpoint_scratch = {key: json.dumps(val) for key, val 
+                               in self.scratch.to_dict().items()}
+    self.checkpoint_s_mem = json.dumps(self.s_mem.tree)
+
+
+  def replay_journal(self, bootstrap_folder): 
+    """
+    Applies the journal in bootstrap_folder (if any) to the state that was 
+    loaded from the snapshot, and marks the result as the checkpoint. 
+
+    INPUT: 
+      bootstrap_folder: The persona's bootstrap_memory folder. 
+    OUTPUT: 
+      None
+    """
+    self.journal_size = 0
+    f_journal = f"{bootstrap_folder}/{JOURNAL_FILE}"
+    if os.path.exists(f_journal): 
+      with open(f_journal) as infile: 
+        for line in infile: 
+          try: 
+            entry = json.loads(line)
+          except ValueError: 
+            # A torn write at the end of the journal (e.g., the process was
+            # killed mid-checkpoint); everything before it is intact. 
+            break
+          for node_details in entry["nodes"]: 
+            self.a_mem.add_node(node_details, node_details["embedding"])
+          if entry["scratch"]: 
+            scratch = self.scratch.to_dict()
+            scratch.update(entry["scratch"])
+            self.scratch.load_dict(scratch)
+          if "spatial_memory" in entry: 
+            self.s_mem.tree = entry["spatial_memory"]
+          self.journal_size += 1
+
+    self.mark_checkpoint()
+
 
   def perceive(self, maze):
     """
@@ -0,0 +1,184 @@
+"""
+File: embedding_cache.py
+Description: A persistent embedding store shared by every simulation on the
+machine.
+
+get_embedding keeps an in-process lru_cache, but it is lost on restart and
+every ReverieServer process (and every fork) asks the API for the same texts
+again. This store keeps embeddings in SQLite, keyed by (model, normalized
+text), as raw float32 blobs. It is bounded by size, evicting the least
+recently used vectors first. WAL mode and a busy timeout make it safe for
+several processes to read and write the same file at once.
+
+Settings: EMBEDDING_CACHE (on/off, default on), EMBEDDING_CACHE_PATH,
+EMBEDDING_CACHE_MAX_MB.
+"""
+import os
+import threading
+import time
+
+import numpy as np
+
+from persona.prompt_template.llm_cache import (connect_shared, enable_wal,
+                                               evict_lru)
+
+
+# SQLite's default limit on the number of host parameters in one statement
+# is 999; we stay well below it.
+_CHUNK = 500
+
+
+def normalize_embedding_text(text):
+  """
+  The text we actually embed, which is also the key of the store: newlines
+  become spaces and an empty text becomes "this is blank", as get_embedding
+  has always done.
+  """
+  text = text.replace("\n", " ")
+  if not text:
+    text = "this is blank"
+  return text
+
+
+def to_float32_tuple(embedding):
+  """
+  Rounds an embedding to float32, the precision of the store, so that a
+  vector fresh from the API equals the same vector read back later.
+  """
+  return tuple(np.asarray(embedding, dtype=np.float32).tolist())
+
+
+class EmbeddingCache:
+  def __init__(self, path, max_bytes=1024 * 1024 * 1024):
+    self.path = path
+    self.max_bytes = max_bytes
+    self._local = threading.local()
+    self._lock = threading.Lock()
+
+    self.hits = 0
+    self.misses = 0
+
+    folder = os.path.dirname(os.path.abspath(path))
+    os.makedirs(folder, exist_ok=True)
+    conn = self._conn()
+    enable_wal(conn)
+    conn.execute("""CREATE TABLE IF NOT EXISTS embeddings (
+                      model TEXT NOT NULL,
+                      text TEXT NOT NULL,
+                      vector BLOB NOT NULL,
+                      size INTEGER NOT NULL,
+                      last_used REAL NOT NULL,
+                      PRIMARY KEY (model, text))""")
+    conn.execute("""CREATE INDEX IF NOT EXISTS embeddings_last_used
+                    ON embeddings (last_used)""")
+    conn.commit()
+    self._bytes = conn.execute(
+      "SELECT COALESCE(SUM(size), 0) FROM embeddings").fetchone()[0]
+
+
+  def _conn(self):
+    conn = getattr(self._local, "conn", None)
+    if conn is None:
+      conn = connect_shared(self.path)
+      self._local.conn = conn
+    return conn
+
+
+  def get_many(self, model, texts):
+    """
+    Looks up the embeddings of <texts> and marks the ones found as recently
+    used.
+
+    INPUT
+      model: The embedding model name.
+      texts: A list of normalized texts.
+    OUTPUT
+      A dictionary from each text found to its embedding (a tuple of floats).
+    """
+    conn = self._conn()
+    found = dict()
+    unique = list(dict.fromkeys(texts))
+    for start in range(0, len(unique), _CHUNK):
+      chunk = unique[start:start + _CHUNK]
+      marks = ",".join("?" * len(chunk))
+      rows = conn.execute(
+        f"""SELECT text, vector FROM embeddings
+            WHERE model = ? AND text IN ({marks})""", [model] + chunk)
+      for text, vector in rows:
+        found[text] = tuple(np.frombuffer(vector, dtype=np.float32).tolist())
+    if found:
+      now = time.time()
+      conn.executemany(
+        "UPDATE embeddings SET last_used = ? WHERE model = ? AND text = ?",
+        [(now, model, text) for text in found])
+      conn.commit()
+    self.hits += len(found)
+    self.misses += len(unique) - len(found)
+    return found
+
+
+  def get(self, model, text):
+    return self.get_many(model, [text]).get(text)
+
+
+  def put_many(self, model, pairs):
+    """
+    Stores embeddings, then evicts the least recently used ones if the store
+    is over its size limit.
+
+    INPUT
+      model: The embedding model name.
+      pairs: A list of (normalized text, embedding) pairs.
+    """
+    if not pairs:
+      return
+    now = time.time()
+    rows = []
+    added = 0
+    for text, embedding in pairs:
+      vector = np.asarray(embedding, dtype=np.float32).tobytes()
+      size = len(vector) + len(text.encode("utf-8"))
+      rows += [(model, text, vector, size, now)]
+      added += size
+    conn = self._conn()
+    conn.executemany("""INSERT OR REPLACE INTO embeddings
+                        (model, text, vector, size, last_used)
+                        VALUES (?, ?, ?, ?, ?)""", rows)
+    conn.commit()
+    with self._lock:
+      self._bytes += added
+      over = self._bytes > self.max_bytes
+    if over:
+      total = evict_lru(conn, "embeddings", self.max_bytes)
+      with self._lock:
+        self._bytes = total
+
+
+  def put(self, model, text, embedding):
+    self.put_many(model, [(text, embedding)])
+
+
+  def __len__(self):
+    return self._conn().execute(
+      "SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_embedding_cache():
+  """
+  Returns the process-wide embedding store, or None if EMBEDDING_CACHE is
+  off.
+  """
+  global _cache
+  if os.getenv("EMBEDDING_CACHE", "on").strip().lower() == "off":
+    return None
+  with _cache_lock:
+    if _cache is None:
+      _cache = EmbeddingCache(
+        os.getenv("EMBEDDING_CACHE_PATH", "embedding_cache.sqlite3"),
+        max_bytes=int(float(os.getenv("EMBEDDING_CACHE_MAX_MB", "1024"))
+                      * 1024 * 1024))
+    return _cache
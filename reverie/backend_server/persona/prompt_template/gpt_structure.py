@@ -5,13 +5,22 @@ File: gpt_structure.py
 Description: Wrapper functions for calling OpenAI APIs.
 """
 import json
+import os
 import random
+import re
+import threading
 import openai
 import openai.error
 import time
 from functools import lru_cache
 
 from utils import *
+from persona.prompt_template.llm_client import chat_completion
+from persona.prompt_template.llm_cache import get_llm_cache, LLMCacheMiss
+from persona.prompt_template.embedding_cache import (
+  get_embedding_cache, normalize_embedding_text, to_float32_tuple)
+from persona.prompt_template.llm_backend import get_llm_backend
+from persona.prompt_template.llm_batcher import get_llm_batcher
 
 openai.api_key = openai_api_key
 
@@ -38,15 +47,111 @@ def _api_call_with_backoff(func, *args, max_retries=3, **kwargs):
       else:
         raise
 
+# The cache key of the last request made on each thread, so that the
+# safe_generate_response functions can drop a response that failed
+# validation instead of being served it again on every retry. It also holds
+# the template and text of the last prompt generate_prompt made on the
+# thread, which tell the batcher (llm_batcher.py) what kind of request a 
+# chat request is.
+_last_request = threading.local()
+
+
+def _send_chat(**request):
+  completion = chat_completion(**request)
+  return completion["choices"][0]["message"]["content"]
+
+
+def _send_embeddings(texts, model):
+  return _api_call_with_backoff(
+      get_llm_backend().create_embeddings, texts, model)
+
+
+def get_request_batcher():
+  """
+  Returns the process-wide request batcher (llm_batcher.py), or None when
+  batching is off.
+  """
+  return get_llm_batcher(_send_chat, _send_embeddings)
+
+
+def _request_template(request):
+  """
+  Returns the name of the prompt template that <request> was generated
+  from, if it carries the last prompt generate_prompt made on this thread.
+  """
+  template = getattr(_last_request, "template", None)
+  if template is None:
+    return None
+  name, prompt = template
+  for message in request.get("messages", []):
+    if prompt in str(message.get("content", "")):
+      return name
+  return None
+
+
+def _fetch_chat_content(request):
+  """
+  Sends a chat request, through the batcher when batching is on and the
+  request's template is one it fuses.
+  """
+  batcher = get_request_batcher()
+  if batcher is not None:
+    template = _request_template(request)
+    if template is not None and batcher.batches(template):
+      return batcher.chat(template, request)
+  return _send_chat(**request)
+
+
+def _create_embeddings(texts, model):
+  """
+  Fetches the embeddings of <texts>, through the batcher when batching is
+  on.
+  """
+  batcher = get_request_batcher()
+  if batcher is not None:
+    return batcher.embed(texts, model)
+  return _send_embeddings(texts, model)
+
+
+def _chat_content(**request):
+  """
+  Sends a chat request and returns the text of the response, going through
+  the response cache (llm_cache.py) when LLM_CACHE is on or replay.
+  """
+  cache = get_llm_cache()
+  if cache is None:
+    return _fetch_chat_content(request)
+
+  key = cache.key_for(request)
+  _last_request.cache_key = key
+  content = cache.get(key)
+  if content is not None:
+    return content
+  if cache.replay_only:
+    raise LLMCacheMiss(key)
+  content = _fetch_chat_content(request)
+  cache.put(key, request.get("model"), content)
+  return content
+
+
+def _discard_last_response():
+  """
+  Removes the response of this thread's last request from the cache.
+  """
+  key = getattr(_last_request, "cache_key", None)
+  cache = get_llm_cache()
+  if cache is not None and key is not None:
+    cache.discard(key)
+  _last_request.cache_key = None
+
+
 def ChatGPT_single_request(prompt):
   temp_sleep()
 
-  completion = _api_call_with_backoff(
-    openai.ChatCompletion.create,
+  return _chat_content(
     model="gpt-4o-mini",
     messages=[{"role": "user", "content": prompt}]
   )
-  return completion["choices"][0]["message"]["content"]
 
 
 # ============================================================================
@@ -68,13 +173,14 @@ def GPT4_request(prompt):
   temp_sleep()
 
   try:
-    completion = _api_call_with_backoff(
-    openai.ChatCompletion.create,
+    return _chat_content(
     model="gpt-4o",
     messages=[{"role": "user", "content": prompt}]
     )
-    return completion["choices"][0]["message"]["content"]
 
+  except LLMCacheMiss:
+    # A replay miss must reach the caller, not become an answer. 
+    raise
   except:
     print ("ChatGPT ERROR")
     return "ChatGPT ERROR"
@@ -94,13 +200,14 @@ def ChatGPT_request(prompt):
   """
   # temp_sleep()
   try:
-    completion = _api_call_with_backoff(
-    openai.ChatCompletion.create,
+    return _chat_content(
     model="gpt-4o-mini",
     messages=[{"role": "user", "content": prompt}]
     )
-    return completion["choices"][0]["message"]["content"]
 
+  except LLMCacheMiss:
+    # A replay miss must reach the caller, not become an answer. 
+    raise
   except:
     print ("ChatGPT ERROR")
     return "ChatGPT ERROR"
@@ -146,12 +253,15 @@ def GPT4_safe_generate_response(prompt,
 
       if func_validate(curr_gpt_response, prompt=prompt):
         return func_clean_up(curr_gpt_response, prompt=prompt)
+      _discard_last_response()
 
       if verbose:
         print ("---- repeat count: \n", i, curr_gpt_response)
         print (curr_gpt_response)
         print ("~~~~")
 
+    except LLMCacheMiss:
+      raise
     except:
       pass
 
@@ -184,12 +294,15 @@ def ChatGPT_safe_generate_response(prompt,
 
       if func_validate(curr_gpt_response, prompt=prompt):
         return func_clean_up(curr_gpt_response, prompt=prompt)
+      _discard_last_response()
 
       if verbose:
         print ("---- repeat count: \n", i, curr_gpt_response)
         print (curr_gpt_response)
         print ("~~~~")
 
+    except LLMCacheMiss:
+      raise
     except:
       pass
 
@@ -216,6 +329,8 @@ def ChatGPT_safe_generate_response_OLD(prompt,
         print (curr_gpt_response)
         print ("~~~~")
 
+    except LLMCacheMiss: 
+      raise
     except: 
       pass
   print ("FAIL SAFE TRIGGERED") 
@@ -240,8 +355,7 @@ def GPT_request(prompt, gpt_parameter):
   """
   temp_sleep()
   try:
-    response = _api_call_with_backoff(
-                openai.ChatCompletion.create,
+    return _chat_content(
                 model="gpt-4o-mini",
                 messages=[{"role": "user", "content": prompt}],
                 temperature=gpt_parameter["temperature"],
@@ -251,12 +365,70 @@ def GPT_request(prompt, gpt_parameter):
                 presence_penalty=gpt_parameter["presence_penalty"],
                 stream=gpt_parameter["stream"],
                 stop=gpt_parameter["stop"],)
-    return response.choices[0].message.content
+  except LLMCacheMiss:
+    raise
   except:
     print ("TOKEN LIMIT EXCEEDED")
     return "TOKEN LIMIT EXCEEDED"
 
 
+# A "!<INPUT n>!" slot of a prompt template. 
+_SLOT = re.compile(r"!<INPUT (0|[1-9][0-9]*)>!")
+_COMMENT_MARKER = "<commentblockmarker>###</commentblockmarker>"
+
+# The compiled prompt templates read so far, as path -> (mtime, segments). 
+# Templates do not change while a simulation runs, so each file is read and
+# compiled only once. With PROMPT_TEMPLATE_RELOAD=on we check the file's 
+# mtime on every call and recompile it if it has changed, which is handy 
+# while editing prompts. 
+_prompt_templates = dict()
+
+
+def compile_prompt_template(template): 
+  """
+  Splits the text of a prompt template into literal and slot segments. 
+  Everything up to the comment block marker (if any) is dropped, as 
+  generate_prompt has always done. 
+
+  INPUT
+    template: The raw text of a prompt template file. 
+  OUTPUT
+    A list of segments: strs are literal text, ints are the numbers of the 
+    "!<INPUT n>!" slots. 
+  EXAMPLE OUTPUT
+    Given "Hi !<INPUT 0>!, it is !<INPUT 1>!.", 
+    ["Hi ", 0, ", it is ", 1, "."]
+  """
+  if _COMMENT_MARKER in template: 
+    template = template.split(_COMMENT_MARKER)[1]
+  segments = []
+  for count, part in enumerate(_SLOT.split(template)): 
+    # re.split puts the captured slot numbers at the odd positions. 
+    if count % 2: 
+      segments += [int(part)]
+    elif part: 
+      segments += [part]
+  return segments
+
+
+def load_prompt_template(prompt_lib_file): 
+  """
+  Returns the compiled segments of a prompt template file (see 
+  compile_prompt_template), reading the file only the first time it is 
+  asked for, or again if it has changed and PROMPT_TEMPLATE_RELOAD is on. 
+  """
+  cached = _prompt_templates.get(prompt_lib_file)
+  reload = os.getenv("PROMPT_TEMPLATE_RELOAD", "off").strip().lower() == "on"
+  if cached is not None and not reload: 
+    return cached[1]
+  mtime = os.path.getmtime(prompt_lib_file)
+  if cached is None or cached[0] != mtime: 
+    with open(prompt_lib_file, "r") as f: 
+      cached = (mtime, compile_prompt_template(f.read()))
+    _prompt_templates[prompt_lib_file] = cached
+  return cached[1]
+
+
 def generate_prompt(curr_input, prompt_lib_file): 
   """
   Takes in the current input (e.g. comment that you want to classifiy) and 
@@ -275,14 +447,21 @@ def generate_prompt(curr_input, prompt_lib_file):
     curr_input = [curr_input]
   curr_input = [str(i) for i in curr_input]
 
-  f = open(prompt_lib_file, "r")
-  prompt = f.read()
-  f.close()
-  for count, i in enumerate(curr_input):   
-    prompt = prompt.replace(f"!<INPUT {count}>!", i)
-  if "<commentblockmarker>###</commentblockmarker>" in prompt: 
-    prompt = prompt.split("<commentblockmarker>###</commentblockmarker>")[1]
-  return prompt.strip()
+  # Slots without an input are left as they are. 
+  prompt = []
+  for segment in load_prompt_template(prompt_lib_file): 
+    if type(segment) == int: 
+      if segment < len(curr_input): 
+        segment = curr_input[segment]
+      else: 
+        segment = f"!<INPUT {segment}>!"
+    prompt += [segment]
+  prompt = "".join(prompt).strip()
+
+  # Remember which template the prompt came from, for the batcher. 
+  name = prompt_lib_file.replace(os.sep, "/").split("prompt_template/")[-1]
+  _last_request.template = (name, prompt)
+  return prompt
 
 
 def safe_generate_response(prompt, 
@@ -299,6 +478,7 @@ def safe_generate_response(prompt,
     curr_gpt_response = GPT_request(prompt, gpt_parameter)
     if func_validate(curr_gpt_response, prompt=prompt): 
       return func_clean_up(curr_gpt_response, prompt=prompt)
+    _discard_last_response()
     if verbose: 
       print ("---- repeat count: ", i, curr_gpt_response)
       print (curr_gpt_response)
@@ -310,9 +490,7 @@ _EMBEDDING_DICT_CACHE = {}
 
 
 def get_embedding(text, model="text-embedding-3-small"):
-  text = text.replace("\n", " ")
-  if not text:
-    text = "this is blank"
+  text = normalize_embedding_text(text)
   emb = _get_embedding_cached(text, model)
   # Also populate the dict cache used by get_embeddings_batch
   _EMBEDDING_DICT_CACHE[(text, model)] = emb
@@ -321,17 +499,26 @@ def get_embedding(text, model="text-embedding-3-small"):
 
 @lru_cache(maxsize=4096)
 def _get_embedding_cached(text, model):
-  response = _api_call_with_backoff(
-      openai.Embedding.create, input=[text], model=model)
-  return tuple(response['data'][0]['embedding'])
+  # The persistent store (embedding_cache.py) is shared across processes
+  # and restarts; the lru_cache above is the per-process layer over it.
+  store = get_embedding_cache()
+  if store is not None:
+    emb = store.get(model, text)
+    if emb is not None:
+      return emb
+  vectors = _create_embeddings([text], model)
+  emb = to_float32_tuple(vectors[0])
+  if store is not None:
+    store.put(model, text, emb)
+  return emb
 
 
 def get_embeddings_batch(texts, model="text-embedding-3-small"):
   """Get embeddings for multiple texts in a single API call.
 
-  Uses a dict cache (_EMBEDDING_DICT_CACHE) shared with the lru_cache.
-  Cached texts are returned immediately; uncached texts are batched into
-  a single openai.Embedding.create call.
+  Uses a dict cache (_EMBEDDING_DICT_CACHE) shared with the lru_cache, then
+  the persistent embedding store. Cached texts are returned immediately;
+  the rest are batched into a single call to the backend (llm_backend.py).
 
   INPUT:
     texts: list of strings to embed
@@ -342,32 +529,40 @@ def get_embeddings_batch(texts, model="text-embedding-3-small"):
   if not texts:
     return []
 
-  cleaned = [t.replace("\n", " ") or "this is blank" for t in texts]
+  cleaned = [normalize_embedding_text(t) for t in texts]
 
   # Separate cached from uncached
   results = {}
   uncached = []
-  uncached_indices = []
-  for i, text in enumerate(cleaned):
+  for text in cleaned:
     cache_key = (text, model)
     if cache_key in _EMBEDDING_DICT_CACHE:
-      results[i] = _EMBEDDING_DICT_CACHE[cache_key]
-    else:
+      results[text] = _EMBEDDING_DICT_CACHE[cache_key]
+    elif text not in uncached:
       uncached.append(text)
-      uncached_indices.append(i)
+
+  # Then the persistent store, shared with other simulations
+  store = get_embedding_cache()
+  if uncached and store is not None:
+    for text, emb in store.get_many(model, uncached).items():
+      results[text] = emb
+      _EMBEDDING_DICT_CACHE[(text, model)] = emb
+    uncached = [text for text in uncached if text not in results]
 
   # Single batch API call for all uncached texts
   if uncached:
-    response = _api_call_with_backoff(
-        openai.Embedding.create, input=uncached, model=model)
-    for j, item in enumerate(response['data']):
-      emb = tuple(item['embedding'])
-      idx = uncached_indices[j]
-      results[idx] = emb
+    vectors = _create_embeddings(uncached, model)
+    fetched = []
+    for j, vector in enumerate(vectors):
+      emb = to_float32_tuple(vector)
+      results[uncached[j]] = emb
+      fetched.append((uncached[j], emb))
       # Store in dict cache for future batch calls
       _EMBEDDING_DICT_CACHE[(uncached[j], model)] = emb
+    if store is not None:
+      store.put_many(model, fetched)
 
-  return [results[i] for i in range(len(texts))]
+  return [results[text] for text in cleaned]
 
 
 if __name__ == '__main__':
@@ -0,0 +1,499 @@
+"""
+File: llm_backend.py
+Description: Pluggable backends behind gpt_structure.py.
+
+gpt_structure.py sends chat requests through llm_client.py and embedding
+requests through _api_call_with_backoff. Both end in a backend chosen with
+LLM_BACKEND:
+  openai  the OpenAI API (default).
+  local   LocalLLMBackend, a deterministic stand-in that needs no network.
+
+LocalLLMBackend recognizes which prompt template a request was generated
+from, and answers in the format that template's run_gpt_prompt_* function
+parses and validates: hours for wake_up_hour, numbered plans for
+daily_planning, one of the offered options for the location prompts, the
+{"output": ...} json of the ChatGPT-style prompts, and so on; a fused
+prompt of llm_batcher.py gets a json object of such answers. Answers are a
+function of the prompt, so a rerun gives the same simulation. Embeddings are
+unit vectors seeded by a hash of the text. Latency (LOCAL_LLM_LATENCY_MS)
+and jitter (LOCAL_LLM_JITTER_MS) make it useful for benchmarking the
+scheduler, the caches and the memory code end to end on an offline machine.
+"""
+import abc
+import asyncio
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+
+import numpy as np
+import openai
+
+from persona.prompt_template.llm_batcher import split_fused_prompt
+
+
+class LLMBackend(abc.ABC):
+  """
+  The interface of a backend. chat_completion takes the keyword arguments of
+  openai.ChatCompletion.create and returns a response of the same shape;
+  create_embeddings returns one vector (a list of floats) per text. A 
+  backend that lacks either cannot be created, so it fails at start-up 
+  rather than at its first request. 
+  """
+  @abc.abstractmethod
+  async def chat_completion(self, **request):
+    pass
+
+
+  @abc.abstractmethod
+  def create_embeddings(self, texts, model):
+    pass
+
+
+class OpenAIBackend(LLMBackend):
+  async def chat_completion(self, **request):
+    return await openai.ChatCompletion.acreate(**request)
+
+
+  def create_embeddings(self, texts, model):
+    response = openai.Embedding.create(input=texts, model=model)
+    return [item["embedding"] for item in response["data"]]
+
+
+# ============================================================================
+# #########################[SECTION 1: TEMPLATES] ############################
+# ============================================================================
+
+TEMPLATE_ROOT = os.path.dirname(os.path.abspath(__file__))
+COMMENT_MARKER = "<commentblockmarker>###</commentblockmarker>"
+
+# What ChatGPT_safe_generate_response and GPT4_safe_generate_response wrap
+# around a prompt; such requests expect {"output": ...} json back.
+_JSON_WRAPPER = re.compile(r'^(?:GPT-3 Prompt:\n)?"""\n(.*)\n"""\n'
+                           r'Output the response to the prompt above in json',
+                           re.S)
+
+
+def _digest(*keys):
+  return hashlib.sha256("\x1f".join(str(k) for k in keys)
+                        .encode("utf-8")).digest()
+
+
+def _pick(options, *keys):
+  """
+  A deterministic choice among <options>, seeded by <keys>.
+  """
+  options = list(options)
+  return options[int.from_bytes(_digest(*keys)[:8], "big") % len(options)]
+
+
+def _last(pattern, text, default=""):
+  found = re.findall(pattern, text)
+  return found[-1] if found else default
+
+
+def _hour_of(hour_str):
+  """
+  "07:00 AM" -> 7, "12:00 PM" -> 12, "00:00 AM" -> 0, "01:00 PM" -> 13.
+  """
+  m = re.search(r"(\d{1,2}):\d{2} ?([AP]M)", hour_str)
+  if not m:
+    return 0
+  hour = int(m.group(1)) % 12
+  if m.group(2) == "PM":
+    hour += 12
+  return hour
+
+
+def _activity_for_hour(hour):
+  if hour < 6 or hour >= 23:
+    return "sleeping"
+  if hour == 6:
+    return "waking up and getting ready"
+  if hour == 7:
+    return "having breakfast"
+  if hour == 12:
+    return "having lunch"
+  if hour == 18:
+    return "having dinner"
+  if hour >= 19:
+    return "relaxing at home"
+  return "working on the day's tasks"
+
+
+def _options(pattern, prompt):
+  return [i.strip() for i in _last(pattern, prompt).split(",") if i.strip()]
+
+
+# ---- handlers, one per template run_gpt_prompt.py uses ----
+# Each takes the prompt and returns the answer; json templates return the
+# value of "output".
+
+def _wake_up_hour(prompt):
+  return f"{_pick([6, 7, 8], prompt)}am"
+
+
+def _daily_plan(prompt):
+  wake = int(_last(r"at (\d{1,2}):00 am, 2\)", prompt, "7"))
+  items = [f"eat breakfast at {wake + 1}:00 am",
+           f"work on the day's tasks from {wake + 2}:00 am to 12:00 pm",
+           "have lunch at 12:00 pm",
+           "work on the day's tasks from 1:00 pm to 5:00 pm",
+           "have dinner at 6:00 pm",
+           "relax from 7:00 pm to 10:00 pm",
+           "go to bed at 11:00 pm"]
+  # The parser keeps an item when the next number follows it, so the list
+  # ends with one more, unparsed, item.
+  ret = items[0]
+  for count, item in enumerate(items[1:] + ["sleep"]):
+    ret += f", {count + 3}) {item}"
+  return " " + ret
+
+
+def _hourly_schedule(prompt):
+  hour = _hour_of(_last(r"-- (\d{1,2}:\d{2} ?[AP]M)\] Activity:", prompt))
+  return " " + _activity_for_hour(hour)
+
+
+def _hourly_schedule_batch(prompt):
+  hours = re.findall(r"-- (\d{1,2}:\d{2} ?[AP]M)\]", prompt)
+  return "\n".join(_activity_for_hour(_hour_of(h)) for h in hours)
+
+
+def _task_decomp(prompt):
+  total = int(prompt.split("(total duration in minutes")[-1]
+                    .split("):")[0].strip())
+  name = prompt.rstrip().rsplit("1) ", 1)[-1].split(" is")[0]
+  if total >= 15:
+    step = max(5, total // 3 // 5 * 5)
+    durations = [step, step, total - 2 * step]
+  else:
+    durations = [total]
+  subtasks = ["getting started", "working on it", "finishing up"]
+  lines = []
+  left = total
+  for count, duration in enumerate(durations):
+    left -= duration
+    line = (f"{subtasks[count]} (duration in minutes: {duration}, "
+            f"minutes left: {left})")
+    if count:
+      line = f"{count + 1}) {name} is {line}"
+    lines += [line]
+  return " " + "\n".join(lines)
+
+
+def _action_sector(prompt):
+  options = _options(r"Area options: \{(.*?)\}", prompt)
+  living = _last(r"lives in \{(.*?)\}", prompt)
+  current = _last(r"is currently in \{(.*?)\}", prompt)
+  task = _last(r"For (.*?), .*? should go to the following area", prompt)
+  if any(w in task for w in ("sleep", "bed", "wak")) and living in options:
+    return living + "}"
+  if current in options and _pick([0, 1], task, "stay"):
+    return current + "}"
+  return _pick(options or [living], task) + "}"
+
+
+def _action_arena(prompt):
+  options = _options(r"\(MUST pick one of \{(.*?)\}\)", prompt)
+  task = _last(r"For (.*?), .*? should go to the following area", prompt)
+  return _pick(options or ["main room"], task) + "}"
+
+
+def _action_object(prompt):
+  options = _options(r"Objects available: \{(.*?)\}", prompt)
+  activity = _last(r"Current activity: (.*)", prompt)
+  return _pick(options or ["bed"], activity)
+
+
+def _pronunciatio(prompt):
+  action = prompt.lower()[-300:]
+  if "sleep" in action:
+    return "😴"
+  if any(w in action for w in ("breakfast", "lunch", "dinner", "eat")):
+    return "🍽️"
+  return _pick(["🙂", "💼", "📖", "☕", "🎨", "🚶"], prompt)
+
+
+def _event_triple(prompt):
+  desc = _last(r"Input: .*? is (.*?)\.\s*\nOutput: \(", prompt, "idle")
+  desc = desc.replace(',', ' ').replace(')', ' ')
+  return f" is, {desc.strip()})"
+
+
+def _obj_event(prompt):
+  return "being used"
+
+
+def _new_decomp_schedule(prompt):
+  first = prompt.split("\n")[0]
+  end = first.split(" to ")[-1].strip()[:5]
+  plan = prompt.split("\nBut ")[0]
+  action = _last(r"\d\d:\d\d ~ \d\d:\d\d -- (.*)", plan, "idle")
+  return f" {end} -- {action}"
+
+
+def _decide_to_talk(prompt):
+  return _pick(["no", "no", "no", "yes"], prompt)
+
+
+def _decide_to_react(prompt):
+  return " Keep going.\nAnswer: Option " + _pick(["2", "2", "2", "1"], prompt)
+
+
+def _create_conversation(prompt):
+  names = re.findall(r"\n(.*?) and (.*?) are in .*?\. What would they talk "
+                     r"about now\?", prompt)
+  other = names[-1][1] if names else "Friend"
+  return f'Hi, how are you?"\n{other}: "Good, thanks!"'
+
+
+def _summarize_conversation(prompt):
+  return "catching up with each other"
+
+
+def _keywords(prompt):
+  desc = _last(r"Description of an event or a conversation: (.*)", prompt)
+  words = [w.strip(".,!?\"'").lower() for w in desc.split()]
+  words = [w for w in words if len(w) > 3][:3] or ["event"]
+  return " " + ", ".join(words) + "\nEmotive keywords: calm"
+
+
+def _free_text(prompt):
+  return _pick(["It was a pleasant day",
+                "There is a lot to do today",
+                "It is good to see friends around town",
+                "Things are going as planned"], prompt)
+
+
+def _poignancy(prompt):
+  if "idle" in prompt[-400:]:
+    return "1"
+  return str(_pick(range(2, 7), prompt))
+
+
+def _poignancy_batch(prompt):
+  items = re.findall(r"(?m)^\d+\. (?:Event|Thought|Conversation): (.*)$",
+                     prompt)
+  return [1 if "idle" in item else _pick(range(2, 7), prompt, item)
+          for item in items]
+
+
+def _focal_points(prompt):
+  n = int(_last(r"what are (\d+) most salient", prompt, "3"))
+  return str([f"What matters most right now (question {i + 1})"
+              for i in range(n)])
+
+
+def _insights(prompt):
+  n = int(_last(r"What (\d+) high-level insights", prompt, "3"))
+  count = len(re.findall(r"(?m)^\d+\. ", prompt)) or 1
+  lines = [f"insight {i + 1} about the day (because of {i % count})"
+           for i in range(n)]
+  ret = lines[0]
+  for i, line in enumerate(lines[1:]):
+    ret += f"\n{i + 2}. {line}"
+  return " " + ret
+
+
+def _agent_chat(prompt):
+  names = re.findall(r"This is what is in (.*?)'s head", prompt)
+  names = (names + ["Someone", "Someone else"])[:2]
+  return [[names[0], "Hi!"], [names[1], "Hello there!"]]
+
+
+def _iterative_chat(prompt):
+  name = _last(r"what should (.*?) say to .*? next", prompt, "Someone")
+  convo = prompt.split("Here is their conversation so far:")[-1]
+  convo = convo.split("\n---")[0]
+  n_lines = len([i for i in convo.strip().split("\n")
+                 if ": " in i and not i.startswith("[")])
+  return json.dumps({
+    name: _pick(["Hi, how is your day going?",
+                 "That sounds great.",
+                 "I should get going, see you later!"], prompt),
+    f"Did the conversation end with {name}'s utterance?":
+      "true" if n_lines >= 4 else "false"})
+
+
+def _safety_score(prompt):
+  return json.dumps({"output": 1})
+
+
+TEMPLATE_HANDLERS = {
+  "v2/wake_up_hour_v1.txt": _wake_up_hour,
+  "v2/daily_planning_v6.txt": _daily_plan,
+  "v2/generate_hourly_schedule_v2.txt": _hourly_schedule,
+  "v2/generate_hourly_schedule_batch_v1.txt": _hourly_schedule_batch,
+  "v2/task_decomp_v3.txt": _task_decomp,
+  "v1/action_location_sector_v1.txt": _action_sector,
+  "v1/action_location_object_vMar11.txt": _action_arena,
+  "v1/action_object_v2.txt": _action_object,
+  "v3_ChatGPT/generate_pronunciatio_v1.txt": _pronunciatio,
+  "v2/generate_event_triple_v1.txt": _event_triple,
+  "v3_ChatGPT/generate_obj_event_v1.txt": _obj_event,
+  "v2/new_decomp_schedule_v1.txt": _new_decomp_schedule,
+  "v2/decide_to_talk_v2.txt": _decide_to_talk,
+  "v2/decide_to_react_v1.txt": _decide_to_react,
+  "v2/create_conversation_v2.txt": _create_conversation,
+  "v3_ChatGPT/summarize_conversation_v1.txt": _summarize_conversation,
+  "v2/get_keywords_v1.txt": _keywords,
+  "v2/keyword_to_thoughts_v1.txt": _free_text,
+  "v2/convo_to_thoughts_v1.txt": _free_text,
+  "v3_ChatGPT/poignancy_event_v1.txt": _poignancy,
+  "v3_ChatGPT/poignancy_thought_v1.txt": _poignancy,
+  "v3_ChatGPT/poignancy_chat_v1.txt": _poignancy,
+  "v3_ChatGPT/poignancy_batch_v1.txt": _poignancy_batch,
+  "v3_ChatGPT/generate_focal_pt_v1.txt": _focal_points,
+  "v2/insight_and_evidence_v1.txt": _insights,
+  "v3_ChatGPT/summarize_chat_ideas_v1.txt": _free_text,
+  "v3_ChatGPT/summarize_chat_relationship_v2.txt": _free_text,
+  "v3_ChatGPT/agent_chat_v1.txt": _agent_chat,
+  "v3_ChatGPT/summarize_ideas_v1.txt": _free_text,
+  "v2/generate_next_convo_line_v1.txt": _free_text,
+  "v2/whisper_inner_thought_v1.txt": _free_text,
+  "v2/planning_thought_on_convo_v1.txt": _free_text,
+  "v3_ChatGPT/memo_on_convo_v1.txt": _free_text,
+  "safety/anthromorphosization_v1.txt": _safety_score,
+  "v3_ChatGPT/iterative_convo_v1.txt": _iterative_chat,
+}
+
+
+class TemplateMatcher:
+  def __init__(self, names, root=TEMPLATE_ROOT):
+    # For every template, the literal text between its !<INPUT n>! slots.
+    # A prompt generated from a template contains all of it, in order.
+    self.templates = []
+    for name in names:
+      with open(os.path.join(root, name), encoding="utf-8") as f:
+        body = f.read()
+      if COMMENT_MARKER in body:
+        body = body.split(COMMENT_MARKER)[1]
+      chunks = [c.strip() for c in re.split(r"!<INPUT \d+>!", body.strip())]
+      self.templates += [(name, [c for c in chunks if c])]
+
+
+  def match(self, prompt):
+    """
+    Returns the name of the template that <prompt> was most likely generated
+    from (the one whose literal text covers most of it), or None.
+    """
+    best, best_score = None, 0
+    for name, chunks in self.templates:
+      pos = 0
+      score = 0
+      for chunk in chunks:
+        found = prompt.find(chunk, pos)
+        if found < 0:
+          score = 0
+          break
+        pos = found + len(chunk)
+        score += len(chunk)
+      if score > best_score:
+        best, best_score = name, score
+    return best
+
+
+# ============================================================================
+# #######################[SECTION 2: LOCAL BACKEND] ##########################
+# ============================================================================
+
+class LocalLLMBackend(LLMBackend):
+  def __init__(self, latency_ms=0.0, jitter_ms=0.0, embedding_dim=1536):
+    self.latency_ms = latency_ms
+    self.jitter_ms = jitter_ms
+    self.embedding_dim = embedding_dim
+    self.matcher = TemplateMatcher(TEMPLATE_HANDLERS.keys())
+    # Requests answered per template (None for unrecognized prompts).
+    self.template_counts = dict()
+    self._lock = threading.Lock()
+
+
+  def delay(self, key):
+    """
+    Seconds to wait for a request. The jitter is seeded by the request, so
+    a rerun sees the same latencies.
+    """
+    jitter = 0.0
+    if self.jitter_ms:
+      jitter = random.Random(_digest(key)).uniform(-self.jitter_ms,
+                                                   self.jitter_ms)
+    return max(0.0, self.latency_ms + jitter) / 1000.0
+
+
+  def respond(self, content):
+    """
+    Returns the text of the answer to a user message.
+    """
+    prompts = split_fused_prompt(content)
+    if prompts is not None:
+      # A multi-answer prompt of the batcher (llm_batcher.py).
+      return json.dumps({str(count + 1): self.respond(prompt)
+                         for count, prompt in enumerate(prompts)},
+                        ensure_ascii=False)
+
+    m = _JSON_WRAPPER.match(content)
+    prompt = m.group(1) if m else content
+    template = self.matcher.match(prompt)
+    with self._lock:
+      self.template_counts[template] = (
+        self.template_counts.get(template, 0) + 1)
+
+    if template is None:
+      answer = _free_text(prompt)
+    else:
+      answer = TEMPLATE_HANDLERS[template](prompt)
+    if m:
+      return json.dumps({"output": answer}, ensure_ascii=False)
+    return answer
+
+
+  async def chat_completion(self, **request):
+    content = "\n".join(str(i.get("content", ""))
+                        for i in request.get("messages", []))
+    await asyncio.sleep(self.delay(content))
+    answer = self.respond(content)
+    return {"object": "chat.completion",
+            "model": request.get("model"),
+            "choices": [{"index": 0,
+                         "message": {"role": "assistant",
+                                     "content": answer},
+                         "finish_reason": "stop"}]}
+
+
+  def embed(self, text, model):
+    seed = int.from_bytes(_digest(model, text)[:8], "big")
+    v = np.random.default_rng(seed).standard_normal(self.embedding_dim)
+    return (v / np.linalg.norm(v)).tolist()
+
+
+  def create_embeddings(self, texts, model):
+    time.sleep(self.delay("\n".join(texts)))
+    return [self.embed(text, model) for text in texts]
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_llm_backend():
+  """
+  Returns the process-wide backend selected with LLM_BACKEND.
+  """
+  global _backend
+  with _backend_lock:
+    if _backend is None:
+      name = os.getenv("LLM_BACKEND", "openai").strip().lower()
+      if name == "local":
+        _backend = LocalLLMBackend(
+          latency_ms=float(os.getenv("LOCAL_LLM_LATENCY_MS", "0")),
+          jitter_ms=float(os.getenv("LOCAL_LLM_JITTER_MS", "0")),
+          embedding_dim=int(os.getenv("LOCAL_LLM_EMBEDDING_DIM", "1536")))
+      elif name == "openai":
+        _backend = OpenAIBackend()
+      else:
+        raise ValueError(f"Unknown LLM_BACKEND: {name}")
+    return _backend
@@ -0,0 +1,347 @@
+"""
+File: llm_batcher.py
+Description: Micro-batching of concurrent requests of the same kind.
+
+Within a step, the persona threads of reverie.py (move_phase_a) often make
+the same kind of call at about the same time. Every persona asks for the
+emoji of its new action (pronunciatio), its event triple and the poignancy
+of what it perceived, and embeds a few texts. Each of these requests is
+small, so most of their time is spent in round trips.
+
+With LLM_BATCH_WINDOW_MS > 0, RequestBatcher holds these requests for up to
+that many milliseconds and fuses whatever arrives in the window:
+  - Chat requests that come from the same prompt template (one of
+    LLM_BATCH_TEMPLATES) and share a model and parameters are fused into
+    one multi-answer prompt. That prompt asks for a json object with one
+    answer per prompt.
+  - Every caller gets back its own answer, cut at its stop sequences just
+    as the single request would have been.
+  - An answer that is missing from the response is sent again on its own by
+    its caller.
+  - Embedding requests for the same model are fused into one embeddings
+    call.
+The first request of a batch waits out the window, or until the batch is
+full (LLM_BATCH_MAX), and then sends the batch. The other requests wait for
+its result.
+
+Requests and upstream calls are counted per template (report()), so a
+benchmark can show how much each template gained.
+"""
+import json
+import os
+import re
+import threading
+
+
+# The multi-answer prompt. Each prompt is in its own numbered block, and the
+# answer is a json object keyed by the block numbers.
+FUSED_INTRO = ("Below are {n} independent prompts. Answer each of them on "
+               "its own, exactly as you would answer it if it were the only "
+               "prompt.\n\n")
+FUSED_BLOCK = "=== PROMPT {i} ===\n{prompt}\n"
+FUSED_OUTRO = ("=== END ===\n\nOutput ONLY a json object that maps the number "
+               "of each prompt (as a string) to your answer to it (as a "
+               'string), for example {"1": "...", "2": "..."}.')
+_FUSED_INTRO = re.compile(r"^Below are (\d+) independent prompts\. ")
+_FUSED_BLOCK = re.compile(r"(?m)^=== PROMPT (\d+) ===\n")
+
+# Default LLM_BATCH_TEMPLATES: the short, single-answer prompts that every
+# persona sends in most steps.
+DEFAULT_TEMPLATES = ("v3_ChatGPT/generate_pronunciatio_v1.txt",
+                     "v2/generate_event_triple_v1.txt",
+                     "v3_ChatGPT/poignancy_event_v1.txt",
+                     "v3_ChatGPT/poignancy_thought_v1.txt",
+                     "v3_ChatGPT/poignancy_chat_v1.txt")
+
+# The name embeddings are counted under in the stats.
+EMBEDDINGS = "embeddings"
+
+
+def fuse_prompts(prompts):
+  """
+  Returns the text of one prompt that asks for an answer to each of
+  <prompts>.
+  """
+  ret = FUSED_INTRO.format(n=len(prompts))
+  for count, prompt in enumerate(prompts):
+    ret += FUSED_BLOCK.format(i=count + 1, prompt=prompt)
+  return ret + FUSED_OUTRO
+
+
+def split_fused_prompt(text):
+  """
+  The inverse of fuse_prompts: returns the list of prompts in <text>, or
+  None if <text> is not a fused prompt.
+  """
+  m = _FUSED_INTRO.match(text)
+  if not m or FUSED_OUTRO not in text:
+    return None
+  body = text[:text.rindex(FUSED_OUTRO)]
+  blocks = _FUSED_BLOCK.split(body)[1:]
+  # <blocks> alternates between block numbers and block texts. Each block
+  # text ends with the newline that FUSED_BLOCK added.
+  prompts = [block[:-1] for block in blocks[1::2]]
+  if len(prompts) != int(m.group(1)):
+    return None
+  return prompts
+
+
+def split_fused_answer(text, n):
+  """
+  Returns the <n> answers in the response <text> to a fused prompt, with
+  None for each answer that is missing.
+  """
+  answers = [None] * n
+  start, end = text.find("{"), text.rfind("}") + 1
+  try:
+    found = json.loads(text[start:end])
+  except ValueError:
+    return answers
+  if not isinstance(found, dict):
+    return answers
+  for count in range(n):
+    answer = found.get(str(count + 1))
+    if answer is None:
+      continue
+    if not isinstance(answer, str):
+      # e.g., {"output": "5"} written as an object rather than a string.
+      answer = json.dumps(answer)
+    answers[count] = answer
+  return answers
+
+
+def cut_at_stop(answer, stop):
+  """
+  Cuts <answer> at the first of the stop sequence(s) <stop>, as the API
+  does for a single request.
+  """
+  if not stop:
+    return answer
+  for sequence in ([stop] if isinstance(stop, str) else stop):
+    if sequence and sequence in answer:
+      answer = answer[:answer.index(sequence)]
+  return answer
+
+
+class _Batch:
+  def __init__(self):
+    self.items = []
+    self.full = threading.Event()
+    self.done = threading.Event()
+    self.results = None
+    self.error = None
+
+
+class RequestBatcher:
+  def __init__(self,
+               send_chat,
+               send_embeddings,
+               window_ms=5,
+               max_batch=16,
+               templates=DEFAULT_TEMPLATES):
+    # <send_chat> takes the keyword arguments of a chat request and returns
+    # the text of the answer; <send_embeddings> takes a list of texts and a
+    # model and returns one vector per text.
+    self.send_chat = send_chat
+    self.send_embeddings = send_embeddings
+    self.window = max(0.0, float(window_ms)) / 1000.0
+    self.max_batch = max(1, int(max_batch))
+    self.templates = set(templates)
+
+    # The open batch of each kind of request, as key -> <_Batch>.
+    self._pending = dict()
+    self._lock = threading.Lock()
+
+    # Per template: requests, upstream calls, calls that carried more than
+    # one request, and requests that had to be resent on their own.
+    self._stats = dict()
+
+
+  def batches(self, template):
+    return template in self.templates
+
+
+  def _count(self, name, requests=0, calls=0, fused=0, fallbacks=0):
+    with self._lock:
+      row = self._stats.setdefault(
+        name, {"requests": 0, "calls": 0, "fused": 0, "fallbacks": 0})
+      row["requests"] += requests
+      row["calls"] += calls
+      row["fused"] += fused
+      row["fallbacks"] += fallbacks
+
+
+  def _join(self, key, item, flush):
+    """
+    Adds <item> to the open batch of <key> and returns its result. The
+    request that opens a batch waits out the window, then runs <flush> on
+    the batch's items; <flush> returns one result per item.
+    """
+    with self._lock:
+      batch = self._pending.get(key)
+      leader = batch is None
+      if leader:
+        batch = _Batch()
+        self._pending[key] = batch
+      slot = len(batch.items)
+      batch.items += [item]
+      if len(batch.items) >= self.max_batch:
+        # Full; close it so the next request opens a new one.
+        del self._pending[key]
+        batch.full.set()
+
+    if leader:
+      batch.full.wait(self.window)
+      with self._lock:
+        if self._pending.get(key) is batch:
+          del self._pending[key]
+      try:
+        batch.results = flush(batch.items)
+      except Exception as e:
+        batch.error = e
+      batch.done.set()
+    else:
+      batch.done.wait()
+
+    if batch.error is not None:
+      raise batch.error
+    return batch.results[slot]
+
+
+  def chat(self, template, request):
+    """
+    Sends the chat <request>, generated from <template>, fused with other
+    requests of the same template that arrive within the window.
+
+    INPUT
+      template: The name of the prompt template, e.g.,
+                "v3_ChatGPT/generate_pronunciatio_v1.txt".
+      request: The keyword arguments of the chat request.
+    OUTPUT
+      The text of the answer.
+    """
+    messages = request.get("messages") or []
+    if len(messages) != 1:
+      self._count(template, requests=1, calls=1)
+      return self.send_chat(**request)
+
+    params = {k: v for k, v in request.items()
+              if k not in ("messages", "max_tokens")}
+    key = (template, json.dumps(params, sort_keys=True, default=str))
+    answer = self._join(key, request,
+                        lambda items: self._flush_chat(template, items))
+    if answer is None:
+      self._count(template, calls=1, fallbacks=1)
+      answer = self.send_chat(**request)
+    return answer
+
+
+  def _flush_chat(self, template, requests):
+    if len(requests) == 1:
+      self._count(template, requests=1, calls=1)
+      return [self.send_chat(**requests[0])]
+
+    # Identical prompts (two personas in the same situation) are asked once.
+    contents = [r["messages"][0]["content"] for r in requests]
+    unique = list(dict.fromkeys(contents))
+
+    fused = dict(requests[0])
+    stop = fused.pop("stop", None)
+    fused["messages"] = [{"role": "user", "content": fuse_prompts(unique)}]
+    if fused.get("max_tokens"):
+      # Room for every answer, plus the json around them.
+      fused["max_tokens"] = (sum(int(r.get("max_tokens") or 0)
+                                 for r in requests)
+                             + 10 * len(unique))
+    self._count(template, requests=len(requests), calls=1,
+                fused=len(requests))
+    try:
+      answers = split_fused_answer(self.send_chat(**fused), len(unique))
+    except Exception:
+      # Each caller resends its request on its own.
+      answers = [None] * len(unique)
+    answers = dict(zip(unique, answers))
+    return [None if answers[c] is None else cut_at_stop(answers[c], stop)
+            for c in contents]
+
+
+  def embed(self, texts, model):
+    """
+    Returns the embeddings of <texts>, fetched in one call together with the
+    other embedding requests for <model> that arrive within the window.
+    """
+    return self._join((EMBEDDINGS, model), list(texts),
+                      lambda items: self._flush_embeddings(model, items))
+
+
+  def _flush_embeddings(self, model, items):
+    unique = list(dict.fromkeys(text for texts in items for text in texts))
+    self._count(EMBEDDINGS, requests=len(items), calls=1,
+                fused=len(items) if len(items) > 1 else 0)
+    vectors = dict(zip(unique, self.send_embeddings(unique, model)))
+    return [[vectors[text] for text in texts] for texts in items]
+
+
+  def stats(self):
+    """
+    Returns a copy of the per-template counts: name -> {"requests",
+    "calls", "fused", "fallbacks"}.
+    """
+    with self._lock:
+      return {name: dict(row) for name, row in self._stats.items()}
+
+
+  def reset_stats(self):
+    with self._lock:
+      self._stats = dict()
+
+
+  def report(self):
+    """
+    Returns the per-template counts as printable lines. "gain" is the number
+    of requests per upstream call.
+    """
+    lines = [f"{'template':<42} {'requests':>8} {'calls':>6} "
+             f"{'fused':>6} {'resent':>6} {'gain':>6}"]
+    for name, row in sorted(self.stats().items()):
+      gain = row["requests"] / row["calls"] if row["calls"] else 0.0
+      lines += [f"{name:<42} {row['requests']:>8} {row['calls']:>6} "
+                f"{row['fused']:>6} {row['fallbacks']:>6} {gain:>5.2f}x"]
+    return lines
+
+
+# The process-wide batcher: None until LLM_BATCH_WINDOW_MS is first read,
+# then the <RequestBatcher>, or False if batching is off.
+_batcher = None
+_batcher_lock = threading.Lock()
+
+
+def get_llm_batcher(send_chat, send_embeddings):
+  """
+  Returns the process-wide batcher, configured from LLM_BATCH_WINDOW_MS,
+  LLM_BATCH_MAX and LLM_BATCH_TEMPLATES, or None when batching is off
+  (LLM_BATCH_WINDOW_MS=0, the default). The send functions are those of
+  RequestBatcher, and are only used when the batcher is first created.
+
+  The settings are read once. After that, every request (batching on or
+  off) gets the answer without taking the lock.
+  """
+  global _batcher
+  batcher = _batcher
+  if batcher is None:
+    with _batcher_lock:
+      if _batcher is None:
+        window_ms = float(os.getenv("LLM_BATCH_WINDOW_MS", "0"))
+        if window_ms <= 0:
+          _batcher = False
+        else:
+          templates = os.getenv("LLM_BATCH_TEMPLATES", "")
+          templates = ([i.strip() for i in templates.split(",")
+                        if i.strip()]
+                       or DEFAULT_TEMPLATES)
+          _batcher = RequestBatcher(
+            send_chat, send_embeddings, window_ms=window_ms,
+            max_batch=int(os.getenv("LLM_BATCH_MAX", "16")),
+            templates=templates)
+      batcher = _batcher
+  return batcher or None
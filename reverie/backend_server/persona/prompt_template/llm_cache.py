@@ -0,0 +1,253 @@
+"""
+File: llm_cache.py
+Description: A persistent, content-addressed cache of LLM responses.
+
+The same prompts come back again and again, across forks of a simulation
+and across reruns of benchmark.py: the poignancy of "bed is idle", the
+emoji for a recurring action, and so on. This cache stores the response
+text in SQLite, keyed by a hash of the whole request (model, messages and
+parameters). Entries are evicted least-recently-used first once the cache
+grows past its size limit.
+
+Modes (LLM_CACHE):
+  off     no cache (default).
+  on      read from the cache, and call the API and store the response on a
+          miss.
+  replay  read-only. A miss raises LLMCacheMiss instead of calling the API,
+          so a rerun costs no API calls and gives the same result every
+          time.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+CACHE_MODES = ("off", "on", "replay")
+
+# How long, in seconds, a connection waits for the locks of other processes.
+BUSY_TIMEOUT = 30
+
+
+class LLMCacheMiss(Exception):
+  """
+  Raised in replay mode when a request is not in the cache.
+  """
+  pass
+
+
+class LLMResponseCache:
+  def __init__(self, path, max_bytes=512 * 1024 * 1024, replay_only=False):
+    self.path = path
+    self.max_bytes = max_bytes
+    self.replay_only = replay_only
+
+    # sqlite3 connections cannot be shared between threads, so every thread
+    # gets its own.
+    self._local = threading.local()
+    self._lock = threading.Lock()
+
+    self.hits = 0
+    self.misses = 0
+
+    folder = os.path.dirname(os.path.abspath(path))
+    os.makedirs(folder, exist_ok=True)
+    conn = self._conn()
+    enable_wal(conn)
+    conn.execute("""CREATE TABLE IF NOT EXISTS responses (
+                      key TEXT PRIMARY KEY,
+                      model TEXT,
+                      response TEXT NOT NULL,
+                      size INTEGER NOT NULL,
+                      last_used REAL NOT NULL)""")
+    conn.execute("""CREATE INDEX IF NOT EXISTS responses_last_used
+                    ON responses (last_used)""")
+    conn.commit()
+    self._bytes = self.total_bytes()
+
+
+  def _conn(self):
+    conn = getattr(self._local, "conn", None)
+    if conn is None:
+      conn = connect_shared(self.path)
+      self._local.conn = conn
+    return conn
+
+
+  @staticmethod
+  def key_for(request):
+    """
+    Returns the cache key of a request: the sha256 of its keyword arguments
+    in canonical JSON form.
+
+    INPUT
+      request: The keyword arguments of openai.ChatCompletion.create.
+    OUTPUT
+      A hex str.
+    """
+    canonical = json.dumps(request, sort_keys=True, ensure_ascii=False,
+                           default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+  def get(self, key):
+    """
+    Returns the cached response str for <key>, or None, and marks the entry
+    as recently used.
+    """
+    conn = self._conn()
+    row = conn.execute("SELECT response FROM responses WHERE key = ?",
+                       (key,)).fetchone()
+    if row is None:
+      self.misses += 1
+      return None
+    self.hits += 1
+    if not self.replay_only:
+      conn.execute("UPDATE responses SET last_used = ? WHERE key = ?",
+                   (time.time(), key))
+      conn.commit()
+    return row[0]
+
+
+  def put(self, key, model, response):
+    """
+    Stores <response> under <key>, then evicts the least recently used
+    entries if the cache is over its size limit.
+    """
+    if self.replay_only:
+      return
+    size = len(response.encode("utf-8")) + len(key)
+    conn = self._conn()
+    conn.execute("""INSERT OR REPLACE INTO responses
+                    (key, model, response, size, last_used)
+                    VALUES (?, ?, ?, ?, ?)""",
+                 (key, model, response, size, time.time()))
+    conn.commit()
+    with self._lock:
+      self._bytes += size
+      over = self._bytes > self.max_bytes
+    if over:
+      self.evict()
+
+
+  def discard(self, key):
+    """
+    Removes <key> from the cache, e.g., when its response failed validation
+    and should not be served again.
+    """
+    if self.replay_only:
+      return
+    conn = self._conn()
+    conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+    conn.commit()
+
+
+  def total_bytes(self):
+    row = self._conn().execute(
+      "SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()
+    return row[0]
+
+
+  def __len__(self):
+    return self._conn().execute(
+      "SELECT COUNT(*) FROM responses").fetchone()[0]
+
+
+  def evict(self):
+    """
+    Deletes least recently used entries until the cache is at 90% of
+    max_bytes.
+    """
+    total = evict_lru(self._conn(), "responses", self.max_bytes)
+    with self._lock:
+      self._bytes = total
+
+
+def connect_shared(path):
+  """
+  Opens a connection to the SQLite file <path>, which other processes may
+  use at the same time. The busy timeout is set before anything else, so
+  every later statement waits for their locks rather than failing.
+  """
+  conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT)
+  conn.execute(f"PRAGMA busy_timeout = {int(BUSY_TIMEOUT * 1000)}")
+  conn.execute("PRAGMA synchronous=NORMAL")
+  return conn
+
+
+def enable_wal(conn):
+  """
+  Switches the file of <conn> to WAL mode, which lets several simulations
+  read and write it at once. The mode is kept in the file, so a store does
+  this once, when it is created, and not for every connection. The busy 
+  handler does not cover this switch, so we retry "database is locked" 
+  here ourselves, for up to BUSY_TIMEOUT seconds.
+  """
+  deadline = time.monotonic() + BUSY_TIMEOUT
+  delay = 0.01
+  while True:
+    try:
+      conn.execute("PRAGMA journal_mode=WAL")
+      return
+    except sqlite3.OperationalError as e:
+      if "locked" not in str(e) or time.monotonic() >= deadline:
+        raise
+      time.sleep(delay)
+      delay = min(delay * 2, 0.5)
+
+
+def evict_lru(conn, table, max_bytes):
+  """
+  Deletes the least recently used rows of <table> until its total size is
+  at 90% of <max_bytes>. Other processes may write to the same file, so we
+  start from the size on disk rather than from any count kept in memory.
+
+  INPUT
+    conn: An sqlite3 connection.
+    table: A table with "size" and "last_used" columns.
+    max_bytes: The size limit of the table.
+  OUTPUT
+    The total size of the table after eviction.
+  """
+  total = conn.execute(
+    f"SELECT COALESCE(SUM(size), 0) FROM {table}").fetchone()[0]
+  if total <= max_bytes:
+    return total
+  target = int(max_bytes * 0.9)
+  doomed = []
+  for rowid, size in conn.execute(
+      f"SELECT rowid, size FROM {table} ORDER BY last_used"):
+    if total <= target:
+      break
+    doomed += [(rowid,)]
+    total -= size
+  conn.executemany(f"DELETE FROM {table} WHERE rowid = ?", doomed)
+  conn.commit()
+  return total
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_llm_cache():
+  """
+  Returns the process-wide response cache configured from LLM_CACHE,
+  LLM_CACHE_PATH and LLM_CACHE_MAX_MB, or None if caching is off.
+  """
+  global _cache
+  mode = os.getenv("LLM_CACHE", "off").strip().lower()
+  if mode not in CACHE_MODES:
+    raise ValueError(f"LLM_CACHE must be one of {CACHE_MODES}: {mode}")
+  if mode == "off":
+    return None
+  with _cache_lock:
+    if _cache is None:
+      _cache = LLMResponseCache(
+        os.getenv("LLM_CACHE_PATH", "llm_cache.sqlite3"),
+        max_bytes=int(float(os.getenv("LLM_CACHE_MAX_MB", "512"))
+                      * 1024 * 1024),
+        replay_only=(mode == "replay"))
+    return _cache
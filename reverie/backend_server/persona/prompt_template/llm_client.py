@@ -0,0 +1,209 @@
+"""
+File: llm_client.py
+Description: A process-wide asyncio request layer for the chat API.
+
+Requests come from many places at once: the persona threads of
+reverie.py, and the smaller thread pools inside plan.py. Without a shared
+layer, nothing bounds the total number of requests in flight. This module
+runs every chat request on one background event loop. That loop enforces:
+  - a semaphore on the number of requests in flight (LLM_MAX_CONCURRENCY),
+  - token buckets for requests per minute and tokens per minute (LLM_RPM,
+    LLM_TPM; 0 turns a limit off),
+  - coalescing: identical requests that are in flight at the same time are
+    sent once, and every caller gets the same response.
+The synchronous chat_completion() wrapper lets the existing blocking code
+(GPT_request, ChatGPT_request, GPT4_request and the safe_generate_response
+functions above them) use this layer without any change.
+"""
+import asyncio
+import json
+import os
+import threading
+import time
+
+import openai
+import openai.error
+
+from persona.prompt_template.llm_backend import get_llm_backend
+
+
+def estimate_tokens(request):
+  """
+  A rough count of the tokens a chat request uses (prompt plus completion),
+  for the tokens-per-minute bucket. We count ~4 characters per token and
+  assume max_tokens (or 256) for the completion.
+
+  INPUT
+    request: The keyword arguments of the chat request.
+  OUTPUT
+    An int number of tokens.
+  """
+  prompt_chars = sum(len(str(m.get("content", "")))
+                     for m in request.get("messages", []))
+  return prompt_chars // 4 + 1 + int(request.get("max_tokens") or 256)
+
+
+class TokenBucket:
+  def __init__(self, per_minute):
+    # <per_minute> is both the refill rate and the capacity of the bucket,
+    # so a burst can use up one minute's worth at once.
+    self.capacity = float(per_minute)
+    self.rate = self.capacity / 60.0
+    self.tokens = self.capacity
+    self.updated = time.monotonic()
+
+
+  def _refill(self):
+    now = time.monotonic()
+    self.tokens = min(self.capacity,
+                      self.tokens + (now - self.updated) * self.rate)
+    self.updated = now
+
+
+  async def acquire(self, amount=1):
+    """
+    Waits until <amount> tokens are available and takes them. A request
+    larger than the whole bucket only waits for a full bucket.
+    """
+    amount = min(float(amount), self.capacity)
+    while True:
+      self._refill()
+      if self.tokens >= amount:
+        self.tokens -= amount
+        return
+      await asyncio.sleep((amount - self.tokens) / self.rate)
+
+
+class AsyncLLMClient:
+  def __init__(self,
+               max_concurrency=8,
+               rpm=0,
+               tpm=0,
+               max_retries=3,
+               request_func=None):
+    # <request_func> is an async function that takes the keyword arguments
+    # of openai.ChatCompletion.create. It defaults to the backend selected
+    # with LLM_BACKEND (llm_backend.py).
+    self.max_concurrency = max(1, int(max_concurrency))
+    self.rpm_bucket = TokenBucket(rpm) if rpm and rpm > 0 else None
+    self.tpm_bucket = TokenBucket(tpm) if tpm and tpm > 0 else None
+    self.max_retries = max_retries
+    self.request_func = request_func or get_llm_backend().chat_completion
+
+    # Counters, for benchmarking and tests.
+    self.n_requests = 0
+    self.n_coalesced = 0
+
+    # The semaphore and the in-flight table belong to the event loop; we
+    # only touch them from coroutines on that loop.
+    self._semaphore = None
+    self._in_flight = dict()
+
+    # The background loop for the synchronous wrapper, started on first use.
+    self._loop = None
+    self._loop_lock = threading.Lock()
+
+
+  async def chat_completion(self, **request):
+    """
+    Sends a chat request, or waits for an identical request that is already
+    in flight.
+
+    INPUT
+      request: The keyword arguments of openai.ChatCompletion.create.
+    OUTPUT
+      The response of the API.
+    """
+    key = json.dumps(request, sort_keys=True, default=str)
+    if key in self._in_flight:
+      self.n_coalesced += 1
+      return await asyncio.shield(self._in_flight[key])
+
+    task = asyncio.ensure_future(self._send(request))
+    self._in_flight[key] = task
+    task.add_done_callback(lambda _: self._in_flight.pop(key, None))
+    return await asyncio.shield(task)
+
+
+  async def _send(self, request):
+    # Same retry policy as _api_call_with_backoff in gpt_structure.py:
+    # exponential backoff (1s, 2s, 4s), no retry for authentication and
+    # invalid requests. We wait outside the semaphore, so a backing-off
+    # request does not hold a slot.
+    if self._semaphore is None:
+      self._semaphore = asyncio.Semaphore(self.max_concurrency)
+    for attempt in range(self.max_retries):
+      if self.rpm_bucket:
+        await self.rpm_bucket.acquire(1)
+      if self.tpm_bucket:
+        await self.tpm_bucket.acquire(estimate_tokens(request))
+      try:
+        async with self._semaphore:
+          self.n_requests += 1
+          return await self.request_func(**request)
+      except (openai.error.AuthenticationError,
+              openai.error.InvalidRequestError):
+        raise
+      except Exception:
+        if attempt < self.max_retries - 1:
+          await asyncio.sleep(2 ** attempt)
+        else:
+          raise
+
+
+  def _get_loop(self):
+    with self._loop_lock:
+      if self._loop is None:
+        loop = asyncio.new_event_loop()
+        thread = threading.Thread(target=loop.run_forever,
+                                  name="llm-client", daemon=True)
+        thread.start()
+        self._loop = loop
+      return self._loop
+
+
+  def chat_completion_sync(self, **request):
+    """
+    Blocking version of chat_completion(), safe to call from any thread
+    other than the client's own event loop.
+    """
+    future = asyncio.run_coroutine_threadsafe(
+      self.chat_completion(**request), self._get_loop())
+    return future.result()
+
+
+  def close(self):
+    """
+    Stops the background event loop, if it was started.
+    """
+    with self._loop_lock:
+      if self._loop is not None:
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._loop = None
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_llm_client():
+  """
+  Returns the process-wide client, configured from LLM_MAX_CONCURRENCY,
+  LLM_RPM and LLM_TPM.
+  """
+  global _client
+  with _client_lock:
+    if _client is None:
+      _client = AsyncLLMClient(
+        max_concurrency=int(os.getenv("LLM_MAX_CONCURRENCY", "8")),
+        rpm=int(os.getenv("LLM_RPM", "0")),
+        tpm=int(os.getenv("LLM_TPM", "0")))
+    return _client
+
+
+def chat_completion(**request):
+  """
+  Sends a chat request through the process-wide client and blocks until it
+  returns. Takes the keyword arguments of openai.ChatCompletion.create.
+  """
+  return get_llm_client().chat_completion_sync(**request)
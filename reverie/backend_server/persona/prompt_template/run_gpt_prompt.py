@@ -375,7 +375,8 @@ def run_gpt_prompt_task_decomp(persona,
                                task, 
                                duration, 
                                test_input=None, 
-                               verbose=False): 
+                               verbose=False, 
+                               org_index=None): 
   def create_prompt_input(persona, task, duration, test_input=None):
 
     """
@@ -385,7 +386,12 @@ def run_gpt_prompt_task_decomp(persona,
     and from 07:00am ~08:00am, Maeve is planning on having breakfast.  
     """
       
-    curr_f_org_index = persona.scratch.get_f_daily_schedule_hourly_org_index()
+    # <org_index> is the hourly schedule block that the prompt treats as the
+    # current one; by default, the block of the current time. 
+    curr_f_org_index = org_index
+    if curr_f_org_index is None: 
+      curr_f_org_index = (persona.scratch
+                            .get_f_daily_schedule_hourly_org_index())
     all_indices = []
     # if curr_f_org_index > 0: 
     #   all_indices += [curr_f_org_index-1]
@@ -2151,6 +2157,93 @@ def run_gpt_prompt_chat_poignancy(persona, event_description, test_input=None, v
 
 
 
+def run_gpt_prompt_poignancy_batch(persona, items, test_input=None, verbose=False): 
+  """
+  Rates the poignancy of several of <persona>'s events, thoughts and 
+  conversations with one prompt, instead of one run_gpt_prompt_*_poignancy
+  call per item. 
+
+  INPUT: 
+    persona: The Persona class instance 
+    items: a list of (event_type, description), where event_type is "event",
+           "thought" or "chat". 
+  OUTPUT: 
+    a list with a score (an int between 1 and 10) per item, in order, or 
+    None for an item whose score was missing or invalid in the response. 
+  """
+  kind_names = {"event": "Event", "thought": "Thought", "chat": "Conversation"}
+
+  def create_prompt_input(persona, items, test_input=None): 
+    if test_input: return test_input
+
+    items_str = ""
+    for count, (event_type, description) in enumerate(items): 
+      items_str += f"{count+1}. {kind_names[event_type]}: {description}\n"
+
+    prompt_input = [persona.scratch.name,
+                    persona.scratch.get_str_iss(),
+                    persona.scratch.name,
+                    items_str.strip()]
+    return prompt_input
+
+  # ChatGPT Plugin ===========================================================
+  def __chat_func_clean_up(gpt_response, prompt=""): 
+    if isinstance(gpt_response, str): 
+      try: 
+        gpt_response = json.loads(gpt_response)
+      except json.JSONDecodeError: 
+        gpt_response = None
+    # Only a list with exactly one entry per item can be matched to the 
+    # items. Anything else (e.g., "1. 3\n2. 7") is thrown away as a whole,
+    # and every item falls back to its own single-item prompt. 
+    if not isinstance(gpt_response, list) or len(gpt_response) != len(items): 
+      return [None] * len(items)
+
+    # Every item is validated on its own, so that one bad score does not 
+    # throw away the rest of the response. 
+    scores = []
+    for score in gpt_response: 
+      try: 
+        score = int(score)
+      except (TypeError, ValueError): 
+        score = None
+      if score is not None and not 1 <= score <= 10: 
+        score = None
+      scores += [score]
+    return scores
+
+  def __chat_func_validate(gpt_response, prompt=""): 
+    try: 
+      return any(i is not None for i in __chat_func_clean_up(gpt_response))
+    except: 
+      return False 
+
+  def get_fail_safe(): 
+    return [None] * len(items)
+
+  gpt_param = {"engine": "gpt-4o-mini", "max_tokens": 10 + 5 * len(items), 
+               "temperature": 0, "top_p": 1, "stream": False,
+               "frequency_penalty": 0, "presence_penalty": 0, "stop": None}
+  prompt_template = "persona/prompt_template/v3_ChatGPT/poignancy_batch_v1.txt"
+  prompt_input = create_prompt_input(persona, items, test_input)
+  prompt = generate_prompt(prompt_input, prompt_template)
+  example_output = str([5] * len(items))
+  special_instruction = (f"The output should ONLY contain a list of "
+                         f"{len(items)} integer values on the scale of 1 to "
+                         f"10, one per item.")
+  fail_safe = get_fail_safe()
+  output = ChatGPT_safe_generate_response(prompt, example_output, special_instruction, 3, fail_safe,
+                                          __chat_func_validate, __chat_func_clean_up, True)
+
+  if debug or verbose: 
+    print_run_prompts(prompt_template, persona, gpt_param, 
+                      prompt_input, prompt, output)
+
+  if output != False:
+    return output, [output, prompt, gpt_param, prompt_input, fail_safe]
+  return fail_safe, [fail_safe, prompt, gpt_param, prompt_input, fail_safe]
+
+
 def run_gpt_prompt_focal_pt(persona, statements, n, test_input=None, verbose=False): 
   def create_prompt_input(persona, statements, n, test_input=None): 
     prompt_input = [statements, str(n)]
@@ -36,6 +36,8 @@ from global_methods import *
 from utils import *
 from maze import *
 from persona.persona import *
+from step_scheduler import PipelinedStepScheduler
+from fast_forward import fast_forward_enabled, skip_dormant_steps
 
 ##############################################################################
 #                                  REVERIE                                   #
@@ -55,9 +57,16 @@ class ReverieServer:
     # <sim_code> indicates our current simulation. The first step here is to 
     # copy everything that's in <fork_sim_code>, but edit its 
     # reverie/meta/json's fork variable. 
+    # With FORK_MODE=lineage, we only copy the persona memories and the 
+    # current step, and keep pointing at <fork_sim_code> for the earlier 
+    # environment and movement steps (see copy_sim_lineage). This makes 
+    # forking cost independent of the length of the simulation's history. 
     self.sim_code = sim_code
     sim_folder = f"{fs_storage}/{self.sim_code}"
-    copyanything(fork_folder, sim_folder)
+    if os.getenv("FORK_MODE", "copy").strip().lower() == "lineage": 
+      copy_sim_lineage(fork_folder, sim_folder)
+    else: 
+      copyanything(fork_folder, sim_folder)
 
     with open(f"{sim_folder}/reverie/meta.json") as json_file:  
       reverie_meta = json.load(json_file)
@@ -66,6 +75,14 @@ class ReverieServer:
       reverie_meta["fork_sim_code"] = fork_sim_code
       outfile.write(json.dumps(reverie_meta, indent=2))
 
+    # <lineage> is the (parent sim code, fork step) pair that older steps of
+    # a lineage fork resolve to, or None if this simulation owns its whole 
+    # history. 
+    self.lineage = None
+    if reverie_meta.get("lineage_parent"): 
+      self.lineage = (reverie_meta["lineage_parent"], 
+                      reverie_meta["lineage_step"])
+
     # LOADING REVERIE'S GLOBAL VARIABLES
     # The start datetime of the Reverie: 
     # <start_datetime> is the datetime instance for the start datetime of 
@@ -84,6 +101,10 @@ class ReverieServer:
     # <sec_per_step> denotes the number of seconds in game time that each 
     # step moves foward. 
     self.sec_per_step = reverie_meta['sec_per_step']
+    # <journal_compact_every> is the number of incremental checkpoints (see
+    # save(full=False)) a persona appends to its journal before the journal
+    # is compacted into a full snapshot. 
+    self.journal_compact_every = int(os.getenv("JOURNAL_COMPACT_EVERY", "10"))
     
     # <maze> is the main Maze instance. Note that we pass in the maze_name
     # (e.g., "double_studio") to instantiate Maze. 
@@ -121,7 +142,8 @@ class ReverieServer:
     # self.persona_convo = dict()
 
     # Loading in all personas. 
-    init_env_file = f"{sim_folder}/environment/{str(self.step)}.json"
+    init_env_file = resolve_sim_step_file(sim_folder, "environment", 
+                                          self.step)
     init_env = json.load(open(init_env_file))
     for persona_name in reverie_meta['persona_names']: 
       persona_folder = f"{sim_folder}/personas/{persona_name}"
@@ -131,8 +153,8 @@ class ReverieServer:
 
       self.personas[persona_name] = curr_persona
       self.personas_tile[persona_name] = (p_x, p_y)
-      self.maze.tiles[p_y][p_x]["events"].add(curr_persona.scratch
-                                              .get_curr_event_and_desc())
+      self.maze.add_event_from_tile(curr_persona.scratch
+                                    .get_curr_event_and_desc(), (p_x, p_y))
 
     # REVERIE SETTINGS PARAMETERS:  
     # <server_sleep> denotes the amount of time that our while loop rests each
@@ -156,13 +178,16 @@ class ReverieServer:
       outfile.write(json.dumps(curr_step, indent=2))
 
 
-  def save(self): 
+  def save(self, full=True): 
     """
     Save all Reverie progress -- this includes Reverie's global state as well
     as all the personas.  
 
     INPUT
-      None
+      full: If True, every persona writes a full snapshot (and its journal is
+            compacted away). If False, the personas only append what changed
+            since their last checkpoint to their journal, compacting once 
+            <journal_compact_every> entries have piled up. 
     OUTPUT 
       None
       * Saves all relevant data to the designated memory directory
@@ -179,6 +204,9 @@ class ReverieServer:
     reverie_meta["maze_name"] = self.maze.maze_name
     reverie_meta["persona_names"] = list(self.personas.keys())
     reverie_meta["step"] = self.step
+    if self.lineage: 
+      reverie_meta["lineage_parent"] = self.lineage[0]
+      reverie_meta["lineage_step"] = self.lineage[1]
     reverie_meta_f = f"{sim_folder}/reverie/meta.json"
     with open(reverie_meta_f, "w") as outfile: 
       outfile.write(json.dumps(reverie_meta, indent=2))
@@ -186,7 +214,10 @@ class ReverieServer:
     # Save the personas.
     for persona_name, persona in self.personas.items(): 
       save_folder = f"{sim_folder}/personas/{persona_name}/bootstrap_memory"
-      persona.save(save_folder)
+      if full: 
+        persona.save(save_folder)
+      else: 
+        persona.checkpoint(save_folder, self.journal_compact_every)
 
 
   def start_path_tester_server(self): 
@@ -429,7 +460,8 @@ class ReverieServer:
         time.sleep(self.server_sleep)
 
 
-  def start_server_headless(self, n_steps):
+  def start_server_headless(self, n_steps, scheduler=None, 
+                            fast_forward=None):
     """
     Run n_steps of simulation without frontend synchronization.
     Bypasses file I/O polling for maximum speed. Useful for batch
@@ -437,14 +469,52 @@ class ReverieServer:
 
     INPUT
       n_steps: Number of simulation steps to execute.
+      scheduler: "sequential" runs every persona's phase A of a step before
+                 the step's phase B. "pipelined" uses PipelinedStepScheduler,
+                 which lets unrelated personas move on without waiting for 
+                 each other. Defaults to the HEADLESS_SCHEDULER environment
+                 variable, or "sequential".
+      fast_forward: If True, the sequential scheduler skips the steps in 
+                    which every persona is asleep (see fast_forward.py). 
+                    Defaults to the HEADLESS_FAST_FORWARD environment 
+                    variable, or off.
     OUTPUT
       None
     """
+    if fast_forward is None: 
+      fast_forward = fast_forward_enabled()
+    if not scheduler: 
+      scheduler = os.getenv("HEADLESS_SCHEDULER", "sequential")
+    if scheduler.strip().lower() == "pipelined": 
+      def on_checkpoint(steps_run): 
+        print(f"  Headless step {steps_run}/{n_steps} "
+              f"(time: {self.curr_time.strftime('%B %d, %Y, %H:%M:%S')})")
+        self.save(full=False)
+
+      PipelinedStepScheduler(self).run(n_steps, on_checkpoint=on_checkpoint)
+      self.save()
+      print(f"Headless run complete: {n_steps} steps. "
+            f"Current time: {self.curr_time.strftime('%B %d, %Y, %H:%M:%S')}")
+      return
+
     game_obj_cleanup = dict()
 
     with ThreadPoolExecutor(
         max_workers=min(len(self.personas), 8)) as executor:
-      for step in range(n_steps):
+      step = 0
+      while step < n_steps:
+        # If everyone is asleep, jump straight to the next step at which 
+        # something can happen. 
+        if fast_forward: 
+          skipped = skip_dormant_steps(self, n_steps - step)
+          if skipped: 
+            if (step + skipped) // 100 > step // 100: 
+              self.save(full=False)
+            step += skipped
+            print(f"  Headless fast-forward {skipped} steps "
+                  f"(time: {self.curr_time.strftime('%B %d, %Y, %H:%M:%S')})")
+            continue
+
         # Clean up object actions from previous cycle
         for key, val in game_obj_cleanup.items():
           self.maze.turn_event_from_tile_idle(key, val)
@@ -497,12 +567,13 @@ class ReverieServer:
         # Advance time
         self.step += 1
         self.curr_time += datetime.timedelta(seconds=self.sec_per_step)
+        step += 1
 
         # Periodic save and progress report
-        if (step + 1) % 100 == 0:
-          print(f"  Headless step {step + 1}/{n_steps} "
+        if step % 100 == 0:
+          print(f"  Headless step {step}/{n_steps} "
                 f"(time: {self.curr_time.strftime('%B %d, %Y, %H:%M:%S')})")
-          self.save()
+          self.save(full=False)
 
     # Final save
     self.save()
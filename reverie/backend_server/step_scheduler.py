@@ -0,0 +1,300 @@
+"""
+File: step_scheduler.py
+Description: A pipelined scheduler for ReverieServer.start_server_headless.
+
+The sequential headless loop runs every persona's move_phase_a for a step in
+parallel, waits for all of them, and then runs every move_phase_b in persona
+order. A step therefore takes as long as the slowest persona's LLM calls,
+even for personas that are nowhere near each other.
+
+PipelinedStepScheduler keeps the same per-persona order of operations,
+  step-start maze update -> phase A -> phase B -> movement,
+but only orders the operations of two personas against each other when one
+can observe or change the other:
+  - <linked> personas: one is chatting with, or walking to (<persona>
+    address), the other.
+  - <near> personas: their tiles are close enough that one's movement can
+    change what the other perceives (vision_r of both plus the one tile each
+    can move in a step, plus one tile of slack).
+  - <referenced> personas: after phase A, one of them retrieved an event of
+    the other. Those events are exactly the candidates that
+    _choose_retrieved and _should_react may react to (chat or wait).
+For such a pair, phase B still follows the persona order, phase B waits for
+the other persona's phase A of the same step, and the next phase A waits for
+the other persona's phase B. Unrelated personas run their phase B and their
+next phase A without waiting for each other, up to one step apart.
+
+Phase A runs on the worker threads. Phase B and all maze updates run on the
+calling thread one at a time, as they do in the sequential loop. A maze
+update only changes the events of the tiles its persona stands on or steps
+to, and the ordering rules keep those tiles out of the vision window of any
+phase A that is running. What is not isolated are the maze's shared event
+indexes: a far-away update can still add or drop a tile in, e.g., a cell of
+Maze.arena_event_tiles that a running phase A looks up. Phase A therefore
+only reads those indexes through snapshots, and only reads the events of
+the tiles inside its window (see Maze.get_nearby_arena_events). The one
+read left unordered is in execute: when it chooses among
+the target tiles of an address, it prefers tiles that no persona stands on,
+and it can see a far-away persona one step early or late. That choice is
+made among randomly sampled tiles anyway.
+"""
+import datetime
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+
+class PipelinedStepScheduler:
+  def __init__(self, server, max_workers=8):
+    # <server> is the ReverieServer whose personas, maze and personas_tile we
+    # advance.
+    self.server = server
+    self.max_workers = max_workers
+    # <names> is the persona order of the sequential loop; phase B of related
+    # personas follows it.
+    self.names = list(server.personas.keys())
+
+    # Per-persona scheduling state. <step_of> is the step a persona is
+    # working on (i.e., every earlier step is finished for that persona),
+    # and <stage> is where it is within that step: "moved" (the previous
+    # step's movement is applied, but not this step's start-of-step maze
+    # update), "ready" (waiting to start phase A), "phase_a" (phase A
+    # running) or "phase_b" (phase A done, waiting for phase B).
+    self.step_of = dict()
+    self.stage = dict()
+    self.phase_a_results = dict()
+    self.refs = dict()
+    self.game_obj_cleanup = dict()
+
+
+  def linked(self, name_1, name_2):
+    """
+    Returns True if one persona is chatting with, or heading towards, the
+    other.
+    """
+    for a, b in [(name_1, name_2), (name_2, name_1)]:
+      scratch = self.server.personas[a].scratch
+      if scratch.chatting_with == b:
+        return True
+      if (scratch.act_address
+          and scratch.act_address.startswith("<persona>")
+          and scratch.act_address.split("<persona>")[-1].strip() == b):
+        return True
+    return False
+
+
+  def near(self, name_1, name_2):
+    """
+    Returns True if the two personas are close enough that the movement of
+    one can change what the other perceives.
+    """
+    tile_1 = self.server.personas_tile[name_1]
+    tile_2 = self.server.personas_tile[name_2]
+    reach = (self.server.personas[name_1].scratch.vision_r
+             + self.server.personas[name_2].scratch.vision_r + 3)
+    return (abs(tile_1[0] - tile_2[0]) <= reach
+            and abs(tile_1[1] - tile_2[1]) <= reach)
+
+
+  def related(self, name_1, name_2):
+    return self.near(name_1, name_2) or self.linked(name_1, name_2)
+
+
+  def referenced(self, name_1, name_2):
+    return (name_2 in self.refs.get(name_1, ())
+            or name_1 in self.refs.get(name_2, ()))
+
+
+  def get_refs(self, name, retrieved):
+    """
+    Returns the names of the other personas whose events are in <retrieved>,
+    i.e., the personas that phase B might react to.
+    """
+    refs = set()
+    for rel_ctx in retrieved.values():
+      subject = rel_ctx["curr_event"].subject
+      if subject != name and subject in self.server.personas:
+        refs.add(subject)
+    return refs
+
+
+  def can_start_of_step(self, name):
+    # Related personas may still change this persona in their phase B of the
+    # previous step (e.g., start a chat with it), which the start-of-step
+    # update has to reflect.
+    step = self.step_of[name]
+    for other in self.names:
+      if (other != name and self.step_of[other] < step
+          and self.related(name, other)):
+        return False
+    return True
+
+
+  def can_start_phase_a(self, name, limit_step):
+    step = self.step_of[name]
+    if step >= limit_step:
+      return False
+    for other in self.names:
+      if other == name:
+        continue
+      # At most one step of lag between any two personas, and none at all
+      # between related ones: every related persona must have finished the
+      # previous step and done its start-of-step update, since both can
+      # change what we perceive.
+      if self.step_of[other] < step - 1:
+        return False
+      if (self.related(name, other)
+          and (self.step_of[other] < step
+               or (self.step_of[other] == step
+                   and self.stage[other] == "moved"))):
+        return False
+    return True
+
+
+  def can_start_phase_b(self, name):
+    step = self.step_of[name]
+    order = self.names.index(name)
+    for other in self.names:
+      if other == name or self.step_of[other] > step:
+        continue
+      if self.step_of[other] < step or self.stage[other] != "phase_b":
+        # <other> has not finished phase A of this step yet. In the
+        # sequential loop, every phase A of the step comes before any
+        # phase B.
+        if self.related(name, other):
+          return False
+      elif (self.names.index(other) < order
+            and (self.related(name, other) or self.referenced(name, other))):
+        # Both are waiting for phase B: keep the persona order.
+        return False
+    return True
+
+
+  def start_of_step(self, name):
+    """
+    The maze update that the sequential headless loop does for every persona
+    at the start of a step, done for a single persona.
+    """
+    maze = self.server.maze
+    persona = self.server.personas[name]
+
+    # Clean up object actions from the persona's previous step.
+    for key, val in self.game_obj_cleanup.get(name, dict()).items():
+      maze.turn_event_from_tile_idle(key, val)
+    self.game_obj_cleanup[name] = dict()
+
+    curr_tile = self.server.personas_tile[name]
+    maze.remove_subject_events_from_tile(persona.name, curr_tile)
+    maze.add_event_from_tile(persona.scratch.get_curr_event_and_desc(),
+                             curr_tile)
+    if not persona.scratch.planned_path:
+      self.game_obj_cleanup[name][persona.scratch
+                                  .get_curr_obj_event_and_desc()] = curr_tile
+      maze.add_event_from_tile(persona.scratch.get_curr_obj_event_and_desc(),
+                               curr_tile)
+      blank = (persona.scratch.get_curr_obj_event_and_desc()[0],
+               None, None, None)
+      maze.remove_event_from_tile(blank, curr_tile)
+
+
+  def run_phase_b(self, name):
+    """
+    Runs phase B and applies the movement, then prepares the persona's next
+    step.
+    """
+    maze = self.server.maze
+    persona = self.server.personas[name]
+    new_day, retrieved = self.phase_a_results.pop(name)
+    next_tile, pronunciatio, description = persona.move_phase_b(
+      maze, self.server.personas, retrieved)
+
+    old_tile = self.server.personas_tile[name]
+    self.server.personas_tile[name] = next_tile
+    maze.remove_subject_events_from_tile(persona.name, old_tile)
+    maze.add_event_from_tile(persona.scratch.get_curr_event_and_desc(),
+                             next_tile)
+
+    self.refs.pop(name, None)
+    self.step_of[name] += 1
+    self.stage[name] = "moved"
+
+
+  def run(self, n_steps, checkpoint_every=100, on_checkpoint=None):
+    """
+    Runs n_steps of the simulation.
+
+    INPUT
+      n_steps: Number of simulation steps to execute.
+      checkpoint_every: Every this many steps, all personas are brought to
+                        the same step and on_checkpoint is called.
+      on_checkpoint: Function that takes the number of steps run so far.
+    OUTPUT
+      None
+      * Advances server.step and server.curr_time by n_steps.
+    """
+    server = self.server
+    base_step = server.step
+    base_time = server.curr_time
+    for name in self.names:
+      self.step_of[name] = 0
+      self.stage[name] = "ready"
+      self.start_of_step(name)
+
+    limit_step = min(checkpoint_every, n_steps)
+    running = dict()
+    max_workers = max(1, min(len(self.names), self.max_workers))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+      while True:
+        # Do every start-of-step update and start every phase A that can
+        # go, then run one phase B (the first eligible one in persona
+        # order), and repeat.
+        progress = True
+        while progress:
+          progress = False
+          for name in self.names:
+            if (self.stage[name] == "moved" and self.step_of[name] < n_steps
+                and self.can_start_of_step(name)):
+              self.start_of_step(name)
+              self.stage[name] = "ready"
+              progress = True
+
+          for name in self.names:
+            if (self.stage[name] == "ready"
+                and self.can_start_phase_a(name, limit_step)):
+              curr_time = base_time + datetime.timedelta(
+                seconds=server.sec_per_step * self.step_of[name])
+              future = executor.submit(server.personas[name].move_phase_a,
+                                       server.maze,
+                                       server.personas_tile[name],
+                                       curr_time)
+              running[future] = name
+              self.stage[name] = "phase_a"
+              progress = True
+
+          for name in self.names:
+            if (self.stage[name] == "phase_b"
+                and self.can_start_phase_b(name)):
+              self.run_phase_b(name)
+              progress = True
+              break
+
+        if running:
+          done, _ = wait(list(running.keys()), return_when=FIRST_COMPLETED)
+          for future in done:
+            name = running.pop(future)
+            self.phase_a_results[name] = future.result()
+            self.refs[name] = self.get_refs(name,
+                                            self.phase_a_results[name][1])
+            self.stage[name] = "phase_b"
+          continue
+
+        # Nothing is running and nothing can start: every persona has
+        # reached <limit_step>.
+        if any(self.step_of[name] < limit_step for name in self.names):
+          raise RuntimeError("PipelinedStepScheduler stalled")
+        server.step = base_step + limit_step
+        server.curr_time = base_time + datetime.timedelta(
+          seconds=server.sec_per_step * limit_step)
+        if on_checkpoint and limit_step % checkpoint_every == 0:
+          on_checkpoint(limit_step)
+        if limit_step >= n_steps:
+          break
+        limit_step = min(limit_step + checkpoint_every, n_steps)
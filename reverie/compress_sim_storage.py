@@ -22,13 +22,20 @@ def compress(sim_code):
       persona_names += [x]
 
   max_move_count = max([int(i.split("/")[-1].split(".")[0]) 
-                 for i in find_filenames(move_folder, "json")])
+                 for i in find_filenames(move_folder, "json")], default=-1)
+  # A simulation forked with copy_sim_lineage keeps its earlier steps in its
+  # parent simulation; resolve_sim_step_file finds them there. 
+  with open(meta_file) as json_file: 
+    meta = json.load(json_file)
+  if meta.get("lineage_parent"): 
+    max_move_count = max(max_move_count, meta["lineage_step"] - 1)
   
   persona_last_move = dict()
   master_move = dict()  
   for i in range(max_move_count+1): 
     master_move[i] = dict()
-    with open(f"{move_folder}/{str(i)}.json") as json_file:  
+    move_file = resolve_sim_step_file(sim_storage, "movement", i)
+    with open(move_file) as json_file:  
       i_move_dict = json.load(json_file)["persona"]
       for p in persona_names: 
         move = False
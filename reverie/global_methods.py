@@ -7,6 +7,7 @@ Description: Contains functions used throughout my projects.
 import random
 import string
 import csv
+import json
 import time
 import datetime as dt
 import pathlib
@@ -225,6 +226,68 @@ def copyanything(src, dst):
     else: raise
 
 
+def copy_sim_lineage(src, dst): 
+  """
+  Forks the simulation folder src into dst without copying its history. 
+  Only reverie/meta.json, the personas folder (bootstrap_memory) and the 
+  environment file of the current step are materialized in dst; the 
+  earlier environment/ and movement/ steps stay in src and are found 
+  through the "lineage_parent" and "lineage_step" entries that are added to
+  dst's meta.json (see resolve_sim_step_file). src must therefore stay next
+  to dst in the same storage folder. 
+  ARGS:
+    src: address of the simulation folder we fork from 
+    dst: address of the new simulation folder 
+  RETURNS: 
+    None
+  """
+  with open(f"{src}/reverie/meta.json") as json_file: 
+    meta = json.load(json_file)
+  step = meta["step"]
+
+  create_folder_if_not_there(f"{dst}/reverie/")
+  create_folder_if_not_there(f"{dst}/environment/")
+  create_folder_if_not_there(f"{dst}/movement/")
+  shutil.copytree(f"{src}/personas", f"{dst}/personas")
+  shutil.copy(resolve_sim_step_file(src, "environment", step), 
+              f"{dst}/environment/{step}.json")
+
+  meta["lineage_parent"] = src.rstrip("/").split("/")[-1]
+  meta["lineage_step"] = step
+  with open(f"{dst}/reverie/meta.json", "w") as outfile: 
+    outfile.write(json.dumps(meta, indent=2))
+
+
+def resolve_sim_step_file(sim_folder, sub_folder, step): 
+  """
+  Finds the file of a step (e.g., "environment" or "movement") in a 
+  simulation folder. If a simulation was forked with copy_sim_lineage, the
+  steps before its fork step are looked up in its parent simulation, and so
+  on up the lineage. 
+  ARGS:
+    sim_folder: address of the simulation folder 
+    sub_folder: "environment" or "movement" 
+    step: the step number 
+  RETURNS: 
+    The path to the step file, or None if no simulation in the lineage has it.
+  """
+  while sim_folder: 
+    curr_file = f"{sim_folder}/{sub_folder}/{step}.json"
+    if os.path.exists(curr_file): 
+      return curr_file
+
+    meta_file = f"{sim_folder}/reverie/meta.json"
+    if not os.path.exists(meta_file): 
+      return None
+    with open(meta_file) as json_file: 
+      meta = json.load(json_file)
+    if not meta.get("lineage_parent") or int(step) >= meta["lineage_step"]: 
+      return None
+    sim_folder = os.path.join(os.path.dirname(sim_folder.rstrip("/")), 
+                              meta["lineage_parent"])
+  return None
+
+
 if __name__ == '__main__':
   pass
 
@@ -77,6 +77,7 @@ _run_gpt.run_gpt_prompt_insight_and_guidance = lambda *a, **kw: ({}, None)
 _run_gpt.run_gpt_prompt_event_triple = lambda *a, **kw: (("s", "p", "o"), None)
 _run_gpt.run_gpt_prompt_event_poignancy = lambda *a, **kw: (1, None)
 _run_gpt.run_gpt_prompt_chat_poignancy = lambda *a, **kw: (1, None)
+_run_gpt.run_gpt_prompt_poignancy_batch = lambda persona, items, **kw: ([1] * len(items), None)
 _run_gpt.run_gpt_prompt_planning_thought_on_convo = lambda *a, **kw: ("thought", None)
 _run_gpt.run_gpt_prompt_memo_on_convo = lambda *a, **kw: ("memo", None)
 
@@ -1,8 +1,10 @@
 """tests/test_associative_memory.py -- AssociativeMemory unit tests."""
 import datetime
+import json
 import pathlib
 import sys
 
+import numpy as np
 import pytest
 
 _MEM_DIR = str(pathlib.Path(__file__).resolve().parent.parent
@@ -10,7 +12,8 @@ _MEM_DIR = str(pathlib.Path(__file__).resolve().parent.parent
 if _MEM_DIR not in sys.path:
     sys.path.insert(0, _MEM_DIR)
 
-from associative_memory import AssociativeMemory, ConceptNode
+from associative_memory import (AssociativeMemory, ConceptNode, EmbeddingStore,
+                                convert_memory_format)
 
 FIXTURES = pathlib.Path(__file__).resolve().parent / "fixtures"
 AM_DIR = str(FIXTURES / "associative_memory")
@@ -238,3 +241,119 @@ class TestKwStrengthEvent:
         )
         # "is idle" should NOT increment kw_strength_event
         assert am.kw_strength_event.get("isabella", 0) == 0
+
+
+# ── EmbeddingStore ────────────────────────────────────────────────────
+
+class TestEmbeddingStore:
+    def test_capacity_doubles(self):
+        store = EmbeddingStore(capacity=2)
+        rows = [store.append(f"k{i}", [float(i), 1.0]) for i in range(5)]
+        assert rows == [0, 1, 2, 3, 4]
+        assert store.capacity == 8
+        assert store.get_matrix().shape == (5, 2)
+        assert store.get_matrix()[3].tolist() == [3.0, 1.0]
+
+    def test_norms_precomputed(self):
+        store = EmbeddingStore()
+        store.append("a", [3.0, 4.0])
+        assert store.get_norms().tolist() == [5.0]
+
+    def test_key_lookup_latest_row(self):
+        store = EmbeddingStore()
+        store.append("a", [1.0, 0.0])
+        store.append("a", [0.0, 1.0])
+        assert "a" in store and "b" not in store
+        assert len(store) == 1
+        assert store["a"].tolist() == [0.0, 1.0]
+
+    def test_rows_follow_node_order(self, am):
+        node = _make_event(am, idx=1)
+        chat = am.add_chat(
+            datetime.datetime(2023, 2, 13, 8, 0), None,
+            "Isabella", "chat with", "Maria", "conversing",
+            {"maria"}, 5, ("emb_chat", [0.2] * 10), [])
+        assert (node.embedding_row, chat.embedding_row) == (0, 1)
+        assert am.embeddings.get_matrix().dtype == np.float32
+
+    def test_save_load_round_trip(self, am, tmp_path):
+        for i in range(1, 4):
+            _make_event(am, idx=i, description=f"event {i}")
+        am.embeddings.append("extra", [0.5] * 10)
+        am.save(str(tmp_path))
+
+        loaded = AssociativeMemory(str(tmp_path))
+        assert loaded.embeddings.row_keys == ["emb_1", "emb_2", "emb_3"]
+        assert np.allclose(loaded.embeddings.get_matrix(),
+                           am.embeddings.get_matrix()[:3])
+        assert np.allclose(loaded.embeddings.get_norms(),
+                           am.embeddings.get_norms()[:3])
+
+
+# ── binary format ─────────────────────────────────────────────────────
+
+def _fill_mixed(am):
+    """Adds events, a thought and a chat with varied fields."""
+    _make_event(am, idx=1, description="Isabella is painting")
+    am.add_thought(
+        datetime.datetime(2023, 2, 13, 9, 30),
+        datetime.datetime(2023, 3, 15, 9, 30),
+        "Isabella", "plans", "party", "Isabella plans a party ☕",
+        {"party"}, 8, ("emb_thought", [0.3] * 10), ["node_1"])
+    am.add_chat(
+        datetime.datetime(2023, 2, 13, 10, 0), None,
+        "Isabella", "chat with", "Maria", "conversing about the party",
+        {"maria"}, 4, ("emb_chat", [0.2] * 10),
+        [["Isabella", "hi"], ["Maria", "hello"]])
+    _make_event(am, idx=1, description="Isabella is painting again")
+
+
+class TestBinaryFormat:
+    def test_binary_round_trip(self, am, tmp_path):
+        _fill_mixed(am)
+        am.save(str(tmp_path), "binary")
+        assert (tmp_path / "nodes.npz").exists()
+        assert not (tmp_path / "nodes.json").exists()
+
+        loaded = AssociativeMemory(str(tmp_path))
+        assert isinstance(loaded.embeddings.get_matrix(), np.memmap)
+        for node_id, node in am.id_to_node.items():
+            other = loaded.id_to_node[node_id]
+            for attr in ("type", "type_count", "depth", "created",
+                         "expiration", "subject", "predicate", "object",
+                         "description", "embedding_key", "poignancy",
+                         "keywords", "filling", "embedding_row"):
+                assert getattr(other, attr) == getattr(node, attr)
+        assert np.array_equal(loaded.embeddings.get_matrix(),
+                              am.embeddings.get_matrix())
+        assert loaded.kw_strength_event == am.kw_strength_event
+
+    def test_append_after_mmap_load(self, am, tmp_path):
+        _fill_mixed(am)
+        am.save(str(tmp_path), "binary")
+        loaded = AssociativeMemory(str(tmp_path))
+        node = _make_event(loaded, idx=9, description="new event")
+        assert node.embedding_row == 4
+        assert loaded.embeddings.get_matrix().shape == (5, 10)
+        # 同じフォルダへの再保存（mmap 中のファイルの置き換え）。
+        loaded.save(str(tmp_path), "binary")
+        assert len(AssociativeMemory(str(tmp_path)).id_to_node) == 5
+
+    def test_convert_json_binary_json(self, am, tmp_path):
+        _fill_mixed(am)
+        am.save(str(tmp_path), "json")
+        nodes_before = json.loads((tmp_path / "nodes.json").read_text())
+        emb_before = json.loads((tmp_path / "embeddings.json").read_text())
+
+        convert_memory_format(str(tmp_path), "binary")
+        assert not (tmp_path / "nodes.json").exists()
+        convert_memory_format(str(tmp_path), "json")
+        assert not (tmp_path / "nodes.npz").exists()
+        assert json.loads((tmp_path / "nodes.json").read_text()) == nodes_before
+        assert (json.loads((tmp_path / "embeddings.json").read_text())
+                == emb_before)
+
+    def test_empty_binary(self, am, tmp_path):
+        am.save(str(tmp_path), "binary")
+        loaded = AssociativeMemory(str(tmp_path))
+        assert loaded.id_to_node == {}
@@ -0,0 +1,163 @@
+"""
+tests/test_embedding_cache.py
+
+persona/prompt_template/embedding_cache.py（永続埋め込みキャッシュ）と、
+それを使う gpt_structure.get_embeddings_batch のテスト。
+"""
+import importlib.util
+import pathlib
+import subprocess
+import sys
+import time
+
+import numpy as np
+import openai
+import pytest
+
+import persona.prompt_template.embedding_cache as embedding_cache
+from persona.prompt_template.embedding_cache import (
+    EmbeddingCache,
+    normalize_embedding_text,
+    to_float32_tuple,
+)
+
+BACKEND = pathlib.Path(__file__).resolve().parent.parent / "reverie" \
+    / "backend_server"
+MODEL = "text-embedding-3-small"
+
+
+@pytest.fixture
+def cache_path(tmp_path):
+    return str(tmp_path / "emb.sqlite3")
+
+
+# ================================================================
+# EmbeddingCache
+# ================================================================
+
+class TestEmbeddingCache:
+    def test_roundtrip_float32(self, cache_path):
+        cache = EmbeddingCache(cache_path)
+        vec = [0.1, -0.2, 1 / 3]
+        cache.put(MODEL, "bed is idle", vec)
+        got = EmbeddingCache(cache_path).get(MODEL, "bed is idle")
+        assert got == to_float32_tuple(vec)
+        assert got == tuple(np.float32(v).item() for v in vec)
+
+    def test_keyed_by_model_and_text(self, cache_path):
+        cache = EmbeddingCache(cache_path)
+        cache.put(MODEL, "a", [1.0])
+        cache.put("other-model", "a", [2.0])
+        assert cache.get_many(MODEL, ["a", "b", "a"]) == {"a": (1.0,)}
+        assert cache.get("other-model", "a") == (2.0,)
+        assert (cache.hits, cache.misses) == (2, 1)
+
+    def test_many_texts_chunked(self, cache_path):
+        cache = EmbeddingCache(cache_path)
+        texts = [f"text {i}" for i in range(1200)]
+        cache.put_many(MODEL, [(t, [float(i)]) for i, t in enumerate(texts)])
+        got = cache.get_many(MODEL, texts)
+        assert len(got) == 1200
+        assert got["text 1199"] == (1199.0,)
+
+    def test_lru_eviction(self, cache_path):
+        # 1 ベクトル = 400 バイト + テキスト 1 バイト。
+        cache = EmbeddingCache(cache_path, max_bytes=1500)
+        for t in "abc":
+            cache.put(MODEL, t, np.zeros(100))
+        assert cache.get(MODEL, "a") is not None
+        cache.put(MODEL, "d", np.zeros(100))
+        assert cache.get(MODEL, "b") is None
+        assert len(cache) == 3
+
+    def test_shared_across_processes(self, cache_path):
+        script = (
+            "import sys; sys.path.insert(0, %r)\n"
+            "from persona.prompt_template.embedding_cache import "
+            "EmbeddingCache\n"
+            "cache = EmbeddingCache(%r)\n"
+            "tag = sys.argv[1]\n"
+            "for i in range(50):\n"
+            "    cache.put('m', f'{tag} {i}', [float(i)])\n"
+            "    cache.get_many('m', [f'a {i}', f'b {i}'])\n"
+        ) % (str(BACKEND), cache_path)
+        procs = [subprocess.Popen([sys.executable, "-c", script, tag])
+                 for tag in ("a", "b")]
+        assert [p.wait(timeout=60) for p in procs] == [0, 0]
+        cache = EmbeddingCache(cache_path)
+        assert len(cache) == 100
+        assert cache.get("m", "b 49") == (49.0,)
+
+    def test_processes_open_at_the_same_moment(self, cache_path):
+        """いくつものプロセスが同じ瞬間に新しいストアを作っても落ちない。"""
+        script = (
+            "import sys, time; sys.path.insert(0, %r)\n"
+            "from persona.prompt_template.embedding_cache import "
+            "EmbeddingCache\n"
+            "tag, start = sys.argv[1], float(sys.argv[2])\n"
+            "time.sleep(max(0.0, start - time.time()))\n"
+            "for i in range(10):\n"
+            "    cache = EmbeddingCache(%r)\n"
+            "    cache.put('m', f'{tag} {i}', [float(i)])\n"
+        ) % (str(BACKEND), cache_path)
+        start = str(time.time() + 1.0)
+        procs = [subprocess.Popen([sys.executable, "-c", script, str(tag),
+                                   start])
+                 for tag in range(8)]
+        assert [p.wait(timeout=120) for p in procs] == [0] * 8
+        assert len(EmbeddingCache(cache_path)) == 80
+
+    def test_normalize_text(self):
+        assert normalize_embedding_text("a\nb") == "a b"
+        assert normalize_embedding_text("") == "this is blank"
+
+
+# ================================================================
+# gpt_structure の埋め込み関数
+# ================================================================
+
+@pytest.fixture
+def gpt_structure(monkeypatch, cache_path):
+    """conftest のスタブではなく本物の gpt_structure を別名で読み込む。"""
+    monkeypatch.setenv("EMBEDDING_CACHE_PATH", cache_path)
+    monkeypatch.setattr(embedding_cache, "_cache", None)
+    spec = importlib.util.spec_from_file_location(
+        "real_gpt_structure",
+        BACKEND / "persona" / "prompt_template" / "gpt_structure.py")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+
+    calls = []
+
+    def create(input, model):
+        calls.append(list(input))
+        return {"data": [{"embedding": [len(t) + 0.1, 1.0]} for t in input]}
+
+    monkeypatch.setattr(openai.Embedding, "create", create)
+    module.api_calls = calls
+    return module
+
+
+class TestGptStructureEmbeddings:
+    def test_batch_consults_store_before_api(self, gpt_structure):
+        embedding_cache.get_embedding_cache().put(MODEL, "known", [9.0, 9.0])
+        out = gpt_structure.get_embeddings_batch(
+            ["known", "new\ntext", "new text", ""])
+        assert gpt_structure.api_calls == [["new text", "this is blank"]]
+        assert out[0] == (9.0, 9.0)
+        assert out[1] == out[2] == to_float32_tuple([8.1, 1.0])
+
+    def test_results_persist_for_other_processes(self, gpt_structure,
+                                                 cache_path):
+        gpt_structure.get_embeddings_batch(["hello"])
+        gpt_structure.get_embedding("single")
+        stored = EmbeddingCache(cache_path).get_many(MODEL,
+                                                     ["hello", "single"])
+        assert stored == {"hello": to_float32_tuple([5.1, 1.0]),
+                          "single": to_float32_tuple([6.1, 1.0])}
+
+    def test_store_can_be_turned_off(self, gpt_structure, monkeypatch):
+        monkeypatch.setenv("EMBEDDING_CACHE", "off")
+        gpt_structure.get_embeddings_batch(["x", "y"])
+        gpt_structure.get_embeddings_batch(["x"])
+        assert gpt_structure.api_calls == [["x", "y"]]
@@ -119,17 +119,20 @@ def test_random_plan_routing(mock_random, mock_pf):
 
 @patch(f"{MODULE}.path_finder")
 def test_default_plan_routing(mock_pf):
-    """Normal address uses address_tiles[plan]."""
+    """Normal address walks the maze's distance field for address_tiles[plan]."""
     persona = _make_persona()
     tiles = [(55, 55), (56, 55)]
     maze = _make_maze(address_tiles={"world:sector:arena:obj": tiles})
-    mock_pf.return_value = [(50, 50), (55, 55)]
+    maze.path_to_address.return_value = [(50, 50), (51, 50), (55, 55)]
 
-    execute(persona, maze, {}, "world:sector:arena:obj")
+    ret, _, _ = execute(persona, maze, {}, "world:sector:arena:obj")
 
-    # path_finder target should be one of the address_tiles
-    target = mock_pf.call_args_list[-1][0][2]
-    assert target in tiles
+    args = maze.path_to_address.call_args[0]
+    assert args[0] == (50, 50)
+    assert args[1] == "world:sector:arena:obj"
+    assert ret == (51, 50)
+    assert persona.scratch.planned_path == [(55, 55)]
+    mock_pf.assert_not_called()
 
 
 # ── 5. act_path_set=True skips path finding ───────────────────────────
@@ -294,17 +297,13 @@ def test_overlap_avoidance(mock_pf):
         return {"events": set()}
 
     maze.access_tile.side_effect = access_tile_side_effect
+    maze.path_to_address.return_value = [(50, 50), (56, 55)]
     personas = {"Bob": MagicMock()}
 
-    # Return progressively shorter paths to pick the closest non-occupied tile
-    mock_pf.side_effect = [
-        [(50, 50), (56, 55)],       # path to (56, 55)
-        [(50, 50), (57, 55)],       # path to (57, 55) -- same length
-    ]
-
-    ret, _, _ = execute(persona, maze, personas, "world:sector:arena:obj")
+    execute(persona, maze, personas, "world:sector:arena:obj")
 
-    # path_finder should NOT have been called with (55, 55) as target
-    # because it was filtered out as occupied by Bob
-    pf_targets = [c[0][2] for c in mock_pf.call_args_list]
-    assert (55, 55) not in pf_targets
+    # The maze is told to avoid (55, 55), occupied by Bob, and only that.
+    avoid = maze.path_to_address.call_args[0][2]
+    assert avoid((55, 55))
+    assert not avoid((56, 55))
+    assert not avoid((57, 55))
@@ -0,0 +1,130 @@
+"""
+tests/test_fast_forward.py
+
+fast_forward のテスト。
+全員が眠っていて互いに見えないときだけ、次に何かが起こりうる時刻
+（行動の終わり・スケジュールの区切り・日付の変わり目）の直前まで
+step と curr_time を進めることを確認する。
+"""
+import datetime
+import pathlib
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+_MEM_DIR = str(pathlib.Path(__file__).resolve().parent.parent
+               / "reverie" / "backend_server" / "persona" / "memory_structures")
+if _MEM_DIR not in sys.path:
+    sys.path.insert(0, _MEM_DIR)
+
+from scratch import Scratch
+
+from fast_forward import fast_forward_steps, skip_dormant_steps
+
+MIDNIGHT = datetime.datetime(2023, 2, 13)
+
+
+def _persona(name, act="sleeping", start=MIDNIGHT, minutes=360,
+             schedule=(("sleeping", 360), ("waking up", 30))):
+    scratch = Scratch("__nonexistent__/scratch.json")
+    scratch.name = name
+    scratch.f_daily_schedule = [list(item) for item in schedule]
+    scratch.add_new_action("the Ville:house:bedroom:bed", minutes, act, "😴",
+                           (name, "is", act), None, None, None, None,
+                           None, None, ("bed", None, None))
+    scratch.act_start_time = start
+    return SimpleNamespace(name=name, scratch=scratch)
+
+
+def _server(personas, tiles, now):
+    for persona in personas:
+        persona.scratch.curr_time = now - datetime.timedelta(seconds=10)
+    return SimpleNamespace(
+        personas={p.name: p for p in personas},
+        personas_tile=dict(zip([p.name for p in personas], tiles)),
+        step=100, curr_time=now, sec_per_step=10)
+
+
+ONE_AM = MIDNIGHT + datetime.timedelta(hours=1)
+
+
+# ================================================================
+# fast_forward_steps
+# ================================================================
+
+class TestFastForwardSteps:
+    def test_skips_to_the_end_of_sleep(self):
+        server = _server([_persona("A"), _persona("B")],
+                         [(10, 10), (50, 50)], ONE_AM)
+        # 6:00 まで 5 時間 = 1800 ステップ。
+        assert fast_forward_steps(server) == 1800
+
+    def test_earliest_boundary_wins(self):
+        a = _persona("A")
+        b = _persona("B", schedule=(("sleeping", 120), ("sleeping", 240)))
+        server = _server([a, b], [(10, 10), (50, 50)], ONE_AM)
+        assert fast_forward_steps(server) == 360
+
+    def test_stops_before_midnight(self):
+        a = _persona("A", start=MIDNIGHT + datetime.timedelta(hours=23),
+                     minutes=420, schedule=(("working", 1380),
+                                            ("sleeping", 420)))
+        now = MIDNIGHT + datetime.timedelta(hours=23, minutes=30)
+        server = _server([a], [(10, 10)], now)
+        assert fast_forward_steps(server) == 180
+
+    def test_lands_off_grid_boundary_before_it(self):
+        server = _server([_persona("A")], [(10, 10)],
+                         ONE_AM + datetime.timedelta(seconds=5))
+        assert fast_forward_steps(server) == 1799
+
+    @pytest.mark.parametrize("change", [
+        lambda p: setattr(p.scratch, "act_description", "eating breakfast"),
+        lambda p: setattr(p.scratch, "planned_path", [(10, 11)]),
+        lambda p: setattr(p.scratch, "chatting_with", "B"),
+        lambda p: setattr(p.scratch, "curr_time",
+                          MIDNIGHT - datetime.timedelta(seconds=10)),
+        lambda p: setattr(p.scratch, "act_start_time",
+                          MIDNIGHT - datetime.timedelta(hours=6)),
+    ])
+    def test_not_dormant(self, change):
+        a = _persona("A")
+        server = _server([a, _persona("B")], [(10, 10), (50, 50)], ONE_AM)
+        change(a)
+        assert fast_forward_steps(server) == 0
+
+    def test_personas_in_sight(self):
+        server = _server([_persona("A"), _persona("B")],
+                         [(10, 10), (14, 13)], ONE_AM)
+        assert fast_forward_steps(server) == 0
+        server.personas_tile["B"] = (15, 13)
+        assert fast_forward_steps(server) == 1800
+
+
+# ================================================================
+# skip_dormant_steps
+# ================================================================
+
+class TestSkipDormantSteps:
+    def test_advances_step_time_and_buffers(self):
+        a = _persona("A")
+        a.scratch.chatting_with_buffer = {"B": 800}
+        server = _server([a, _persona("B")], [(10, 10), (50, 50)], ONE_AM)
+        assert skip_dormant_steps(server, 5000) == 1800
+        assert server.step == 1900
+        assert server.curr_time == MIDNIGHT + datetime.timedelta(hours=6)
+        assert a.scratch.chatting_with_buffer == {"B": -1000}
+        # 次のステップで行動が終わる（通常のループがそこから引き継ぐ）。
+        a.scratch.curr_time = server.curr_time
+        assert a.scratch.act_check_finished()
+
+    def test_capped_by_remaining_steps(self):
+        server = _server([_persona("A")], [(10, 10)], ONE_AM)
+        assert skip_dormant_steps(server, 50) == 50
+        assert server.curr_time == ONE_AM + datetime.timedelta(seconds=500)
+
+    def test_nothing_to_skip(self):
+        server = _server([_persona("A", act="painting")], [(10, 10)], ONE_AM)
+        assert skip_dormant_steps(server, 5000) == 0
+        assert server.step == 100 and server.curr_time == ONE_AM
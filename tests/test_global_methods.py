@@ -1,4 +1,5 @@
 """Tests for reverie/backend_server/global_methods.py"""
+import json
 import os
 import pytest
 
@@ -10,6 +11,8 @@ from global_methods import (
     write_list_of_list_to_csv,
     read_file_to_list,
     find_filenames,
+    copy_sim_lineage,
+    resolve_sim_step_file,
 )
 
 
@@ -136,3 +139,63 @@ class TestFindFilenames:
     def test_empty_directory(self, tmp_path):
         result = find_filenames(str(tmp_path), suffix=".csv")
         assert result == []
+
+
+# ===================================================================
+# copy_sim_lineage / resolve_sim_step_file tests
+# ===================================================================
+
+def _make_sim(folder, step, persona="Alice"):
+    """Creates a minimal simulation folder with steps 0..step."""
+    for sub in ("environment", "movement"):
+        os.makedirs(folder / sub)
+        for i in range(step + 1):
+            (folder / sub / f"{i}.json").write_text(json.dumps({"step": i}))
+    os.makedirs(folder / "personas" / persona / "bootstrap_memory")
+    (folder / "personas" / persona / "bootstrap_memory"
+     / "scratch.json").write_text("{}")
+    os.makedirs(folder / "reverie")
+    (folder / "reverie" / "meta.json").write_text(json.dumps({"step": step}))
+
+
+class TestSimLineage:
+    def test_fork_materializes_only_current_step(self, tmp_path):
+        _make_sim(tmp_path / "parent", 5)
+        copy_sim_lineage(str(tmp_path / "parent"), str(tmp_path / "child"))
+        child = tmp_path / "child"
+        assert os.listdir(child / "environment") == ["5.json"]
+        assert os.listdir(child / "movement") == []
+        assert (child / "personas" / "Alice" / "bootstrap_memory"
+                / "scratch.json").exists()
+        meta = json.loads((child / "reverie" / "meta.json").read_text())
+        assert meta == {"step": 5, "lineage_parent": "parent",
+                        "lineage_step": 5}
+
+    def test_resolve_follows_lineage(self, tmp_path):
+        _make_sim(tmp_path / "parent", 5)
+        copy_sim_lineage(str(tmp_path / "parent"), str(tmp_path / "child"))
+        child = str(tmp_path / "child")
+        assert resolve_sim_step_file(child, "movement", 2) == (
+            f"{tmp_path}/parent/movement/2.json")
+        assert resolve_sim_step_file(child, "environment", 5) == (
+            f"{child}/environment/5.json")
+        # The parent's steps after the fork do not belong to the child.
+        (tmp_path / "parent" / "movement" / "7.json").write_text("{}")
+        assert resolve_sim_step_file(child, "movement", 7) is None
+
+    def test_resolve_through_two_forks(self, tmp_path):
+        _make_sim(tmp_path / "a", 3)
+        copy_sim_lineage(str(tmp_path / "a"), str(tmp_path / "b"))
+        meta_f = tmp_path / "b" / "reverie" / "meta.json"
+        meta = json.loads(meta_f.read_text())
+        meta["step"] = 6
+        meta_f.write_text(json.dumps(meta))
+        for i in range(3, 7):
+            (tmp_path / "b" / "environment" / f"{i}.json").write_text("{}")
+            (tmp_path / "b" / "movement" / f"{i}.json").write_text("{}")
+        copy_sim_lineage(str(tmp_path / "b"), str(tmp_path / "c"))
+        c = str(tmp_path / "c")
+        assert resolve_sim_step_file(c, "movement", 1) == (
+            f"{tmp_path}/a/movement/1.json")
+        assert resolve_sim_step_file(c, "movement", 4) == (
+            f"{tmp_path}/b/movement/4.json")
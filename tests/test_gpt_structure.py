@@ -0,0 +1,92 @@
+"""
+tests/test_gpt_structure.py
+
+gpt_structure のテスト。
+conftest のスタブではなく本物のモジュールを読み込み、
+generate_prompt がテンプレートをプロセスごとに一度だけ読んでコンパイルし、
+以前の str.replace による実装と同じプロンプトを作ることを確認する。
+"""
+import importlib.util
+import os
+import pathlib
+import sys
+
+import pytest
+
+TEMPLATES = (pathlib.Path(__file__).resolve().parent.parent / "reverie"
+             / "backend_server" / "persona" / "prompt_template")
+
+
+@pytest.fixture
+def gpt_structure(monkeypatch):
+    spec = importlib.util.spec_from_file_location(
+        "persona.prompt_template.gpt_structure", TEMPLATES / "gpt_structure.py")
+    module = importlib.util.module_from_spec(spec)
+    monkeypatch.setitem(sys.modules, spec.name, module)
+    spec.loader.exec_module(module)
+    return module
+
+
+# ================================================================
+# generate_prompt
+# ================================================================
+
+class TestGeneratePrompt:
+    def test_substitutes_inputs(self, gpt_structure, tmp_path):
+        template = tmp_path / "t.txt"
+        template.write_text("header\n<commentblockmarker>###</commentblockmarker>"
+                            "\nHello !<INPUT 0>!, it is !<INPUT 1>!.\n")
+        prompt = gpt_structure.generate_prompt(["Isabella", 9], str(template))
+        assert prompt == "Hello Isabella, it is 9."
+        assert gpt_structure.generate_prompt("Klaus", str(template)) == (
+            "Hello Klaus, it is !<INPUT 1>!.")
+
+    def test_template_read_once(self, gpt_structure, tmp_path):
+        template = tmp_path / "t.txt"
+        template.write_text("Hello !<INPUT 0>!.")
+        assert gpt_structure.generate_prompt(["a"], str(template)) == "Hello a."
+        template.write_text("Bye !<INPUT 0>!.")
+        assert gpt_structure.generate_prompt(["b"], str(template)) == "Hello b."
+        assert list(gpt_structure._prompt_templates) == [str(template)]
+
+    def test_reload_on_change(self, gpt_structure, tmp_path, monkeypatch):
+        monkeypatch.setenv("PROMPT_TEMPLATE_RELOAD", "on")
+        template = tmp_path / "t.txt"
+        template.write_text("Hello !<INPUT 0>!.")
+        assert gpt_structure.generate_prompt(["a"], str(template)) == "Hello a."
+        template.write_text("Bye !<INPUT 0>!.")
+        stat = template.stat()
+        os.utime(template, (stat.st_atime, stat.st_mtime + 10))
+        assert gpt_structure.generate_prompt(["b"], str(template)) == "Bye b."
+
+    def test_compile(self, gpt_structure):
+        compile_template = gpt_structure.compile_prompt_template
+        assert compile_template("Hi !<INPUT 0>!, it is !<INPUT 1>!.") == [
+            "Hi ", 0, ", it is ", 1, "."]
+        assert compile_template("x<commentblockmarker>###</commentblockmarker>"
+                                "!<INPUT 10>!!<INPUT 2>!") == [10, 2]
+
+    def test_matches_replace_on_every_template(self, gpt_structure):
+        def reference(curr_input, path):
+            prompt = open(path).read()
+            for count, i in enumerate(curr_input):
+                prompt = prompt.replace(f"!<INPUT {count}>!", i)
+            if "<commentblockmarker>###</commentblockmarker>" in prompt:
+                prompt = prompt.split(
+                    "<commentblockmarker>###</commentblockmarker>")[1]
+            return prompt.strip()
+
+        paths = sorted(TEMPLATES.rglob("*.txt"))
+        assert len(paths) > 40
+        for path in paths:
+            for n in (0, 3, 40):
+                curr_input = [f"input {i}" for i in range(n)]
+                assert gpt_structure.generate_prompt(curr_input, str(path)) \
+                    == reference(curr_input, str(path)), path
+
+    def test_real_template(self, gpt_structure):
+        path = str(TEMPLATES / "v2" / "wake_up_hour_v1.txt")
+        prompt = gpt_structure.generate_prompt(["iss", "lifestyle", "Isabella"],
+                                               path)
+        assert "!<INPUT" not in prompt
+        assert "Isabella" in prompt
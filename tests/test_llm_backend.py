@@ -0,0 +1,342 @@
+"""
+tests/test_llm_backend.py
+
+llm_backend のテスト。
+LocalLLMBackend の応答が決定的であること、テンプレートを識別できること、
+本物の run_gpt_prompt の各関数がフェイルセーフではなく
+ローカルバックエンドの応答をパース・検証して使えることを確認する。
+"""
+import asyncio
+import datetime
+import importlib.util
+import json
+import pathlib
+import sys
+import threading
+import time
+from unittest.mock import MagicMock
+
+import numpy as np
+import pytest
+
+from persona.prompt_template import (llm_backend, llm_batcher, llm_cache,
+                                     llm_client)
+from persona.prompt_template.llm_backend import (LocalLLMBackend,
+                                                 OpenAIBackend,
+                                                 TemplateMatcher,
+                                                 get_llm_backend)
+
+BACKEND = pathlib.Path(__file__).resolve().parent.parent / "reverie" / "backend_server"
+TEMPLATES = BACKEND / "persona" / "prompt_template"
+
+
+def _prompt(template, inputs):
+    """gpt_structure.generate_prompt と同じ手順でプロンプトを作る。"""
+    prompt = (TEMPLATES / template).read_text(encoding="utf-8")
+    for count, i in enumerate(inputs):
+        prompt = prompt.replace(f"!<INPUT {count}>!", str(i))
+    if "<commentblockmarker>###</commentblockmarker>" in prompt:
+        prompt = prompt.split("<commentblockmarker>###</commentblockmarker>")[1]
+    return prompt.strip()
+
+
+def _chat(backend, content):
+    response = asyncio.run(backend.chat_completion(
+        model="gpt-4o-mini", messages=[{"role": "user", "content": content}]))
+    return response["choices"][0]["message"]["content"]
+
+
+# ================================================================
+# LocalLLMBackend
+# ================================================================
+
+class TestLocalLLMBackend:
+    def test_template_matcher(self):
+        matcher = TemplateMatcher(llm_backend.TEMPLATE_HANDLERS.keys())
+        prompt = _prompt("v2/wake_up_hour_v1.txt",
+                         ["Name: Isabella", "Isabella goes to bed early",
+                          "Isabella"])
+        assert matcher.match(prompt) == "v2/wake_up_hour_v1.txt"
+        assert matcher.match("something else entirely") is None
+
+    def test_responses_are_deterministic(self):
+        prompt = _prompt("v2/decide_to_talk_v2.txt", ["a"] * 20)
+        a = _chat(LocalLLMBackend(), prompt)
+        b = _chat(LocalLLMBackend(), prompt)
+        assert a == b
+
+    def test_json_wrapped_prompt(self):
+        inner = _prompt("v3_ChatGPT/poignancy_event_v1.txt",
+                        ["Isabella", "iss", "Isabella", "bed is idle"])
+        content = ('"""\n' + inner + '\n"""\n'
+                   "Output the response to the prompt above in json. x\n"
+                   'Example output json:\n{"output": "5"}')
+        backend = LocalLLMBackend()
+        assert json.loads(_chat(backend, content)) == {"output": "1"}
+        assert backend.template_counts == {
+            "v3_ChatGPT/poignancy_event_v1.txt": 1}
+
+    def test_unknown_prompt_falls_back_to_text(self):
+        backend = LocalLLMBackend()
+        assert _chat(backend, "Tell me a story.")
+        assert backend.template_counts == {None: 1}
+
+    def test_embeddings(self):
+        backend = LocalLLMBackend(embedding_dim=8)
+        a, b, a2 = backend.create_embeddings(["cat", "dog", "cat"], "m")
+        assert len(a) == 8
+        assert a == a2
+        assert a != b
+        assert np.linalg.norm(a) == pytest.approx(1.0)
+
+    def test_latency_and_jitter(self):
+        backend = LocalLLMBackend(latency_ms=30, jitter_ms=10)
+        delays = {backend.delay(str(i)) for i in range(20)}
+        assert all(0.02 <= d <= 0.04 for d in delays)
+        assert len(delays) > 1
+        assert backend.delay("x") == backend.delay("x")
+
+        start = time.monotonic()
+        backend.create_embeddings(["x"], "m")
+        assert time.monotonic() - start >= backend.delay("x") * 0.9
+
+
+# ================================================================
+# get_llm_backend
+# ================================================================
+
+class TestGetLLMBackend:
+    @pytest.fixture(autouse=True)
+    def _reset(self, monkeypatch):
+        monkeypatch.setattr(llm_backend, "_backend", None)
+
+    def test_default_is_openai(self, monkeypatch):
+        monkeypatch.delenv("LLM_BACKEND", raising=False)
+        assert isinstance(get_llm_backend(), OpenAIBackend)
+
+    def test_local(self, monkeypatch):
+        monkeypatch.setenv("LLM_BACKEND", "local")
+        monkeypatch.setenv("LOCAL_LLM_LATENCY_MS", "5")
+        backend = get_llm_backend()
+        assert isinstance(backend, LocalLLMBackend)
+        assert backend.latency_ms == 5.0
+        assert get_llm_backend() is backend
+
+    def test_incomplete_backend_cannot_be_created(self):
+        class ChatOnly(llm_backend.LLMBackend):
+            async def chat_completion(self, **request):
+                return {}
+
+        with pytest.raises(TypeError):
+            ChatOnly()
+
+    def test_unknown(self, monkeypatch):
+        monkeypatch.setenv("LLM_BACKEND", "nope")
+        with pytest.raises(ValueError):
+            get_llm_backend()
+
+
+# ================================================================
+# 本物の run_gpt_prompt をローカルバックエンドで動かす
+# ================================================================
+
+@pytest.fixture
+def run_gpt_prompt(monkeypatch):
+    """
+    conftest のスタブの代わりに本物の gpt_structure と run_gpt_prompt を
+    読み込み、LLM_BACKEND=local で動かす。
+    """
+    monkeypatch.setenv("LLM_BACKEND", "local")
+    monkeypatch.setenv("LLM_CACHE", "off")
+    monkeypatch.setenv("EMBEDDING_CACHE", "off")
+    monkeypatch.setattr(llm_backend, "_backend", None)
+    monkeypatch.setattr(llm_client, "_client", None)
+    monkeypatch.chdir(BACKEND)
+
+    modules = dict()
+    for name in ("gpt_structure", "print_prompt", "run_gpt_prompt"):
+        spec = importlib.util.spec_from_file_location(
+            f"persona.prompt_template.{name}", TEMPLATES / f"{name}.py")
+        module = importlib.util.module_from_spec(spec)
+        monkeypatch.setitem(sys.modules, spec.name, module)
+        spec.loader.exec_module(module)
+        modules[name] = module
+    yield modules["run_gpt_prompt"]
+    if llm_client._client is not None:
+        llm_client._client.close()
+
+
+def _persona():
+    persona = MagicMock()
+    persona.name = "Isabella Rodriguez"
+    persona.scratch.name = "Isabella Rodriguez"
+    persona.scratch.get_str_iss.return_value = (
+        "Name: Isabella Rodriguez\nInnate traits: friendly")
+    persona.scratch.get_str_lifestyle.return_value = (
+        "Isabella goes to bed around 11pm and wakes up around 6am.")
+    persona.scratch.get_str_firstname.return_value = "Isabella"
+    persona.scratch.get_str_curr_date_str.return_value = "Monday February 13"
+    persona.scratch.curr_time = datetime.datetime(2023, 2, 13, 9, 0)
+    persona.scratch.daily_req = ["eat breakfast at 7:00 am",
+                                 "open the cafe at 8:00 am"]
+    persona.scratch.f_daily_schedule_hourly_org = [["sleeping", 360],
+                                                   ["working", 120],
+                                                   ["having lunch", 60]]
+    persona.scratch.get_f_daily_schedule_hourly_org_index.return_value = 1
+    return persona
+
+
+class TestRunGPTPromptWithLocalBackend:
+    def test_wake_up_hour(self, run_gpt_prompt):
+        output, _ = run_gpt_prompt.run_gpt_prompt_wake_up_hour(_persona())
+        assert output in (6, 7, 8)
+
+    def test_daily_plan(self, run_gpt_prompt):
+        output, info = run_gpt_prompt.run_gpt_prompt_daily_plan(_persona(), 7)
+        assert output[0] == ("wake up and complete the morning routine "
+                             "at 7:00 am")
+        assert len(output) == 8
+        assert output[1:] != info[-1]
+        assert output[-1] == "go to bed at 11:00 pm"
+
+    def test_hourly_schedule(self, run_gpt_prompt):
+        hours = ["06:00 AM", "07:00 AM", "08:00 AM", "12:00 PM"]
+        output, _ = run_gpt_prompt.run_gpt_prompt_generate_hourly_schedule(
+            _persona(), "12:00 PM", ["sleeping", "having breakfast",
+                                     "working"], hours)
+        assert output == "having lunch"
+
+        output, _ = (run_gpt_prompt
+                     .run_gpt_prompt_generate_hourly_schedule_batch(
+                         _persona(), hours, hours))
+        assert output == ["waking up and getting ready", "having breakfast",
+                          "working on the day's tasks", "having lunch"]
+
+    def test_task_decomp(self, run_gpt_prompt):
+        output, _ = run_gpt_prompt.run_gpt_prompt_task_decomp(
+            _persona(), "working", 60)
+        assert sum(d for _, d in output) == 60
+        assert len(output) == 3
+        assert all(task.startswith("working (") for task, _ in output)
+        output, _ = run_gpt_prompt.run_gpt_prompt_task_decomp(
+            _persona(), "having lunch", 60, org_index=1)
+        assert sum(d for _, d in output) == 60
+
+    def test_event_triple_and_pronunciatio(self, run_gpt_prompt):
+        persona = _persona()
+        output, _ = run_gpt_prompt.run_gpt_prompt_event_triple(
+            "having lunch", persona)
+        assert output == ("Isabella Rodriguez", "is", "having lunch")
+        output, _ = run_gpt_prompt.run_gpt_prompt_pronunciatio(
+            "having lunch", persona)
+        assert output != "😋"
+
+    def test_poignancy(self, run_gpt_prompt):
+        persona = _persona()
+        output, _ = run_gpt_prompt.run_gpt_prompt_event_poignancy(
+            persona, "bed is idle")
+        assert output == 1
+        output, _ = run_gpt_prompt.run_gpt_prompt_event_poignancy(
+            persona, "Isabella is planning a party")
+        assert 2 <= output <= 6
+
+    def test_poignancy_batch(self, run_gpt_prompt):
+        persona = _persona()
+        backend = llm_backend.get_llm_backend()
+        output, info = run_gpt_prompt.run_gpt_prompt_poignancy_batch(
+            persona, [("event", "bed is idle"),
+                      ("thought", "Isabella wants to plan a party"),
+                      ("chat", "Isabella is chatting with Klaus")])
+        assert output[0] == 1
+        assert all(2 <= i <= 6 for i in output[1:])
+        assert "2. Thought: Isabella wants to plan a party" in info[1]
+        assert backend.template_counts == {
+            "v3_ChatGPT/poignancy_batch_v1.txt": 1}
+
+    @pytest.mark.parametrize("answer, expected", [
+        ("[3, 7]", [3, 7]),
+        ("[3, 11]", [3, None]),
+        # 番号付きの答えや数の合わない答えは、どの項目にも対応づけない。
+        ("1. 3\n2. 7", [None, None]),
+        ("[3, 7, 9]", [None, None]),
+        ("5", [None, None]),
+    ])
+    def test_poignancy_batch_needs_one_score_per_item(
+            self, run_gpt_prompt, monkeypatch, answer, expected):
+        gpt_structure = sys.modules["persona.prompt_template.gpt_structure"]
+        monkeypatch.setattr(gpt_structure, "ChatGPT_request",
+                            lambda prompt: json.dumps({"output": answer}))
+        output, _ = run_gpt_prompt.run_gpt_prompt_poignancy_batch(
+            _persona(), [("event", "Klaus is reading"),
+                         ("thought", "Isabella wants to plan a party")])
+        assert output == expected
+
+    def test_replay_miss_reaches_the_caller(self, run_gpt_prompt,
+                                            monkeypatch, tmp_path):
+        """
+        replay モードでキャッシュにない要求は、フェイルセーフの答えに
+        すり替わらず LLMCacheMiss として呼び出し元まで届く。
+        """
+        monkeypatch.setenv("LLM_CACHE", "replay")
+        monkeypatch.setenv("LLM_CACHE_PATH", str(tmp_path / "llm.sqlite3"))
+        monkeypatch.setattr(llm_cache, "_cache", None)
+        gpt_structure = sys.modules["persona.prompt_template.gpt_structure"]
+        persona = _persona()
+        with pytest.raises(llm_cache.LLMCacheMiss):
+            gpt_structure.ChatGPT_single_request("What is your plan?")
+        with pytest.raises(llm_cache.LLMCacheMiss):
+            run_gpt_prompt.run_gpt_prompt_event_poignancy(
+                persona, "Isabella is planning a party")
+        with pytest.raises(llm_cache.LLMCacheMiss):
+            run_gpt_prompt.run_gpt_prompt_task_decomp(persona, "working", 60)
+        with pytest.raises(llm_cache.LLMCacheMiss):
+            gpt_structure.GPT4_request("What is your plan?")
+
+    def test_reflection(self, run_gpt_prompt):
+        persona = _persona()
+        statements = "0. Isabella opened the cafe\n1. Isabella had lunch\n"
+        output, info = run_gpt_prompt.run_gpt_prompt_focal_pt(
+            persona, statements, 3)
+        assert len(output) == 3
+        assert output != info[-1]
+        output, _ = run_gpt_prompt.run_gpt_prompt_insight_and_guidance(
+            persona, statements, 2)
+        assert isinstance(output, dict) and len(output) == 2
+        assert all(e < 2 for evidence in output.values() for e in evidence)
+
+    def test_batched_requests_same_answers(self, run_gpt_prompt,
+                                           monkeypatch):
+        """まとめて送っても 1 件ずつ送ったときと同じ答えになる。"""
+        monkeypatch.setattr(llm_batcher, "_batcher", None)
+        monkeypatch.delenv("LLM_BATCH_WINDOW_MS", raising=False)
+        actions = ["having lunch", "painting a picture", "reading a book",
+                   "sleeping"]
+
+        def ask(action):
+            persona = _persona()
+            return (run_gpt_prompt.run_gpt_prompt_pronunciatio(
+                        action, persona)[0],
+                    run_gpt_prompt.run_gpt_prompt_event_triple(
+                        action, persona)[0])
+
+        expected = [ask(action) for action in actions]
+
+        monkeypatch.setenv("LLM_BATCH_WINDOW_MS", "200")
+        monkeypatch.setattr(llm_batcher, "_batcher", None)
+        results = [None] * len(actions)
+        threads = [threading.Thread(
+                       target=lambda i=i: results.__setitem__(
+                           i, ask(actions[i])))
+                   for i in range(len(actions))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert results == expected
+        stats = llm_batcher._batcher.stats()
+        for template in ("v3_ChatGPT/generate_pronunciatio_v1.txt",
+                         "v2/generate_event_triple_v1.txt"):
+            assert stats[template]["requests"] == 4
+            assert stats[template]["calls"] < 4
+            assert stats[template]["fallbacks"] == 0
@@ -0,0 +1,222 @@
+"""
+tests/test_llm_batcher.py
+
+persona/prompt_template/llm_batcher.py（同じテンプレートのリクエストの
+マイクロバッチ化）のテスト。
+ウィンドウ内に並行して届いたリクエストが 1 回の呼び出しにまとめられ、
+各呼び出し元に自分の答えが返ること、欠けた答えは単独で送り直されること、
+テンプレートごとの集計を確認する。
+"""
+import json
+import threading
+
+import pytest
+
+from persona.prompt_template import llm_batcher
+from persona.prompt_template.llm_batcher import (RequestBatcher,
+                                                 cut_at_stop,
+                                                 fuse_prompts,
+                                                 get_llm_batcher,
+                                                 split_fused_answer,
+                                                 split_fused_prompt)
+
+TEMPLATE = "v3_ChatGPT/generate_pronunciatio_v1.txt"
+
+
+# ---- helpers ----
+
+class FakeChat:
+    """まとめられたプロンプトには各プロンプトを大文字にした答えを返す。"""
+
+    def __init__(self, drop=(), error=False):
+        self.drop = set(drop)
+        self.error = error
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def __call__(self, **request):
+        with self.lock:
+            self.calls.append(request)
+        content = request["messages"][0]["content"]
+        prompts = split_fused_prompt(content)
+        if prompts is None:
+            return content.upper()
+        if self.error:
+            raise RuntimeError("boom")
+        return json.dumps({str(i + 1): p.upper()
+                           for i, p in enumerate(prompts)
+                           if p not in self.drop})
+
+
+def _request(prompt, **params):
+    return dict(model="gpt-4o-mini",
+                messages=[{"role": "user", "content": prompt}], **params)
+
+
+def _run_concurrently(fn, args):
+    results = [None] * len(args)
+
+    def run(count):
+        results[count] = fn(*args[count])
+
+    threads = [threading.Thread(target=run, args=(i,))
+               for i in range(len(args))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+# ================================================================
+# fused prompt format
+# ================================================================
+
+class TestFusedFormat:
+    def test_round_trip(self):
+        prompts = ["first prompt", "second\nprompt\n", '{"output": "5"}']
+        assert split_fused_prompt(fuse_prompts(prompts)) == prompts
+
+    def test_not_fused(self):
+        assert split_fused_prompt("Rate (return a number):") is None
+
+    def test_split_answer(self):
+        text = 'Sure! {"1": "a", "3": {"output": "5"}} done'
+        assert split_fused_answer(text, 3) == ["a", None, '{"output": "5"}']
+        assert split_fused_answer("not json", 2) == [None, None]
+
+    def test_cut_at_stop(self):
+        assert cut_at_stop(" is, idle)\nmore", ["\n"]) == " is, idle)"
+        assert cut_at_stop("a)b", ")") == "a"
+        assert cut_at_stop("abc", None) == "abc"
+
+
+# ================================================================
+# RequestBatcher.chat
+# ================================================================
+
+class TestChat:
+    def test_concurrent_requests_fused(self):
+        chat = FakeChat()
+        batcher = RequestBatcher(chat, None, window_ms=200)
+        prompts = [f"prompt {i}" for i in range(5)]
+        results = _run_concurrently(
+            batcher.chat, [(TEMPLATE, _request(p)) for p in prompts])
+
+        assert results == [p.upper() for p in prompts]
+        assert len(chat.calls) == 1
+        assert batcher.stats() == {TEMPLATE: {"requests": 5, "calls": 1,
+                                              "fused": 5, "fallbacks": 0}}
+
+    def test_identical_prompts_asked_once(self):
+        chat = FakeChat()
+        batcher = RequestBatcher(chat, None, window_ms=200)
+        results = _run_concurrently(
+            batcher.chat, [(TEMPLATE, _request("same"))] * 3
+                          + [(TEMPLATE, _request("other"))])
+        assert results == ["SAME", "SAME", "SAME", "OTHER"]
+        fused = chat.calls[0]["messages"][0]["content"]
+        assert split_fused_prompt(fused) == ["same", "other"]
+
+    def test_single_request_sent_as_is(self):
+        chat = FakeChat()
+        batcher = RequestBatcher(chat, None, window_ms=1)
+        assert batcher.chat(TEMPLATE, _request("alone")) == "ALONE"
+        assert chat.calls == [_request("alone")]
+
+    def test_missing_answer_resent_alone(self):
+        chat = FakeChat(drop={"prompt 1"})
+        batcher = RequestBatcher(chat, None, window_ms=200)
+        results = _run_concurrently(
+            batcher.chat, [(TEMPLATE, _request(f"prompt {i}"))
+                           for i in range(3)])
+        assert results == ["PROMPT 0", "PROMPT 1", "PROMPT 2"]
+        assert len(chat.calls) == 2
+        assert chat.calls[1] == _request("prompt 1")
+        assert batcher.stats()[TEMPLATE]["fallbacks"] == 1
+
+    def test_failed_batch_resent_alone(self):
+        chat = FakeChat(error=True)
+        batcher = RequestBatcher(chat, None, window_ms=200)
+        results = _run_concurrently(
+            batcher.chat, [(TEMPLATE, _request(f"p{i}")) for i in range(3)])
+        assert results == ["P0", "P1", "P2"]
+        assert len(chat.calls) == 4
+
+    def test_stop_and_max_tokens(self):
+        chat = FakeChat()
+        batcher = RequestBatcher(chat, None, window_ms=200)
+        results = _run_concurrently(
+            batcher.chat, [(TEMPLATE, _request(p, max_tokens=30, stop=["\n"]))
+                           for p in ("a\nb", "c\nd")])
+        assert results == ["A", "C"]
+        assert "stop" not in chat.calls[0]
+        assert chat.calls[0]["max_tokens"] == 80
+
+    def test_different_params_not_fused(self):
+        chat = FakeChat()
+        batcher = RequestBatcher(chat, None, window_ms=100)
+        _run_concurrently(batcher.chat,
+                          [(TEMPLATE, _request("a", temperature=0)),
+                           (TEMPLATE, _request("b", temperature=1))])
+        assert len(chat.calls) == 2
+
+    def test_full_batch_sent_early(self):
+        chat = FakeChat()
+        batcher = RequestBatcher(chat, None, window_ms=10000, max_batch=2)
+        results = _run_concurrently(
+            batcher.chat, [(TEMPLATE, _request(f"p{i}")) for i in range(4)])
+        assert results == ["P0", "P1", "P2", "P3"]
+        assert len(chat.calls) == 2
+
+
+# ================================================================
+# RequestBatcher.embed
+# ================================================================
+
+class TestEmbed:
+    def test_concurrent_embeddings_fused(self):
+        calls = []
+
+        def send(texts, model):
+            calls.append((list(texts), model))
+            return [[len(t)] for t in texts]
+
+        batcher = RequestBatcher(None, send, window_ms=200)
+        results = _run_concurrently(batcher.embed, [(["a", "bb"], "m"),
+                                                    (["bb", "ccc"], "m")])
+        assert results == [[[1], [2]], [[2], [3]]]
+        assert len(calls) == 1
+        assert sorted(calls[0][0]) == ["a", "bb", "ccc"]
+        assert batcher.stats()["embeddings"]["calls"] == 1
+        assert "gain" in batcher.report()[0]
+
+
+# ================================================================
+# get_llm_batcher
+# ================================================================
+
+class TestGetLLMBatcher:
+    @pytest.fixture(autouse=True)
+    def _reset(self, monkeypatch):
+        monkeypatch.setattr(llm_batcher, "_batcher", None)
+
+    def test_off_by_default(self, monkeypatch):
+        monkeypatch.delenv("LLM_BATCH_WINDOW_MS", raising=False)
+        assert get_llm_batcher(None, None) is None
+
+    def test_off_is_remembered(self, monkeypatch):
+        monkeypatch.delenv("LLM_BATCH_WINDOW_MS", raising=False)
+        assert get_llm_batcher(None, None) is None
+        # 設定は最初の 1 回だけ読み、以後はロックを取らない。
+        monkeypatch.setenv("LLM_BATCH_WINDOW_MS", "5")
+        monkeypatch.setattr(llm_batcher, "_batcher_lock", None)
+        assert get_llm_batcher(None, None) is None
+
+    def test_configured(self, monkeypatch):
+        monkeypatch.setenv("LLM_BATCH_WINDOW_MS", "5")
+        monkeypatch.setenv("LLM_BATCH_TEMPLATES", "a.txt, b.txt")
+        batcher = get_llm_batcher(None, None)
+        assert batcher.window == pytest.approx(0.005)
+        assert batcher.batches("a.txt") and not batcher.batches(TEMPLATE)
+        assert get_llm_batcher(None, None) is batcher
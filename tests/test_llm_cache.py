@@ -0,0 +1,180 @@
+"""
+tests/test_llm_cache.py
+
+persona/prompt_template/llm_cache.py（永続 LLM 応答キャッシュ）のテスト。
+"""
+import pathlib
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+import persona.prompt_template.llm_cache as llm_cache
+from persona.prompt_template.llm_cache import LLMResponseCache
+
+
+BACKEND = pathlib.Path(__file__).resolve().parent.parent / "reverie" / "backend_server"
+
+
+def _request(content, **kw):
+    return dict(model="gpt-4o-mini",
+                messages=[{"role": "user", "content": content}], **kw)
+
+
+@pytest.fixture
+def cache_path(tmp_path):
+    return str(tmp_path / "cache" / "llm.sqlite3")
+
+
+# ================================================================
+# 複数プロセスからの同時接続
+# ================================================================
+
+class TestSharedFile:
+    def test_processes_open_at_the_same_moment(self, cache_path):
+        """
+        いくつものプロセスが同じ瞬間に新しいファイルを開き、各スレッドが
+        接続を作って読み書きしても "database is locked" で落ちない。
+        """
+        script = (
+            "import sys, threading, time; sys.path.insert(0, %r)\n"
+            "from persona.prompt_template.llm_cache import LLMResponseCache\n"
+            "tag, start = sys.argv[1], float(sys.argv[2])\n"
+            "time.sleep(max(0.0, start - time.time()))\n"
+            "cache = LLMResponseCache(%r)\n"
+            "def work(t):\n"
+            "    for i in range(20):\n"
+            "        # A new store, with new connections, every time.\n"
+            "        store = LLMResponseCache(%r) if i %% 2 else cache\n"
+            "        store.put(f'{tag} {t} {i}', 'm', 'r')\n"
+            "        store.get(f'{tag} {t} {i}')\n"
+            "threads = [threading.Thread(target=work, args=(t,))\n"
+            "           for t in range(4)]\n"
+            "[t.start() for t in threads]\n"
+            "[t.join() for t in threads]\n"
+        ) % (str(BACKEND), cache_path, cache_path)
+        start = str(time.time() + 1.0)
+        procs = [subprocess.Popen([sys.executable, "-c", script, str(tag),
+                                   start])
+                 for tag in range(8)]
+        assert [p.wait(timeout=120) for p in procs] == [0] * 8
+        assert len(LLMResponseCache(cache_path)) == 8 * 4 * 20
+
+    def test_wal_switch_retried_while_locked(self):
+        class Conn:
+            calls = 0
+
+            def execute(self, sql):
+                Conn.calls += 1
+                if Conn.calls < 3:
+                    raise sqlite3.OperationalError("database is locked")
+
+        llm_cache.enable_wal(Conn())
+        assert Conn.calls == 3
+
+    def test_wal_kept_in_the_file(self, cache_path):
+        LLMResponseCache(cache_path)
+        conn = llm_cache.connect_shared(cache_path)
+        assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+
+
+# ================================================================
+# LLMResponseCache
+# ================================================================
+
+class TestLLMResponseCache:
+    def test_key_depends_on_model_prompt_and_params(self):
+        key = LLMResponseCache.key_for
+        assert key(_request("a")) == key(_request("a"))
+        assert key(_request("a", temperature=0, top_p=1)) == key(
+            dict(reversed(list(_request("a", temperature=0,
+                                        top_p=1).items()))))
+        assert key(_request("a")) != key(_request("b"))
+        assert key(_request("a")) != key(_request("a", temperature=0))
+        assert key(_request("a")) != key(dict(_request("a"), model="gpt-4o"))
+
+    def test_put_get_persists(self, cache_path):
+        cache = LLMResponseCache(cache_path)
+        key = cache.key_for(_request("bed is idle"))
+        assert cache.get(key) is None
+        cache.put(key, "gpt-4o-mini", "1 ベッド")
+        assert cache.get(key) == "1 ベッド"
+        assert (cache.hits, cache.misses) == (1, 1)
+
+        reopened = LLMResponseCache(cache_path)
+        assert reopened.get(key) == "1 ベッド"
+        assert len(reopened) == 1
+
+    def test_discard(self, cache_path):
+        cache = LLMResponseCache(cache_path)
+        cache.put("k", "m", "bad answer")
+        cache.discard("k")
+        assert cache.get("k") is None
+
+    def test_lru_eviction(self, cache_path):
+        # 1 エントリ = 100 バイト（応答 99 + キー 1）。
+        cache = LLMResponseCache(cache_path, max_bytes=350)
+        for k in "abc":
+            cache.put(k, "m", "x" * 99)
+        assert cache.get("a") is not None  # a を最近使ったことにする
+        cache.put("d", "m", "x" * 99)
+        # 400 > 350 なので 315 以下になるまで古い順に消える（b だけ）。
+        assert cache.get("b") is None
+        for k in "acd":
+            assert cache.get(k) is not None
+        assert cache.total_bytes() == 300
+
+    def test_replay_only_never_writes(self, cache_path):
+        LLMResponseCache(cache_path).put("k", "m", "recorded")
+        replay = LLMResponseCache(cache_path, replay_only=True)
+        replay.put("new", "m", "ignored")
+        replay.discard("k")
+        assert replay.get("new") is None
+        assert replay.get("k") == "recorded"
+
+    def test_concurrent_threads(self, cache_path):
+        cache = LLMResponseCache(cache_path)
+
+        def worker(i):
+            for j in range(20):
+                cache.put(f"{i}-{j}", "m", f"v{i}-{j}")
+                assert cache.get(f"{i}-{j}") == f"v{i}-{j}"
+
+        threads = [threading.Thread(target=worker, args=(i,))
+                   for i in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert len(cache) == 80
+
+
+# ================================================================
+# get_llm_cache
+# ================================================================
+
+class TestGetLLMCache:
+    @pytest.fixture(autouse=True)
+    def reset(self, monkeypatch):
+        monkeypatch.setattr(llm_cache, "_cache", None)
+
+    def test_off_by_default(self, monkeypatch):
+        monkeypatch.delenv("LLM_CACHE", raising=False)
+        assert llm_cache.get_llm_cache() is None
+
+    def test_replay_mode(self, monkeypatch, cache_path):
+        monkeypatch.setenv("LLM_CACHE", "replay")
+        monkeypatch.setenv("LLM_CACHE_PATH", cache_path)
+        monkeypatch.setenv("LLM_CACHE_MAX_MB", "1")
+        cache = llm_cache.get_llm_cache()
+        assert cache.replay_only
+        assert cache.max_bytes == 1024 * 1024
+        assert llm_cache.get_llm_cache() is cache
+
+    def test_unknown_mode(self, monkeypatch):
+        monkeypatch.setenv("LLM_CACHE", "sometimes")
+        with pytest.raises(ValueError):
+            llm_cache.get_llm_cache()
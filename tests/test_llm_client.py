@@ -0,0 +1,160 @@
+"""
+tests/test_llm_client.py
+
+persona/prompt_template/llm_client.py（非同期 LLM リクエスト層）のテスト。
+同時実行数の上限、同一リクエストの合流、レート制限、リトライを確認する。
+"""
+import asyncio
+import threading
+import time
+
+import openai.error
+import pytest
+
+from persona.prompt_template.llm_client import (
+    AsyncLLMClient,
+    TokenBucket,
+    estimate_tokens,
+)
+
+
+# ---- helpers ----
+
+class FakeAPI:
+    """同時実行数と呼び出し回数を記録する偽の ChatCompletion.acreate。"""
+
+    def __init__(self, delay=0.02, errors=()):
+        self.delay = delay
+        self.errors = list(errors)
+        self.calls = []
+        self.active = 0
+        self.max_active = 0
+
+    async def __call__(self, **request):
+        self.calls.append(request)
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        try:
+            await asyncio.sleep(self.delay)
+            if self.errors:
+                raise self.errors.pop(0)
+            content = request["messages"][0]["content"]
+            return {"choices": [{"message": {"content": f"re: {content}"}}]}
+        finally:
+            self.active -= 1
+
+
+def _request(content, **kw):
+    return dict(model="gpt-4o-mini",
+                messages=[{"role": "user", "content": content}], **kw)
+
+
+async def _gather(client, requests):
+    return await asyncio.gather(
+        *[client.chat_completion(**r) for r in requests])
+
+
+# ================================================================
+# AsyncLLMClient
+# ================================================================
+
+class TestAsyncLLMClient:
+    def test_concurrency_bounded(self):
+        api = FakeAPI()
+        client = AsyncLLMClient(max_concurrency=3, request_func=api)
+        out = asyncio.run(_gather(client, [_request(f"p{i}")
+                                           for i in range(10)]))
+        assert [o["choices"][0]["message"]["content"] for o in out] == [
+            f"re: p{i}" for i in range(10)]
+        assert api.max_active == 3
+        assert client.n_requests == 10
+
+    def test_identical_requests_coalesced(self):
+        api = FakeAPI()
+        client = AsyncLLMClient(request_func=api)
+        requests = [_request("same")] * 5 + [_request("other")]
+        out = asyncio.run(_gather(client, requests))
+        assert len(api.calls) == 2
+        assert client.n_coalesced == 4
+        assert all(o is out[0] for o in out[:5])
+
+    def test_sequential_identical_requests_not_cached(self):
+        api = FakeAPI(delay=0)
+        client = AsyncLLMClient(request_func=api)
+
+        async def run():
+            await client.chat_completion(**_request("same"))
+            await client.chat_completion(**_request("same"))
+
+        asyncio.run(run())
+        assert len(api.calls) == 2
+
+    def test_retries_transient_errors(self, monkeypatch):
+        monkeypatch.setattr(asyncio, "sleep", _no_sleep(asyncio.sleep))
+        api = FakeAPI(errors=[openai.error.RateLimitError("slow down")])
+        client = AsyncLLMClient(request_func=api)
+        out = asyncio.run(client.chat_completion(**_request("x")))
+        assert out["choices"][0]["message"]["content"] == "re: x"
+        assert len(api.calls) == 2
+
+    def test_invalid_request_not_retried(self):
+        api = FakeAPI(errors=[openai.error.InvalidRequestError("bad", "p")])
+        client = AsyncLLMClient(request_func=api)
+        with pytest.raises(openai.error.InvalidRequestError):
+            asyncio.run(client.chat_completion(**_request("x")))
+        assert len(api.calls) == 1
+
+    def test_sync_wrapper_from_threads(self):
+        api = FakeAPI()
+        client = AsyncLLMClient(max_concurrency=2, request_func=api)
+        out = dict()
+
+        def worker(i):
+            out[i] = client.chat_completion_sync(**_request(f"t{i}"))
+
+        threads = [threading.Thread(target=worker, args=(i,))
+                   for i in range(6)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        client.close()
+        assert {i: o["choices"][0]["message"]["content"]
+                for i, o in out.items()} == {i: f"re: t{i}" for i in range(6)}
+        assert api.max_active == 2
+
+
+def _no_sleep(real_sleep):
+    async def sleep(seconds):
+        await real_sleep(0)
+    return sleep
+
+
+# ================================================================
+# TokenBucket / estimate_tokens
+# ================================================================
+
+class TestTokenBucket:
+    def test_burst_then_refill(self):
+        bucket = TokenBucket(600)  # 10 per second
+
+        async def run():
+            start = time.monotonic()
+            for _ in range(600):
+                await bucket.acquire(1)
+            burst = time.monotonic() - start
+            await bucket.acquire(2)
+            return burst, time.monotonic() - start - burst
+
+        burst, wait = asyncio.run(run())
+        assert burst < 0.1
+        assert 0.15 <= wait < 1.0
+
+    def test_oversized_request_waits_for_full_bucket(self):
+        bucket = TokenBucket(60000)
+        asyncio.run(bucket.acquire(10 ** 6))
+        assert bucket.tokens == pytest.approx(0, abs=100)
+
+    def test_estimate_tokens(self):
+        assert estimate_tokens(_request("a" * 400, max_tokens=50)) == 151
+        assert estimate_tokens(_request("")) == 257
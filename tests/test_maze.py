@@ -0,0 +1,444 @@
+"""
+tests/test_maze.py
+
+Maze の経路探索まわりのテスト。
+アドレスごとの距離場（address_distance_field）と path_to_address が
+path_finder による最短経路と同じ長さを返すこと、LRU で上限が守られることを
+小さな迷路と実際の the Ville のマップで確認する。
+"""
+import math
+import pathlib
+import random
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pytest
+
+import maze as maze_module
+from maze import Maze
+from path_finder import UNREACHABLE, PathCache, occupancy_grid, path_finder
+
+ASSETS = (pathlib.Path(__file__).resolve().parent.parent / "environment"
+          / "frontend_server" / "static_dirs" / "assets" / "the_ville"
+          / "matrix")
+
+GRID = [
+    "#########",
+    "#...#...#",
+    "#.#.#.#.#",
+    "#.#...#.#",
+    "#########",
+]
+MAZE = [list(row) for row in GRID]
+
+
+def _tiny_maze(addresses, max_fields=8):
+    """GRID から Maze を組み立てる（csv を読まない）。"""
+    m = Maze.__new__(Maze)
+    m.collision_maze = MAZE
+    m.collision_grid = occupancy_grid(m.collision_maze, "#")
+    m.maze_height = len(GRID)
+    m.maze_width = len(GRID[0])
+    m.world = "w"
+    for level in ("sector", "arena", "game_object", "spawning_location"):
+        setattr(m, f"{level}_names", [""])
+        setattr(m, f"{level}_layer", np.zeros(m.collision_grid.shape,
+                                              dtype=np.uint16))
+    m.tile_events = dict()
+    m.event_tiles = dict()
+    m.subject_tiles = dict()
+    m.arena_event_tiles = dict()
+    m.address_tiles = {k: set(v) for k, v in addresses.items()}
+    m.distance_fields = OrderedDict()
+    m.max_distance_fields = max_fields
+    m.collision_version = 0
+    m.path_cache = PathCache()
+    return m
+
+
+def _connected(path):
+    return all(abs(a[0] - b[0]) + abs(a[1] - b[1]) == 1
+               for a, b in zip(path, path[1:]))
+
+
+@pytest.fixture(scope="module")
+def ville():
+    patch = pytest.MonkeyPatch()
+    patch.setattr(maze_module, "env_matrix", str(ASSETS))
+    patch.setattr(maze_module, "collision_block_id", "32125")
+    yield Maze("the_ville")
+    patch.undo()
+
+
+# ================================================================
+# address_distance_field / path_to_address
+# ================================================================
+
+class TestPathToAddress:
+    def test_distance_field(self):
+        m = _tiny_maze({"room": [(7, 3), (7, 2)]})
+        field = m.address_distance_field("room")
+        assert field.dtype == np.uint16
+        assert field[3][7] == 0 and field[2][7] == 0
+        assert field[1][7] == 1
+        assert field[1][1] == 11
+        assert field[0][0] == UNREACHABLE
+
+    def test_shortest_path_to_nearest_tile(self):
+        m = _tiny_maze({"room": [(7, 3), (1, 3)]})
+        path = m.path_to_address((3, 1), "room")
+        assert path[0] == (3, 1)
+        assert path[-1] == (1, 3)
+        assert _connected(path)
+        assert len(path) == len(path_finder(MAZE, (3, 1), (1, 3), "#"))
+
+    def test_matches_path_finder_everywhere(self):
+        targets = [(5, 1), (7, 3)]
+        m = _tiny_maze({"a": targets})
+        for y, row in enumerate(GRID):
+            for x, c in enumerate(row):
+                if c == "#":
+                    continue
+                path = m.path_to_address((x, y), "a")
+                best = min(len(path_finder(MAZE, (x, y), t, "#"))
+                           for t in targets)
+                assert len(path) == best
+                assert path[-1] in targets
+                assert _connected(path)
+
+    def test_start_on_address(self):
+        m = _tiny_maze({"a": [(1, 1)]})
+        assert m.path_to_address((1, 1), "a") == [(1, 1)]
+
+    def test_unreachable(self):
+        m = _tiny_maze({"a": [(0, 0)]})
+        assert m.path_to_address((1, 1), "a") == [(1, 1)]
+
+    def test_avoid_occupied_tile(self):
+        m = _tiny_maze({"row": [(5, 1), (6, 1), (7, 1)]})
+        path = m.path_to_address((5, 3), "row", lambda t: t == (5, 1))
+        assert path[-1] == (6, 1)
+        assert _connected(path)
+        # 全タイルが避けるべき場合は最寄りのタイルで止まる。
+        path = m.path_to_address((5, 3), "row", lambda t: True)
+        assert path[-1] == (5, 1)
+
+    def test_lru_bound(self):
+        m = _tiny_maze({"a": [(1, 1)], "b": [(3, 1)], "c": [(5, 1)]},
+                       max_fields=2)
+        m.address_distance_field("a")
+        m.address_distance_field("b")
+        m.address_distance_field("a")
+        m.address_distance_field("c")
+        assert list(m.distance_fields) == ["a", "c"]
+        assert m.address_distance_field("a") is m.distance_fields["a"]
+
+
+class TestSetCollision:
+    def test_invalidates_paths_and_fields(self):
+        m = _tiny_maze({"a": [(3, 3)]})
+        m.collision_maze = [list(row) for row in GRID]
+
+        def find(start, end):
+            return path_finder(m.collision_grid, start, end, "#",
+                               cache=m.path_cache, version=m.collision_version)
+
+        assert len(find((1, 1), (3, 3))) == 5
+        assert m.path_to_address((1, 1), "a")[-1] == (3, 3)
+        m.set_collision((3, 2), True)
+        assert m.collision_version == 1
+        assert m.collision_maze[2][3] == maze_module.collision_block_id
+        assert m.access_tile((3, 2))["collision"] is True
+        assert m.distance_fields == {}
+        # (3, 2) が塞がったので (3, 3) には届かない。
+        assert find((1, 1), (3, 3)) == [(3, 3)]
+        assert m.path_to_address((1, 1), "a") == [(1, 1)]
+        m.set_collision((3, 2), False)
+        assert len(find((1, 1), (3, 3))) == 5
+        assert m.path_cache.hits == 0
+
+
+class TestVille:
+    def test_collision_grid(self, ville):
+        assert ville.collision_grid.shape == (100, 140)
+        assert ville.collision_grid.sum() > 0
+
+    def test_paths_match_path_finder(self, ville):
+        rng = random.Random(0)
+        addresses = sorted(a for a in ville.address_tiles
+                           if not a.startswith("<spawn_loc>"))
+        spawn = sorted(t for a, ts in ville.address_tiles.items()
+                       if a.startswith("<spawn_loc>") for t in ts)
+        for _ in range(10):
+            address = rng.choice(addresses)
+            start = rng.choice(spawn)
+            path = ville.path_to_address(start, address)
+            if len(path) == 1 and start not in ville.address_tiles[address]:
+                continue
+            assert path[-1] in ville.address_tiles[address]
+            assert _connected(path)
+            assert all(not ville.collision_grid[y][x] for x, y in path[1:])
+            assert len(path) == len(path_finder(ville.collision_grid, start,
+                                                path[-1], "32125"))
+
+
+# ================================================================
+# タイルのレイヤー配列と疎なイベント集合
+# ================================================================
+
+def _reference_tiles():
+    """以前の Maze.__init__ と同じ手順で作った、タイルごとの辞書。"""
+    read = maze_module.read_file_to_list
+    blocks = ASSETS / "special_blocks"
+    world = read(str(blocks / "world_blocks.csv"), header=False)[0][-1]
+    names = dict()
+    for level, file in (("sector", "sector_blocks"), ("arena", "arena_blocks"),
+                        ("game_object", "game_object_blocks"),
+                        ("spawning_location", "spawning_location_blocks")):
+        rows = read(str(blocks / f"{file}.csv"), header=False)
+        names[level] = {row[0]: row[-1] for row in rows}
+    mazes = dict()
+    for level in ("collision", "sector", "arena", "game_object",
+                  "spawning_location"):
+        raw = read(str(ASSETS / "maze" / f"{level}_maze.csv"),
+                   header=False)[0]
+        mazes[level] = [raw[i:i + 140] for i in range(0, len(raw), 140)]
+    tiles = []
+    for i in range(100):
+        row = []
+        for j in range(140):
+            tile = {"world": world}
+            for level, table in names.items():
+                tile[level] = table.get(mazes[level][i][j], "")
+            tile["collision"] = mazes["collision"][i][j] != "0"
+            tile["events"] = set()
+            if tile["game_object"]:
+                name = ":".join([world, tile["sector"], tile["arena"],
+                                 tile["game_object"]])
+                tile["events"].add((name, None, None, None))
+            row += [tile]
+        tiles += [row]
+    return tiles
+
+
+class TestTileLayers:
+    def test_access_tile_matches_tile_dicts(self, ville):
+        reference = _reference_tiles()
+        for y in range(ville.maze_height):
+            for x in range(ville.maze_width):
+                assert ville.access_tile((x, y)) == reference[y][x]
+
+    def test_get_tile_path(self, ville):
+        x, y = sorted(ville.address_tiles["<spawn_loc>sp-A"])[0]
+        tile = ville.access_tile((x, y))
+        assert ville.get_tile_path((x, y), "world") == tile["world"]
+        assert ville.get_tile_path((x, y), "arena") == ":".join(
+            [tile["world"], tile["sector"], tile["arena"]])
+        assert (x, y) in ville.address_tiles[
+            ville.get_tile_path((x, y), "arena")]
+
+    def test_layers(self, ville):
+        for level in ("sector", "arena", "game_object", "spawning_location"):
+            layer = getattr(ville, f"{level}_layer")
+            names = getattr(ville, f"{level}_names")
+            assert layer.shape == (100, 140) and layer.dtype == np.uint16
+            assert names[0] == "" and len(set(names)) == len(names)
+            assert layer.max() < len(names)
+        # イベントを持つのはオブジェクトのあるタイルだけ。
+        assert len(ville.tile_events) == np.count_nonzero(
+            ville.game_object_layer)
+        assert sum(len(t) for t in ville.arena_event_tiles.values()) == len(
+            ville.tile_events)
+
+    def test_sparse_events(self):
+        m = _tiny_maze({})
+        event = ("Isabella", "is", "idle", "idle")
+        assert m.access_tile((1, 1))["events"] == set()
+        m.add_event_from_tile(event, (1, 1))
+        assert m.access_tile((1, 1))["events"] == {event}
+        m.turn_event_from_tile_idle(event, (1, 1))
+        assert m.access_tile((1, 1))["events"] == {("Isabella", None, None,
+                                                    None)}
+        m.remove_subject_events_from_tile("Isabella", (1, 1))
+        assert m.tile_events == {}
+        m.add_event_from_tile(event, [2, 1])
+        m.remove_event_from_tile(event, (2, 1))
+        m.remove_event_from_tile(event, (2, 1))
+        assert m.tile_events == {}
+
+
+# ================================================================
+# 視界ウィンドウ（get_nearby_spaces / get_nearby_arena_events）
+# ================================================================
+
+def _reference_perception(maze, tile, vision_r):
+    """以前の perceive と同じ、タイルごとのループによる結果。"""
+    spaces = []
+    events = []
+    arena = maze.get_tile_path(tile, "arena")
+    for t in maze.get_nearby_tiles(tile, vision_r):
+        details = maze.access_tile(t)
+        space = tuple(details[k] for k in ("world", "sector", "arena",
+                                           "game_object"))
+        if space not in spaces:
+            spaces += [space]
+        if details["events"] and maze.get_tile_path(t, "arena") == arena:
+            events += [(math.dist(t, tile), details["events"])]
+    return spaces, sorted(events, key=lambda e: e[0])
+
+
+class TestVisionWindow:
+    def test_matches_tile_by_tile(self, ville):
+        rng = random.Random(1)
+        open_tiles = [(x, y) for y in range(ville.maze_height)
+                      for x in range(ville.maze_width)
+                      if not ville.collision_grid[y][x]]
+        for vision_r in (0, 4, 8, 200):
+            for tile in rng.sample(open_tiles, 20) + [(0, 0), (139, 99)]:
+                spaces, events = _reference_perception(ville, tile, vision_r)
+                assert ville.get_nearby_spaces(tile, vision_r) == spaces
+                nearby = ville.get_nearby_arena_events(tile, vision_r)
+                assert [d for d, _ in nearby] == pytest.approx(
+                    [d for d, _ in events])
+                assert [e for _, e in nearby] == [e for _, e in events]
+
+    def test_explored_tiles_give_the_same_places(self, ville):
+        # 探索済みタイルを飛ばしても、毎回全部見た場合と同じ順で場所が集まる。
+        rng = random.Random(3)
+        path = ville.path_to_address((72, 14), rng.choice(sorted(
+            a for a in ville.address_tiles if a.count(":") == 2)))
+        explored = np.zeros(ville.collision_grid.shape, dtype=bool)
+        full, incremental = [], []
+        for tile in path:
+            for space in ville.get_nearby_spaces(tile, 4):
+                if space not in full:
+                    full += [space]
+            for space in ville.get_nearby_spaces(tile, 4, explored):
+                if space not in incremental:
+                    incremental += [space]
+        assert incremental == full
+        assert ville.get_nearby_spaces(path[-1], 4, explored) == []
+
+    def test_follows_event_changes(self):
+        m = _tiny_maze({})
+        event = ("Isabella", "is", "idle", "idle")
+        assert m.get_nearby_arena_events((1, 1), 4) == []
+        m.add_event_from_tile(event, (3, 1))
+        assert m.get_nearby_arena_events((1, 1), 4) == [(2.0, {event})]
+        m.remove_event_from_tile(event, (3, 1))
+        assert m.arena_event_tiles == {}
+        assert m.get_nearby_arena_events((1, 1), 4) == []
+
+
+# ================================================================
+# イベントの索引（event_tiles / subject_tiles / arena_event_tiles）
+# ================================================================
+
+def _index_from_tiles(m):
+    """tile_events だけから作り直した索引。"""
+    event_tiles, subject_tiles, arena_event_tiles = {}, {}, {}
+    for tile, events in m.tile_events.items():
+        assert events
+        arena = (int(m.sector_layer[tile[1]][tile[0]]),
+                 int(m.arena_layer[tile[1]][tile[0]]),
+                 tile[0] // maze_module.EVENT_CELL,
+                 tile[1] // maze_module.EVENT_CELL)
+        arena_event_tiles.setdefault(arena, set()).add(tile)
+        for event in events:
+            event_tiles.setdefault(event, set()).add(tile)
+            subject_tiles.setdefault(event[0], {}).setdefault(
+                tile, set()).add(event)
+    return event_tiles, subject_tiles, arena_event_tiles
+
+
+class TestEventIndex:
+    def test_subject_and_event_tiles(self):
+        m = _tiny_maze({})
+        walk = ("Isabella", "is", "walking", "walking")
+        bed = ("w:s:a:bed", None, None, None)
+        m.add_event_from_tile(bed, (5, 1))
+        m.add_event_from_tile(bed, (6, 1))
+        m.add_event_from_tile(walk, (5, 1))
+        assert m.event_tiles[bed] == {(5, 1), (6, 1)}
+        assert m.subject_tiles["Isabella"] == {(5, 1): {walk}}
+
+        m.turn_event_from_tile_idle(walk, (5, 1))
+        idle = ("Isabella", None, None, None)
+        assert m.subject_tiles["Isabella"] == {(5, 1): {idle}}
+        assert walk not in m.event_tiles
+
+        m.remove_subject_events_from_tile("Isabella", (5, 1))
+        assert "Isabella" not in m.subject_tiles
+        assert m.tile_events[(5, 1)] == {bed}
+        m.remove_event_from_tile(bed, (5, 1))
+        m.remove_event_from_tile(bed, (6, 1))
+        assert (m.tile_events, m.event_tiles, m.subject_tiles,
+                m.arena_event_tiles) == ({}, {}, {}, {})
+
+    def test_index_stays_consistent(self, ville):
+        rng = random.Random(2)
+        names = ["Isabella", "Klaus", "Maria"]
+        tiles = rng.sample(sorted(ville.tile_events), 30)
+        saved = {t: set(e) for t, e in ville.tile_events.items()}
+        placed = {}
+        for step in range(300):
+            name = rng.choice(names)
+            if name in placed:
+                ville.remove_subject_events_from_tile(name, placed[name])
+            placed[name] = rng.choice(tiles)
+            event = (name, "is", "busy", str(step))
+            ville.add_event_from_tile(event, placed[name])
+            if step % 7 == 0:
+                ville.turn_event_from_tile_idle(event, placed[name])
+        assert (ville.event_tiles, ville.subject_tiles,
+                ville.arena_event_tiles) == _index_from_tiles(ville)
+        for name, tile in placed.items():
+            ville.remove_subject_events_from_tile(name, tile)
+        assert ville.tile_events == saved
+
+    def test_street_perception_while_far_events_change(self, ville):
+        """
+        通りは 1 つのアリーナなので、遠くの通りのイベントが別スレッドで
+        増減している間も、近くのイベントの知覚が壊れず同じ結果になる。
+        """
+        walkable = [(x, y) for y in range(ville.maze_height)
+                    for x in range(ville.maze_width)
+                    if ville._event_cell_key((x, y))[:2] == (0, 0)
+                    and not ville.collision_grid[y][x]
+                    and (x, y) not in ville.tile_events]
+        assert len(walkable) > 9000
+        center = walkable[len(walkable) // 2]
+        near = [t for t in walkable if 0 < math.dist(t, center) <= 3][:3]
+        far = [t for t in walkable if math.dist(t, center) > 20][:2000]
+        for count, t in enumerate(near):
+            ville.add_event_from_tile(("Klaus", "is", "near", str(count)), t)
+        expected = ville.get_nearby_arena_events(center, 4)
+        assert len(expected) == len(near)
+
+        stop = threading.Event()
+        errors = []
+
+        def churn():
+            while not stop.is_set():
+                for t in far:
+                    ville.add_event_from_tile(("Maria", "is", "far", ""), t)
+                for t in far:
+                    ville.remove_subject_events_from_tile("Maria", t)
+
+        thread = threading.Thread(target=churn)
+        thread.start()
+        try:
+            for _ in range(2000):
+                try:
+                    assert ville.get_nearby_arena_events(
+                        center, 4) == expected
+                except RuntimeError as e:
+                    errors += [e]
+                    break
+        finally:
+            stop.set()
+            thread.join()
+            for t in near:
+                ville.remove_subject_events_from_tile("Klaus", t)
+        assert errors == []
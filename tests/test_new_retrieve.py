@@ -0,0 +1,158 @@
+"""
+tests/test_new_retrieve.py
+
+retrieve.py の new_retrieve（ベクトル化スコアリング）のテスト。
+従来の辞書ベース実装と同一のランキングを返すことを確認する。
+"""
+import datetime
+import pathlib
+import random
+from unittest.mock import MagicMock
+
+import numpy as np
+import pytest
+
+from persona.memory_structures.associative_memory import AssociativeMemory
+from persona.cognitive_modules.retrieve import (
+    new_retrieve,
+    normalize_array_floats,
+    top_highest_x_indices,
+    normalize_dict_floats,
+    top_highest_x_values,
+    extract_recency,
+    extract_importance,
+    cos_sim,
+    get_embedding,
+)
+
+AM_DIR = str(pathlib.Path(__file__).resolve().parent / "fixtures"
+             / "associative_memory")
+
+
+# ---- helpers ----
+
+def _legacy_new_retrieve(persona, focal_points, n_count=30):
+    """ベクトル化前の new_retrieve（デバッグ出力を除く）。"""
+    retrieved = dict()
+    for focal_pt in focal_points:
+        nodes = [[i.last_accessed, i]
+                 for i in persona.a_mem.seq_event + persona.a_mem.seq_thought
+                 if "idle" not in i.embedding_key]
+        nodes = sorted(nodes, key=lambda x: x[0])
+        nodes = [i for created, i in nodes]
+
+        recency_out = normalize_dict_floats(
+            extract_recency(persona, nodes), 0, 1)
+        importance_out = normalize_dict_floats(
+            extract_importance(persona, nodes), 0, 1)
+        focal_embedding = get_embedding(focal_pt)
+        relevance_out = dict()
+        for node in nodes:
+            relevance_out[node.node_id] = cos_sim(
+                persona.a_mem.embeddings[node.embedding_key], focal_embedding)
+        relevance_out = normalize_dict_floats(relevance_out, 0, 1)
+
+        gw = [0.5, 3, 2]
+        master_out = dict()
+        for key in recency_out.keys():
+            master_out[key] = (
+                persona.scratch.recency_w*recency_out[key]*gw[0]
+                + persona.scratch.relevance_w*relevance_out[key]*gw[1]
+                + persona.scratch.importance_w*importance_out[key]*gw[2])
+
+        master_out = top_highest_x_values(master_out, n_count)
+        master_nodes = [persona.a_mem.id_to_node[key]
+                        for key in list(master_out.keys())]
+        for n in master_nodes:
+            n.last_accessed = persona.scratch.curr_time
+        retrieved[focal_pt] = master_nodes
+    return retrieved
+
+
+def _make_persona(seed, n_nodes=60):
+    """乱数シードから決定的に記憶を構築した Persona モックを生成する。"""
+    rng = random.Random(seed)
+    a_mem = AssociativeMemory(AM_DIR)
+    base = datetime.datetime(2023, 2, 13, 8, 0)
+    for i in range(n_nodes):
+        # 同一時刻のノードを混ぜて、同順位の扱いも検証する。
+        created = base + datetime.timedelta(minutes=rng.randint(0, 20))
+        desc = f"node {i} is idle" if i % 7 == 0 else f"node {i} happens"
+        embedding = [rng.uniform(-1, 1) for _ in range(10)]
+        args = (created, None, "s", "p", f"o{i}", desc, {f"kw{i}"},
+                rng.randint(1, 10), (desc, embedding), [])
+        if rng.random() < 0.3:
+            a_mem.add_thought(*args)
+        else:
+            a_mem.add_event(*args)
+
+    persona = MagicMock()
+    persona.a_mem = a_mem
+    persona.scratch.recency_decay = 0.99
+    persona.scratch.recency_w = 1
+    persona.scratch.relevance_w = 1
+    persona.scratch.importance_w = 1
+    persona.scratch.curr_time = base + datetime.timedelta(hours=1)
+    return persona
+
+
+# ================================================================
+# new_retrieve
+# ================================================================
+
+class TestNewRetrieve:
+    @pytest.mark.parametrize("seed", [0, 1, 2])
+    def test_matches_legacy_ranking(self, seed):
+        focal_points = ["Isabella is painting", "party plans", "coffee"]
+        vec_persona = _make_persona(seed)
+        ref_persona = _make_persona(seed)
+
+        # 2回続けて呼び、last_accessed の更新後も一致することを確認する。
+        for n_count in (10, 5):
+            got = new_retrieve(vec_persona, focal_points, n_count)
+            want = _legacy_new_retrieve(ref_persona, focal_points, n_count)
+            assert list(got.keys()) == list(want.keys())
+            for focal_pt in focal_points:
+                assert ([n.node_id for n in got[focal_pt]]
+                        == [n.node_id for n in want[focal_pt]])
+            vec_persona.scratch.curr_time += datetime.timedelta(minutes=5)
+            ref_persona.scratch.curr_time += datetime.timedelta(minutes=5)
+
+    def test_idle_nodes_excluded(self):
+        persona = _make_persona(3)
+        got = new_retrieve(persona, ["anything"], n_count=100)
+        assert all("idle" not in n.embedding_key for n in got["anything"])
+
+    def test_last_accessed_updated(self):
+        persona = _make_persona(4)
+        got = new_retrieve(persona, ["anything"], n_count=3)
+        for node in got["anything"]:
+            assert node.last_accessed == persona.scratch.curr_time
+
+    def test_empty_memory(self):
+        persona = _make_persona(5, n_nodes=0)
+        assert new_retrieve(persona, ["a", "b"]) == {"a": [], "b": []}
+
+
+# ================================================================
+# normalize_array_floats / top_highest_x_indices
+# ================================================================
+
+class TestVectorizedHelpers:
+    def test_normalize_matches_dict_version(self):
+        values = [1.2, 3.4, 5.6, 7.8]
+        d = normalize_dict_floats(dict(enumerate(values)), 0, 1)
+        out = normalize_array_floats(np.array(values), 0, 1)
+        assert out.tolist() == pytest.approx(list(d.values()))
+
+    def test_normalize_constant_column(self):
+        x = np.array([[5.0, 1.0], [5.0, 3.0]])
+        out = normalize_array_floats(x, 0, 1)
+        assert out[:, 0].tolist() == [0.5, 0.5]
+        assert out[:, 1].tolist() == [0.0, 1.0]
+
+    def test_top_indices_ties_keep_order(self):
+        scores = np.array([1.0, 3.0, 3.0, 2.0, 3.0])
+        assert top_highest_x_indices(scores, 2).tolist() == [1, 2]
+        assert top_highest_x_indices(scores, 10).tolist() == [1, 2, 4, 3, 0]
+        assert top_highest_x_indices(scores, 0).tolist() == []
@@ -1,8 +1,13 @@
 """Tests for reverie/backend_server/path_finder.py"""
 import copy
+import random
+
+import numpy as np
 import pytest
 
 from path_finder import (
+    PathCache,
+    occupancy_grid,
     path_finder_v1,
     path_finder_v2,
     path_finder,
@@ -95,6 +100,100 @@ class TestPathFinderV2:
         _all_on_open_tiles(path, original)
 
 
+# ===================================================================
+# Breadth-first search tests (queue frontier, occupancy grid)
+# ===================================================================
+
+def _wavefront_reference(a, start, end):
+    """
+    The original grid-scanning wavefront of path_finder_v2, without its
+    150-step limit. The BFS must return exactly the same paths.
+    """
+    m = [[0] * len(row) for row in a]
+    m[start[0]][start[1]] = 1
+    k = 0
+    while m[end[0]][end[1]] == 0:
+        k += 1
+        grew = False
+        for i in range(len(m)):
+            for j in range(len(m[i])):
+                if m[i][j] == k:
+                    for ni, nj in ((i - 1, j), (i, j - 1), (i + 1, j), (i, j + 1)):
+                        if (0 <= ni < len(m) and 0 <= nj < len(m[i])
+                                and m[ni][nj] == 0 and a[ni][nj] != COLLISION):
+                            m[ni][nj] = k + 1
+                            grew = True
+        if not grew:
+            break
+    i, j = end
+    k = m[i][j]
+    path = [(i, j)]
+    while k > 1:
+        for ni, nj in ((i - 1, j), (i, j - 1), (i + 1, j), (i, j + 1)):
+            if 0 <= ni < len(m) and 0 <= nj < len(m[i]) and m[ni][nj] == k - 1:
+                i, j = ni, nj
+                break
+        path.append((i, j))
+        k -= 1
+    path.reverse()
+    return path
+
+
+def _random_maze(rng, height, width, density):
+    return [['#' if rng.random() < density else ' ' for _ in range(width)]
+            for _ in range(height)]
+
+
+class TestBreadthFirstSearch:
+    def test_matches_wavefront_on_random_mazes(self):
+        """Same paths as the wavefront, including tie-breaking."""
+        rng = random.Random(0)
+        for _ in range(20):
+            maze = _random_maze(rng, 12, 15, 0.3)
+            for _ in range(20):
+                start = (rng.randrange(12), rng.randrange(15))
+                end = (rng.randrange(12), rng.randrange(15))
+                assert (path_finder_v2(maze, start, end, COLLISION)
+                        == _wavefront_reference(maze, start, end))
+
+    def test_occupancy_grid_input(self):
+        """A precomputed occupancy grid gives the same result."""
+        grid = occupancy_grid(_maze(), COLLISION)
+        assert grid.dtype == bool
+        assert grid.shape == (8, 13)
+        assert grid[0][0] and not grid[1][0]
+        assert (path_finder_v2(grid, (1, 0), (6, 12), COLLISION)
+                == path_finder_v2(_maze(), (1, 0), (6, 12), COLLISION))
+
+    def test_long_path_beyond_old_limit(self):
+        """Paths longer than 150 steps are found (the wavefront gave up)."""
+        # A serpentine corridor: rows alternate between open and walled,
+        # with a gap at alternating ends.
+        width = 40
+        maze = []
+        for r in range(15):
+            if r % 2 == 0:
+                maze.append([' '] * width)
+            else:
+                row = ['#'] * width
+                row[width - 1 if r % 4 == 1 else 0] = ' '
+                maze.append(row)
+        path = path_finder_v2(maze, (0, 0), (14, 0), COLLISION)
+        assert len(path) > 150
+        assert path[0] == (0, 0) and path[-1] == (14, 0)
+        _is_connected(path)
+        _all_on_open_tiles(path, maze)
+
+    def test_unreachable_returns_end(self):
+        """An unreachable end gives [end], as the wavefront did."""
+        sealed = [
+            ['#', '#', '#', '#', '#'],
+            [' ', ' ', '#', ' ', '#'],
+            ['#', '#', '#', '#', '#'],
+        ]
+        assert path_finder_v2(sealed, (1, 0), (1, 3), COLLISION) == [(1, 3)]
+
+
 # ===================================================================
 # path_finder_v1 tests (DFS, destructive)
 # ===================================================================
@@ -153,6 +252,48 @@ class TestPathFinder:
             assert original[y][x] != COLLISION, f"Collision at x={x},y={y}"
 
 
+# ===================================================================
+# PathCache tests (path_finder results keyed by (start, end))
+# ===================================================================
+
+class TestPathCache:
+    def test_hit_and_miss(self):
+        """The second identical query is served from the cache."""
+        cache = PathCache()
+        first = path_finder(_maze(), (0, 1), (12, 6), COLLISION, cache=cache)
+        second = path_finder(_maze(), (0, 1), (12, 6), COLLISION, cache=cache)
+        assert first == second == path_finder(_maze(), (0, 1), (12, 6), COLLISION)
+        assert (cache.hits, cache.misses) == (1, 1)
+        assert cache.hit_rate() == 0.5
+
+    def test_returns_copies(self):
+        """Changing a returned path does not change the cached one."""
+        cache = PathCache()
+        path = path_finder(_maze(), (0, 1), (12, 6), COLLISION, cache=cache)
+        path.clear()
+        assert path_finder(_maze(), (0, 1), (12, 6), COLLISION, cache=cache)
+
+    def test_version_invalidates(self):
+        """A new collision maze version drops every cached path."""
+        cache = PathCache()
+        maze = _maze()
+        before = path_finder(maze, (0, 1), (3, 1), COLLISION, cache=cache)
+        maze[1][3] = COLLISION
+        stale = path_finder(maze, (0, 1), (3, 1), COLLISION, cache=cache)
+        assert stale == before
+        after = path_finder(maze, (0, 1), (3, 1), COLLISION, cache=cache,
+                            version=1)
+        assert after == [(3, 1)]
+        assert len(cache.paths) == 1
+
+    def test_lru_bound(self):
+        """Only max_entries paths are kept, least recently used first out."""
+        cache = PathCache(max_entries=2)
+        for end in [(1, 1), (1, 2), (1, 1), (1, 3)]:
+            path_finder(_maze(), (0, 1), end, COLLISION, cache=cache)
+        assert list(cache.paths) == [((0, 1), (1, 1)), ((0, 1), (1, 3))]
+
+
 # ===================================================================
 # closest_coordinate tests
 # ===================================================================
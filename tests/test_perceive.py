@@ -8,9 +8,13 @@ import math
 from datetime import datetime
 from unittest.mock import MagicMock, call, patch
 
+import numpy as np
 import pytest
 
-from persona.cognitive_modules.perceive import perceive
+from maze import Maze
+from persona.memory_structures.spatial_memory import MemoryTree
+from persona.cognitive_modules.perceive import (generate_poig_scores,
+                                                perceive)
 
 
 # ---- helpers ----
@@ -33,10 +37,8 @@ def _make_persona():
     scratch.chat = [["Alice", "Hi"]]
     persona.scratch = scratch
 
-    # Spatial memory: real dict so tree mutations work naturally
-    s_mem = MagicMock()
-    s_mem.tree = {}
-    persona.s_mem = s_mem
+    # Spatial memory: a real, empty MemoryTree
+    persona.s_mem = MemoryTree("__nonexistent__/spatial.json")
 
     # Associative memory
     a_mem = MagicMock()
@@ -56,26 +58,33 @@ def _make_persona():
     return persona
 
 
-def _make_maze(tiles, tile_path_map=None):
-    """テスト用の Maze モックを生成する。
+def _make_maze(tiles):
+    """tiles から本物の Maze を組み立てる（csv を読まない）。
 
     Args:
         tiles: dict mapping (x,y) -> tile detail dict
-        tile_path_map: dict mapping (x,y) -> arena path string
     """
-    maze = MagicMock()
-
-    coords = list(tiles.keys())
-    maze.get_nearby_tiles = MagicMock(return_value=coords)
-    maze.access_tile = MagicMock(side_effect=lambda c: tiles[c])
-
-    if tile_path_map is None:
-        tile_path_map = {}
-    # get_tile_path: first arg is coord, second is level string
-    def _get_tile_path(coord, level="arena"):
-        return tile_path_map.get(coord, "world:sector:arena")
-    maze.get_tile_path = MagicMock(side_effect=_get_tile_path)
-
+    maze = Maze.__new__(Maze)
+    maze.maze_width = maze.maze_height = 100
+    maze.world = next(iter(tiles.values()))["world"]
+    for level in ("sector", "arena", "game_object", "spawning_location"):
+        names = [""]
+        layer = np.zeros((100, 100), dtype=np.uint16)
+        for (x, y), tile in tiles.items():
+            name = tile.get(level, "")
+            if name not in names:
+                names += [name]
+            layer[y][x] = names.index(name)
+        setattr(maze, f"{level}_names", names)
+        setattr(maze, f"{level}_layer", layer)
+    maze.collision_grid = np.zeros((100, 100), dtype=bool)
+    maze.tile_events = dict()
+    maze.event_tiles = dict()
+    maze.subject_tiles = dict()
+    maze.arena_event_tiles = dict()
+    for coord, tile in tiles.items():
+        for event in tile["events"]:
+            maze.add_event_from_tile(event, coord)
     return maze
 
 
@@ -142,6 +151,33 @@ class TestSpatialMemory:
         objects = persona.s_mem.tree["Smallville"]["downtown"]["cafe"]
         assert objects.count("table") == 1
 
+    def test_explored_tiles_skipped(self):
+        """探索済みのタイルは二度目の perceive で見直さない。"""
+        persona = _make_persona()
+        tiles = {
+            (50, 50): _tile("Smallville", "downtown", "cafe", "table"),
+        }
+        maze = _make_maze(tiles)
+
+        perceive(persona, maze)
+        explored = persona.s_mem.explored
+        assert explored[50][50] and explored[46][46] and not explored[45][50]
+
+        # 探索済みのタイルが変わっても空間記憶には入らない。
+        maze.game_object_names += ["counter"]
+        maze.game_object_layer[50][50] = len(maze.game_object_names) - 1
+        perceive(persona, maze)
+        assert persona.s_mem.tree["Smallville"]["downtown"]["cafe"] == [
+            "table"]
+
+        persona.scratch.curr_tile = (52, 50)
+        maze.game_object_layer[50][56] = len(maze.game_object_names) - 1
+        maze.sector_layer[50][56] = maze.sector_layer[50][50]
+        maze.arena_layer[50][56] = maze.arena_layer[50][50]
+        perceive(persona, maze)
+        assert persona.s_mem.tree["Smallville"]["downtown"]["cafe"] == [
+            "table", "counter"]
+
 
 # ================================================================
 # Event filtering tests
@@ -157,15 +193,10 @@ class TestEventFiltering:
         tiles = {
             (50, 50): _tile(events=set()),
             (51, 50): _tile(events={same_arena_event}),
-            (52, 50): _tile(events={diff_arena_event}),
-        }
-
-        tile_path_map = {
-            (50, 50): "world:sector:cafe",
-            (51, 50): "world:sector:cafe",
-            (52, 50): "world:sector:bedroom",  # different arena
+            (52, 50): _tile(arena="bedroom",  # different arena
+                            events={diff_arena_event}),
         }
-        maze = _make_maze(tiles, tile_path_map)
+        maze = _make_maze(tiles)
 
         perceive(persona, maze)
 
@@ -202,6 +233,7 @@ class TestEventFiltering:
         """近いイベントが先に知覚される。"""
         persona = _make_persona()
         persona.scratch.att_bandwidth = 10  # no limit effectively
+        persona.scratch.vision_r = 5
 
         far_event = ("Far", "is", "away", "far away")
         close_event = ("Close", "is", "near", "very near")
@@ -430,3 +462,98 @@ class TestEmbedding:
         add_event_args = persona.a_mem.add_event.call_args[0]
         event_embedding_pair = add_event_args[8]
         assert event_embedding_pair == ("Bob is cooking food", cached_vec)
+
+
+# ================================================================
+# Poignancy batching tests
+# ================================================================
+
+class TestPoignancyBatch:
+    @patch("persona.cognitive_modules.perceive.run_gpt_prompt_event_poignancy")
+    @patch("persona.cognitive_modules.perceive.run_gpt_prompt_poignancy_batch")
+    def test_grouped_by_persona(self, mock_batch, mock_single):
+        """複数件の人物は 1 プロンプト、1 件の人物は従来の単発プロンプト。"""
+        mock_batch.side_effect = lambda persona, items: (
+            [len(d) % 10 + 1 for _, d in items], None)
+        mock_single.return_value = (7, None)
+        alice, bob = _make_persona(), _make_persona()
+
+        scores = generate_poig_scores([
+            (alice, "event", "Bob is cooking food"),
+            (bob, "event", "Alice is reading"),
+            (alice, "event", "bed is idle"),
+            (alice, "thought", "I want to paint more"),
+        ])
+
+        assert scores == [len("Bob is cooking food") % 10 + 1, 7, 1,
+                          len("I want to paint more") % 10 + 1]
+        mock_batch.assert_called_once_with(
+            alice, [("event", "Bob is cooking food"),
+                    ("thought", "I want to paint more")])
+        mock_single.assert_called_once_with(bob, "Alice is reading")
+
+    @patch("persona.cognitive_modules.perceive.run_gpt_prompt_chat_poignancy")
+    @patch("persona.cognitive_modules.perceive.run_gpt_prompt_event_poignancy")
+    @patch("persona.cognitive_modules.perceive.run_gpt_prompt_poignancy_batch")
+    def test_invalid_items_fall_back(self, mock_batch, mock_single, mock_chat):
+        """バッチ応答で欠けた項目だけが単発プロンプトで採点される。"""
+        mock_batch.return_value = ([3, None, None], None)
+        mock_single.return_value = (6, None)
+        mock_chat.return_value = (8, None)
+        alice = _make_persona()
+
+        scores = generate_poig_scores([
+            (alice, "event", "Bob is cooking food"),
+            (alice, "event", "Carol is singing"),
+            (alice, "chat", "chatting with Bob"),
+        ])
+
+        assert scores == [3, 6, 8]
+        mock_single.assert_called_once_with(alice, "Carol is singing")
+        mock_chat.assert_called_once_with(alice, "chatting with Bob")
+
+    @patch("persona.cognitive_modules.perceive.ThreadPoolExecutor")
+    @patch("persona.cognitive_modules.perceive.run_gpt_prompt_event_poignancy")
+    @patch("persona.cognitive_modules.perceive.run_gpt_prompt_poignancy_batch")
+    def test_single_persona_runs_inline(self, mock_batch, mock_single,
+                                        mock_pool):
+        """1 人分の採点（とそのフォールバック）にはスレッドプールを作らない。"""
+        mock_batch.return_value = ([4, None], None)
+        mock_single.return_value = (6, None)
+        alice = _make_persona()
+
+        scores = generate_poig_scores([
+            (alice, "event", "Bob is cooking food"),
+            (alice, "event", "Carol is singing"),
+        ])
+
+        assert scores == [4, 6]
+        mock_pool.assert_not_called()
+
+    def test_nothing_to_rate(self):
+        alice = _make_persona()
+        assert generate_poig_scores([]) == []
+        assert generate_poig_scores([(alice, "event", "bed is idle")]) == [1]
+
+    @patch("persona.cognitive_modules.perceive.run_gpt_prompt_poignancy_batch")
+    def test_perceive_rates_events_in_one_batch(self, mock_batch):
+        """perceive は新しいイベントとチャットをまとめて採点する。"""
+        mock_batch.side_effect = lambda persona, items: (
+            list(range(2, 2 + len(items))), None)
+        persona = _make_persona()
+        tiles = {
+            (50, 50): _tile(events={("Bob", "cooking", "food",
+                                     "cooking food")}),
+            (51, 50): _tile(events={("Alice", "chat with", "Bob",
+                                     "chatting with Bob")}),
+        }
+
+        perceive(persona, _make_maze(tiles))
+
+        mock_batch.assert_called_once()
+        assert [kind for kind, _ in mock_batch.call_args[0][1]] == [
+            "event", "event", "chat"]
+        assert persona.a_mem.add_chat.call_args[0][7] == 4
+        assert [c[0][7] for c in persona.a_mem.add_event.call_args_list] == [
+            2, 3]
+        assert persona.scratch.importance_trigger_curr == 150 - 5
@@ -0,0 +1,112 @@
+"""
+tests/test_persona_journal.py
+
+Persona.save_delta / checkpoint / replay_journal（差分チェックポイント）のテスト。
+"""
+import datetime
+import json
+import pathlib
+import shutil
+
+import pytest
+
+from persona.persona import Persona, JOURNAL_FILE
+
+BASE_PERSONA = (pathlib.Path(__file__).resolve().parent.parent / "environment"
+                / "frontend_server" / "storage"
+                / "base_the_ville_isabella_maria_klaus" / "personas"
+                / "Isabella Rodriguez")
+
+
+@pytest.fixture
+def persona_folder(tmp_path):
+    folder = tmp_path / "Isabella Rodriguez"
+    shutil.copytree(BASE_PERSONA, folder)
+    return folder
+
+
+def _load(folder):
+    return Persona("Isabella Rodriguez", str(folder))
+
+
+def _add_event(persona, i):
+    return persona.a_mem.add_event(
+        datetime.datetime(2023, 2, 13, 8, i), None,
+        "Isabella Rodriguez", "is", f"thing {i}", f"Isabella does thing {i}",
+        {"isabella", f"thing {i}"}, 3, (f"thing {i}", [0.1 * i] * 10), [])
+
+
+def _state(persona):
+    """比較用に JSON 互換の形へ正規化した Persona の状態。"""
+    nodes = [persona.a_mem.node_to_dict(persona.a_mem.id_to_node[k])
+             for k in sorted(persona.a_mem.id_to_node)]
+    # keywords は set 由来で、並び順がハッシュシードに依存する。
+    for node in nodes:
+        node["keywords"] = sorted(node["keywords"])
+    return json.loads(json.dumps(
+        [nodes, persona.scratch.to_dict(), persona.s_mem.tree,
+         persona.a_mem.kw_strength_event]))
+
+
+def _start(persona):
+    persona.scratch.curr_time = datetime.datetime(2023, 2, 13, 8, 0)
+    persona.scratch.act_start_time = persona.scratch.curr_time
+
+
+class TestSaveDelta:
+    def test_replay_matches_live_state(self, persona_folder):
+        bootstrap = persona_folder / "bootstrap_memory"
+        persona = _load(persona_folder)
+        _start(persona)
+        _add_event(persona, 1)
+        persona.save_delta(str(bootstrap))
+
+        _add_event(persona, 2)
+        persona.scratch.planned_path += [(1, 2)]  # in-place な変更
+        persona.s_mem.tree["the Ville"]["new sector"] = {}
+        persona.save_delta(str(bootstrap))
+
+        lines = (bootstrap / JOURNAL_FILE).read_text().splitlines()
+        assert len(lines) == 2
+        second = json.loads(lines[1])
+        assert [n["object"] for n in second["nodes"]] == ["thing 2"]
+        assert list(second["scratch"]) == ["planned_path"]
+        assert "spatial_memory" in second
+
+        reloaded = _load(persona_folder)
+        assert reloaded.journal_size == 2
+        assert _state(reloaded) == _state(persona)
+
+    def test_unchanged_state_writes_empty_entry(self, persona_folder):
+        bootstrap = persona_folder / "bootstrap_memory"
+        persona = _load(persona_folder)
+        _start(persona)
+        persona.save_delta(str(bootstrap))
+        persona.save_delta(str(bootstrap))
+        last = json.loads(
+            (bootstrap / JOURNAL_FILE).read_text().splitlines()[-1])
+        assert last == {"nodes": [], "scratch": {}}
+
+    def test_checkpoint_compacts(self, persona_folder):
+        bootstrap = persona_folder / "bootstrap_memory"
+        persona = _load(persona_folder)
+        _start(persona)
+        for i in range(1, 4):
+            _add_event(persona, i)
+            persona.checkpoint(str(bootstrap), compact_every=2)
+        # 2 回の差分の後、3 回目でフルスナップショットに圧縮される。
+        assert not (bootstrap / JOURNAL_FILE).exists()
+        assert persona.journal_size == 0
+        assert _state(_load(persona_folder)) == _state(persona)
+
+    def test_torn_last_line_is_ignored(self, persona_folder):
+        bootstrap = persona_folder / "bootstrap_memory"
+        persona = _load(persona_folder)
+        _start(persona)
+        _add_event(persona, 1)
+        persona.save_delta(str(bootstrap))
+        with open(bootstrap / JOURNAL_FILE, "a") as f:
+            f.write('{"nodes": [{"type"')
+        reloaded = _load(persona_folder)
+        assert reloaded.journal_size == 1
+        assert len(reloaded.a_mem.id_to_node) == len(persona.a_mem.id_to_node)
@@ -0,0 +1,301 @@
+"""
+tests/test_plan_determine_action.py
+
+plan._resolve_action_address（行動の場所の投機的な解決）のテスト。
+候補のアドレスが空間記憶にあるものだけに絞られること、
+候補が当たればセクター・エリア・オブジェクトの答えは投機なしと同じで
+直列の往復が減ること、外れれば通常どおり順に聞き直すことを確認する。
+あわせて、繰り返す行動の解決結果を覚えておく行動メモ
+（_recall_action / _memorize_action）のキー・TTL・再利用確率を確認する。
+日の始めに一日分のタスク分解をまとめて先に始めておく
+DECOMP_AHEAD（_decompose_day_ahead / _task_decomp）も確認する。
+"""
+import datetime
+import pathlib
+import sys
+import threading
+import time
+from unittest.mock import MagicMock
+
+import pytest
+
+_MEM_DIR = str(pathlib.Path(__file__).resolve().parent.parent
+               / "reverie" / "backend_server" / "persona" / "memory_structures")
+if _MEM_DIR not in sys.path:
+    sys.path.insert(0, _MEM_DIR)
+
+from scratch import Scratch
+
+from persona.cognitive_modules import plan
+
+WORLD = "the Ville"
+TREE = {WORLD: {"Hobbs Cafe": {"cafe": ["counter", "table"]},
+                "Isabella's house": {"bedroom": ["bed"],
+                                     "kitchen": ["stove"]}}}
+DELAY = 0.1
+
+
+def _persona(act_address="the Ville:Hobbs Cafe:cafe:counter",
+             living_area="the Ville:Isabella's house:bedroom"):
+    persona = MagicMock()
+    persona.s_mem.tree = TREE
+    persona.scratch.curr_tile = (1, 1)
+    persona.scratch.act_address = act_address
+    persona.scratch.living_area = living_area
+    return persona
+
+
+def _maze(sector="Isabella's house", arena="kitchen"):
+    maze = MagicMock()
+    maze.access_tile.return_value = {"world": WORLD, "sector": sector,
+                                     "arena": arena}
+    return maze
+
+
+@pytest.fixture
+def prompts(monkeypatch):
+    """
+    generate_action_* をそれぞれ DELAY 秒かかる決定的な関数に置き換え、
+    呼び出しを記録する。
+    """
+    calls = []
+    lock = threading.Lock()
+    answers = {"sector": "Hobbs Cafe", "arena": {"Hobbs Cafe": "cafe"},
+               "object": {"the Ville:Hobbs Cafe:cafe": "counter"}}
+
+    def record(name, *args):
+        with lock:
+            calls.append((name,) + args)
+        time.sleep(DELAY)
+
+    def sector(act_desp, persona, maze):
+        record("sector")
+        return answers["sector"]
+
+    def arena(act_desp, persona, maze, act_world, act_sector):
+        record("arena", act_sector)
+        return answers["arena"].get(act_sector, "main room")
+
+    def game_object(act_desp, act_address, persona, maze):
+        record("object", act_address)
+        return answers["object"].get(act_address, "table")
+
+    def obj_desc(act_game_object, act_desp, persona):
+        record("obj_desc", act_game_object)
+        return f"{act_game_object} is being used"
+
+    monkeypatch.setattr(plan, "generate_action_sector", sector)
+    monkeypatch.setattr(plan, "generate_action_arena", arena)
+    monkeypatch.setattr(plan, "generate_action_game_object", game_object)
+    monkeypatch.setattr(plan, "generate_act_obj_desc", obj_desc)
+    return calls, answers
+
+
+def _resolve(persona=None, maze=None):
+    start = time.monotonic()
+    ret = plan._resolve_action_address("working", persona or _persona(),
+                                       maze or _maze(), WORLD)
+    return ret, time.monotonic() - start
+
+
+# ================================================================
+# _speculative_addresses
+# ================================================================
+
+class TestSpeculativeAddresses:
+    def test_order_and_filter(self):
+        persona = _persona(act_address="the Ville:nowhere:cafe:counter")
+        assert plan._speculative_addresses(persona, _maze(), WORLD, 3) == [
+            "the Ville:Isabella's house:kitchen",
+            "the Ville:Isabella's house:bedroom"]
+
+    def test_dedup_and_limit(self):
+        persona = _persona()
+        maze = _maze("Hobbs Cafe", "cafe")
+        assert plan._speculative_addresses(persona, maze, WORLD, 3) == [
+            "the Ville:Hobbs Cafe:cafe",
+            "the Ville:Isabella's house:bedroom"]
+        assert plan._speculative_addresses(persona, maze, WORLD, 1) == [
+            "the Ville:Hobbs Cafe:cafe"]
+
+    def test_missing_addresses(self):
+        persona = _persona(act_address=None, living_area=None)
+        assert plan._speculative_addresses(
+            persona, _maze("", ""), WORLD, 3) == []
+
+
+# ================================================================
+# _resolve_action_address
+# ================================================================
+
+EXPECTED = ("Hobbs Cafe", "cafe", "counter", "counter is being used")
+
+
+class TestResolveActionAddress:
+    def test_off_by_default(self, prompts, monkeypatch):
+        calls, _ = prompts
+        monkeypatch.delenv("ACTION_SPECULATION", raising=False)
+        ret, elapsed = _resolve()
+        assert ret == EXPECTED
+        assert [c[0] for c in calls] == ["sector", "arena", "object",
+                                         "obj_desc"]
+        assert elapsed >= 4 * DELAY
+
+    def test_hit(self, prompts, monkeypatch):
+        monkeypatch.setenv("ACTION_SPECULATION", "3")
+        ret, elapsed = _resolve()
+        assert ret == EXPECTED
+        # The sector and the guessed branches run side by side.
+        assert elapsed < 3.5 * DELAY
+
+    def test_sector_hit_arena_miss(self, prompts, monkeypatch):
+        calls, answers = prompts
+        answers["arena"]["Hobbs Cafe"] = "back room"
+        answers["object"]["the Ville:Hobbs Cafe:back room"] = "shelf"
+        monkeypatch.setenv("ACTION_SPECULATION", "3")
+        ret, _ = _resolve()
+        assert ret == ("Hobbs Cafe", "back room", "shelf",
+                       "shelf is being used")
+        assert ("object", "the Ville:Hobbs Cafe:back room") in calls
+
+    def test_miss(self, prompts, monkeypatch):
+        calls, answers = prompts
+        answers["sector"] = "Johnson Park"
+        monkeypatch.setenv("ACTION_SPECULATION", "3")
+        ret, _ = _resolve()
+        assert ret == ("Johnson Park", "main room", "table",
+                       "table is being used")
+        assert ("arena", "Johnson Park") in calls
+        assert ("object", "the Ville:Johnson Park:main room") in calls
+
+    def test_no_guesses(self, prompts, monkeypatch):
+        calls, _ = prompts
+        monkeypatch.setenv("ACTION_SPECULATION", "3")
+        persona = _persona(act_address=None, living_area=None)
+        ret, _ = _resolve(persona, _maze("", ""))
+        assert ret == EXPECTED
+        assert len(calls) == 4
+
+
+# ================================================================
+# action memo (_recall_action / _memorize_action)
+# ================================================================
+
+class TestActionMemo:
+    @pytest.fixture
+    def persona(self):
+        persona = _persona()
+        persona.scratch = Scratch("__nonexistent__/scratch.json")
+        persona.scratch.living_area = "the Ville:Isabella's house:bedroom"
+        persona.scratch.curr_time = datetime.datetime(2023, 2, 13, 8, 0)
+        return persona
+
+    @pytest.fixture
+    def maze(self):
+        maze = _maze()
+        maze.address_tiles = {"the Ville:Hobbs Cafe:cafe:counter": {(1, 1)}}
+        return maze
+
+    def _memorize(self, persona, act_desp="Having  breakfast."):
+        plan._memorize_action(persona, WORLD, act_desp,
+                              act_address="the Ville:Hobbs Cafe:cafe:counter",
+                              act_pronunciatio="🍳",
+                              act_event=["Isabella", "eat", "breakfast"])
+
+    def test_off_by_default(self, persona, maze, monkeypatch):
+        monkeypatch.delenv("ACTION_MEMO_TTL_DAYS", raising=False)
+        self._memorize(persona)
+        assert persona.scratch.act_memo == {}
+        assert plan._recall_action(persona, maze, WORLD,
+                                   "having breakfast") is None
+
+    def test_recall(self, persona, maze, monkeypatch):
+        monkeypatch.setenv("ACTION_MEMO_TTL_DAYS", "3")
+        self._memorize(persona)
+        memo = plan._recall_action(persona, maze, WORLD, "having breakfast")
+        assert memo["act_pronunciatio"] == "🍳"
+        # Other actions and other homes are not the same entry.
+        assert plan._recall_action(persona, maze, WORLD, "painting") is None
+        persona.scratch.living_area = "the Ville:Hobbs Cafe:cafe"
+        assert plan._recall_action(persona, maze, WORLD,
+                                   "having breakfast") is None
+
+    def test_expired(self, persona, maze, monkeypatch):
+        monkeypatch.setenv("ACTION_MEMO_TTL_DAYS", "1")
+        self._memorize(persona)
+        persona.scratch.curr_time += datetime.timedelta(days=1)
+        assert plan._recall_action(persona, maze, WORLD,
+                                   "having breakfast") is None
+
+    def test_address_gone(self, persona, maze, monkeypatch):
+        monkeypatch.setenv("ACTION_MEMO_TTL_DAYS", "3")
+        self._memorize(persona)
+        maze.address_tiles = dict()
+        assert plan._recall_action(persona, maze, WORLD,
+                                   "having breakfast") is None
+
+    def test_reuse_probability(self, persona, maze, monkeypatch):
+        monkeypatch.setenv("ACTION_MEMO_TTL_DAYS", "3")
+        monkeypatch.setenv("ACTION_MEMO_REUSE", "0")
+        self._memorize(persona)
+        assert plan._recall_action(persona, maze, WORLD,
+                                   "having breakfast") is None
+
+
+# ================================================================
+# day-ahead decomposition (_decompose_day_ahead / _task_decomp)
+# ================================================================
+
+class TestDecomposeDayAhead:
+    @pytest.fixture
+    def decomps(self, monkeypatch):
+        """generate_task_decomp を呼び出しを記録する関数に置き換える。"""
+        calls = []
+        lock = threading.Lock()
+
+        def decomp(persona, task, duration, org_index=None):
+            with lock:
+                calls.append((task, duration, org_index))
+            return [[f"{task} ({org_index})", duration]]
+
+        monkeypatch.setattr(plan, "generate_task_decomp", decomp)
+        return calls
+
+    @pytest.fixture
+    def persona(self):
+        persona = MagicMock()
+        persona.scratch = Scratch("__nonexistent__/scratch.json")
+        persona.scratch.f_daily_schedule_hourly_org = [
+            ["reading", 60], ["sleeping", 360], ["having breakfast", 60],
+            ["painting", 120], ["taking a walk", 30], ["painting", 120],
+            ["sleeping", 690]]
+        return persona
+
+    def test_off_by_default(self, persona, decomps, monkeypatch):
+        monkeypatch.delenv("DECOMP_AHEAD", raising=False)
+        plan._decompose_day_ahead(persona)
+        assert persona.scratch.decomp_ahead == {}
+        assert plan._task_decomp(persona, "painting", 120) == [
+            ["painting (None)", 120]]
+        assert decomps == [("painting", 120, None)]
+
+    def test_whole_day(self, persona, decomps, monkeypatch):
+        monkeypatch.setenv("DECOMP_AHEAD", " On ")
+        plan._decompose_day_ahead(persona)
+        for futures in persona.scratch.decomp_ahead.values():
+            for future in futures:
+                future.result()
+        # The first block, sleep and short blocks are not decomposed ahead;
+        # each block is decomposed as seen from the block before it.
+        assert sorted(decomps) == [("having breakfast", 60, 1),
+                                   ("painting", 120, 2),
+                                   ("painting", 120, 4)]
+
+        assert plan._task_decomp(persona, "painting", 120) == [
+            ["painting (2)", 120]]
+        assert plan._task_decomp(persona, "painting", 120) == [
+            ["painting (4)", 120]]
+        assert len(decomps) == 3
+        # Once used up, blocks are decomposed on demand again.
+        assert plan._task_decomp(persona, "painting", 120) == [
+            ["painting (None)", 120]]
@@ -97,6 +97,58 @@ class TestScratchGetters:
         assert "\n" in result  # multi-line string
 
 
+# ── memoized prompt strings ───────────────────────────────────────────
+
+class TestMemoizedPromptStrings:
+    def test_iss_reused_until_context_changes(self, scratch):
+        first = scratch.get_str_iss()
+        assert scratch.get_str_iss() is first
+        version = scratch.version
+        scratch.currently = "Isabella is planning a party."
+        assert scratch.version == version + 1
+        second = scratch.get_str_iss()
+        assert "Currently: Isabella is planning a party." in second
+        scratch.daily_plan_req = "stay at the cafe"
+        assert "Daily plan requirement: stay at the cafe" in (
+            scratch.get_str_iss())
+
+    def test_iss_follows_the_date(self, scratch):
+        first = scratch.get_str_iss()
+        scratch.curr_time += datetime.timedelta(minutes=10)
+        assert scratch.get_str_iss() is first
+        scratch.curr_time += datetime.timedelta(days=1)
+        assert scratch.get_str_iss() != first
+        assert scratch.curr_time.strftime("%A %B %d") in scratch.get_str_iss()
+
+    def test_act_summary_follows_new_action(self, scratch):
+        scratch.act_start_time = scratch.curr_time
+        first = scratch.act_summary_str()
+        assert scratch.act_summary_str() is first
+        scratch.add_new_action("the_ville:cafe:counter", 15, "making coffee",
+                               "~", ("Isabella Rodriguez", "is", "making"),
+                               None, None, None, None, None, None,
+                               ("counter", None, None))
+        assert "Activity: Isabella Rodriguez is making coffee" in (
+            scratch.act_summary_str())
+
+    def test_round_trip_without_an_action(self, scratch, tmp_path):
+        # A checkpoint taken before the first action has no act_start_time;
+        # loading it must not clear curr_time.
+        scratch.act_start_time = None
+        curr_time = scratch.curr_time
+        scratch.save(tmp_path / "scratch.json")
+        loaded = Scratch(str(tmp_path / "scratch.json"))
+        assert loaded.act_start_time is None
+        assert loaded.curr_time == curr_time
+        scratch.load_dict(loaded.to_dict())
+        assert scratch.curr_time == curr_time
+        assert loaded.to_dict() == scratch.to_dict()
+
+    def test_version_not_saved(self, scratch):
+        assert "version" not in scratch.to_dict()
+        assert "prompt_strs" not in scratch.to_dict()
+
+
 # ── daily schedule index ──────────────────────────────────────────────
 
 class TestDailyScheduleIndex:
@@ -141,6 +193,35 @@ class TestActionHelpers:
         assert scratch.act_path_set is False
 
 
+# ── action memo ───────────────────────────────────────────────────────
+
+class TestActMemo:
+    def test_recall_within_ttl(self, scratch):
+        scratch.add_act_memo("k", 2, act_address="a:b:c:d")
+        assert scratch.recall_act_memo("k", 2)["act_address"] == "a:b:c:d"
+        scratch.curr_time += datetime.timedelta(days=1)
+        assert scratch.recall_act_memo("k", 2) is not None
+        scratch.curr_time += datetime.timedelta(days=1)
+        assert scratch.recall_act_memo("k", 2) is None
+        assert "k" not in scratch.act_memo
+
+    def test_add_drops_expired(self, scratch):
+        scratch.add_act_memo("old", 1, act_address="x")
+        scratch.curr_time += datetime.timedelta(days=1)
+        scratch.add_act_memo("new", 1, act_address="y")
+        assert list(scratch.act_memo) == ["new"]
+
+    def test_saved_with_scratch(self, scratch, tmp_path):
+        scratch.add_act_memo("k", 1, act_address="a:b:c:d",
+                             act_event=["Isabella Rodriguez", "is", "eating"])
+        scratch.save(tmp_path / "scratch.json")
+        loaded = Scratch(str(tmp_path / "scratch.json"))
+        assert loaded.act_memo == scratch.act_memo
+
+    def test_missing_in_old_files(self, scratch):
+        assert scratch.act_memo == {}
+
+
 # ── daily schedule summary ────────────────────────────────────────────
 
 class TestDailyScheduleSummary:
@@ -86,3 +86,58 @@ class TestSaveReload:
         mem.save(out_file)
         reloaded = MemoryTree(out_file)
         assert reloaded.tree == mem.tree
+
+
+# ── places index and explored tiles ───────────────────────────────────
+
+class TestAddPlace:
+    def test_adds_new_levels_in_order(self, mem):
+        mem.add_place("the_ville", "isabella_house", "main_room", "lamp")
+        mem.add_place("the_ville", "isabella_house", "main_room", "easel")
+        mem.add_place("the_ville", "park", "garden", "")
+        room = mem.tree["the_ville"]["isabella_house"]["main_room"]
+        assert room == ["easel", "canvas", "paint_set", "lamp"]
+        assert mem.tree["the_ville"]["park"] == {"garden": []}
+        assert ("the_ville", "park", "garden") in mem.places
+
+    def test_empty_levels_skipped(self):
+        mt = MemoryTree("__nonexistent__/spatial.json")
+        mt.add_place("w", "", "", "")
+        assert mt.tree == {"w": {}}
+
+    def test_setting_tree_rebuilds_index(self, mem):
+        mem.get_explored(3, 4)[1][2] = True
+        mem.tree = {"w": {"s": {"a": ["o"]}}}
+        assert mem.places == {("w",), ("w", "s"), ("w", "s", "a"),
+                              ("w", "s", "a", "o")}
+        assert not mem.get_explored(3, 4).any()
+        mem.add_place("w", "s", "a", "o")
+        assert mem.tree == {"w": {"s": {"a": ["o"]}}}
+
+    def test_explored_shape(self, mem):
+        explored = mem.get_explored(3, 4)
+        assert explored.shape == (3, 4) and not explored.any()
+        assert mem.get_explored(3, 4) is explored
+        assert mem.get_explored(5, 4).shape == (5, 4)
+
+
+class TestMemoizedStrings:
+    def test_strings_follow_new_places(self, mem):
+        arena = "the_ville:isabella_house:main_room"
+        first = mem.get_str_accessible_arena_game_objects(arena)
+        assert mem.get_str_accessible_arena_game_objects(arena) is first
+        mem.add_place("the_ville", "isabella_house", "main_room", "lamp")
+        assert mem.get_str_accessible_arena_game_objects(arena).endswith(
+            "lamp")
+        mem.add_place("the_ville", "park", "", "")
+        assert mem.get_str_accessible_sectors("the_ville").endswith("park")
+        mem.add_place("the_ville", "isabella_house", "bathroom", "")
+        assert "bathroom" in mem.get_str_accessible_sector_arenas(
+            "the_ville:isabella_house")
+
+    def test_strings_follow_new_tree(self, mem):
+        assert "easel" in mem.get_str_accessible_arena_game_objects(
+            "the_ville:isabella_house:main_room")
+        mem.tree = {"the_ville": {"isabella_house": {"main_room": ["bed"]}}}
+        assert mem.get_str_accessible_arena_game_objects(
+            "the_ville:isabella_house:main_room") == "bed"
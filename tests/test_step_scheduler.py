@@ -0,0 +1,293 @@
+"""
+tests/test_step_scheduler.py
+
+step_scheduler.PipelinedStepScheduler のテスト。
+逐次ヘッドレスループ（全員の phase A の後に persona 順で phase B）と
+同じ最終状態になること、無関係なペルソナ同士が待ち合わせないことを確認する。
+"""
+import datetime
+import pathlib
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import maze as maze_module
+from step_scheduler import PipelinedStepScheduler
+
+ASSETS = (pathlib.Path(__file__).resolve().parent.parent / "environment"
+          / "frontend_server" / "static_dirs" / "assets" / "the_ville"
+          / "matrix")
+
+
+# ---- fakes ----
+
+class FakeMaze:
+    """イベント集合だけを持つ Maze の代用品。"""
+
+    def __init__(self):
+        self.tiles = dict()
+
+    def _events(self, tile):
+        return self.tiles.setdefault(tuple(tile), set())
+
+    def add_event_from_tile(self, curr_event, tile):
+        self._events(tile).add(curr_event)
+
+    def remove_event_from_tile(self, curr_event, tile):
+        self._events(tile).discard(curr_event)
+
+    def turn_event_from_tile_idle(self, curr_event, tile):
+        if curr_event in self._events(tile):
+            self._events(tile).remove(curr_event)
+            self._events(tile).add((curr_event[0], None, None, None))
+
+    def remove_subject_events_from_tile(self, subject, tile):
+        for event in list(self._events(tile)):
+            if event[0] == subject:
+                self._events(tile).remove(event)
+
+    def snapshot(self):
+        return {k: sorted(map(str, v)) for k, v in self.tiles.items() if v}
+
+
+class FakePersona:
+    """
+    vision_r 内のペルソナを知覚し、phase B で知覚した相手の scratch を
+    読み書きする（会話の代わり）ペルソナ。
+    """
+
+    def __init__(self, name, path, delay=0.0, trace=None):
+        self.name = name
+        self.delay = delay
+        self.trace = trace
+        self.scratch = SimpleNamespace(
+            vision_r=1, chatting_with=None, act_address="somewhere",
+            planned_path=list(path), curr_time=None, curr_tile=None,
+            greetings=0, log=[])
+        self.scratch.get_curr_event_and_desc = lambda: (
+            self.name, "is", "walking", "walking")
+        self.scratch.get_curr_obj_event_and_desc = lambda: (
+            f"obj of {self.name}", "is", "used", "used")
+
+    def move_phase_a(self, maze, curr_tile, curr_time):
+        if self.trace is not None:
+            self.trace.append(("a_start", self.name, curr_time))
+        time.sleep(self.delay)
+        self.scratch.curr_tile = curr_tile
+        self.scratch.curr_time = curr_time
+        retrieved = dict()
+        r = self.scratch.vision_r
+        for x in range(curr_tile[0] - r, curr_tile[0] + r + 1):
+            for y in range(curr_tile[1] - r, curr_tile[1] + r + 1):
+                for event in maze.tiles.get((x, y), ()):
+                    if event[0] != self.name and event[1] == "is":
+                        retrieved[f"{event[0]} {event[2]}"] = {
+                            "curr_event": SimpleNamespace(subject=event[0])}
+        self.scratch.log += [("a", curr_time, curr_tile, sorted(retrieved))]
+        if self.trace is not None:
+            self.trace.append(("a_end", self.name, curr_time))
+        return False, retrieved
+
+    def move_phase_b(self, maze, personas, retrieved):
+        for desc in sorted(retrieved):
+            other = personas.get(retrieved[desc]["curr_event"].subject)
+            if other is not None:
+                # 相手の状態を読み、書き換える。
+                self.scratch.log += [("b", other.name,
+                                      other.scratch.greetings)]
+                other.scratch.greetings += 1
+        next_tile = self.scratch.curr_tile
+        if self.scratch.planned_path:
+            next_tile = self.scratch.planned_path.pop(0)
+        return next_tile, "", "walking"
+
+
+class VillePersona(FakePersona):
+    """本物の Maze の get_nearby_arena_events で知覚する FakePersona。"""
+
+    def __init__(self, name, path, delay=0.0, trace=None):
+        super().__init__(name, path, delay, trace)
+        self.scratch.vision_r = 4
+
+    def move_phase_a(self, maze, curr_tile, curr_time):
+        time.sleep(self.delay)
+        self.scratch.curr_tile = curr_tile
+        self.scratch.curr_time = curr_time
+        retrieved = dict()
+        for _, events in maze.get_nearby_arena_events(
+                curr_tile, self.scratch.vision_r):
+            for event in events:
+                if event[0] != self.name and event[1] == "is":
+                    retrieved[f"{event[0]} {event[2]}"] = {
+                        "curr_event": SimpleNamespace(subject=event[0])}
+        self.scratch.log += [("a", curr_time, curr_tile, sorted(retrieved))]
+        return False, retrieved
+
+
+def _ville():
+    patch = pytest.MonkeyPatch()
+    patch.setattr(maze_module, "env_matrix", str(ASSETS))
+    patch.setattr(maze_module, "collision_block_id", "32125")
+    try:
+        ville = maze_module.Maze("the_ville")
+    finally:
+        patch.undo()
+    # 比較しやすいよう、ペルソナが置いたイベントだけを見る。
+    objects = set(ville.tile_events)
+    ville.snapshot = lambda: {
+        t: sorted(map(str, e)) for t, e in ville.tile_events.items()
+        if t not in objects}
+    return ville
+
+
+def _make_server(specs, trace=None, persona_class=FakePersona, maze=None):
+    personas = dict()
+    tiles = dict()
+    for name, start, path, delay in specs:
+        personas[name] = persona_class(name, path, delay, trace)
+        tiles[name] = start
+    return SimpleNamespace(
+        personas=personas, personas_tile=tiles,
+        maze=maze if maze is not None else FakeMaze(), step=0,
+        curr_time=datetime.datetime(2023, 2, 13, 8, 0), sec_per_step=10)
+
+
+def _run_sequential(server, n_steps):
+    """start_server_headless の逐次ループと同じ手順。"""
+    game_obj_cleanup = dict()
+    for step in range(n_steps):
+        for key, val in game_obj_cleanup.items():
+            server.maze.turn_event_from_tile_idle(key, val)
+        game_obj_cleanup = dict()
+        for name, persona in server.personas.items():
+            tile = server.personas_tile[name]
+            server.maze.remove_subject_events_from_tile(persona.name, tile)
+            server.maze.add_event_from_tile(
+                persona.scratch.get_curr_event_and_desc(), tile)
+            if not persona.scratch.planned_path:
+                obj_event = persona.scratch.get_curr_obj_event_and_desc()
+                game_obj_cleanup[obj_event] = tile
+                server.maze.add_event_from_tile(obj_event, tile)
+                server.maze.remove_event_from_tile(
+                    (obj_event[0], None, None, None), tile)
+        results = {name: p.move_phase_a(server.maze,
+                                        server.personas_tile[name],
+                                        server.curr_time)
+                   for name, p in server.personas.items()}
+        for name, persona in server.personas.items():
+            next_tile, _, _ = persona.move_phase_b(
+                server.maze, server.personas, results[name][1])
+            old_tile = server.personas_tile[name]
+            server.personas_tile[name] = next_tile
+            server.maze.remove_subject_events_from_tile(persona.name,
+                                                        old_tile)
+            server.maze.add_event_from_tile(
+                persona.scratch.get_curr_event_and_desc(), next_tile)
+        server.step += 1
+        server.curr_time += datetime.timedelta(seconds=server.sec_per_step)
+
+
+def _state(server):
+    return ({name: (p.scratch.log, p.scratch.greetings)
+             for name, p in server.personas.items()},
+            dict(server.personas_tile), server.maze.snapshot(),
+            server.step, server.curr_time)
+
+
+def _line(start, n, dx):
+    return [(start[0] + dx * (i + 1), start[1]) for i in range(n)]
+
+
+SPECS = [
+    # Alice と Bob はすれ違う（互いに知覚し phase B で干渉する）。
+    ("Alice", (0, 0), _line((0, 0), 6, 1), 0.002),
+    ("Bob", (6, 0), _line((6, 0), 6, -1), 0.0),
+    # Carol と Dave は遠く離れており、Dave は遅い。
+    ("Carol", (100, 100), _line((100, 100), 3, 1), 0.0),
+    ("Dave", (200, 200), [], 0.01),
+]
+
+
+# the Ville の通り（1 つのアリーナ）を歩くペルソナたち。
+VILLE_SPECS = [
+    # Alice と Bob はすれ違う。
+    ("Alice", (20, 5), _line((20, 5), 8, 1), 0.002),
+    ("Bob", (28, 5), _line((28, 5), 8, -1), 0.0),
+    # 残りは遠く離れた同じ通りを歩き、遠くのイベントを変え続ける。
+    ("Carol", (60, 8), _line((60, 8), 8, 1), 0.0),
+    ("Dave", (100, 2), _line((100, 2), 8, 1), 0.005),
+    ("Erin", (130, 14), _line((130, 14), 8, -1), 0.0),
+    ("Frank", (80, 11), [], 0.001),
+]
+
+
+# ================================================================
+# PipelinedStepScheduler
+# ================================================================
+
+class TestPipelinedStepScheduler:
+    @pytest.mark.parametrize("n_steps", [1, 7, 12])
+    def test_matches_sequential_loop(self, n_steps):
+        ref = _make_server(SPECS)
+        _run_sequential(ref, n_steps)
+        got = _make_server(SPECS)
+        PipelinedStepScheduler(got).run(n_steps)
+        assert _state(got) == _state(ref)
+        # すれ違いで実際に相互作用が起きていること。
+        if n_steps > 1:
+            assert got.personas["Bob"].scratch.greetings > 0
+
+    def test_matches_sequential_loop_on_the_ville(self):
+        """
+        本物の Maze でも、遠くのペルソナによる同じアリーナ（通り）の
+        イベントの増減が、別スレッドの知覚を壊さず結果も変えない。
+        """
+        ref = _make_server(VILLE_SPECS, persona_class=VillePersona,
+                           maze=_ville())
+        _run_sequential(ref, 12)
+        got = _make_server(VILLE_SPECS, persona_class=VillePersona,
+                           maze=_ville())
+        PipelinedStepScheduler(got).run(12)
+        assert _state(got) == _state(ref)
+        assert got.personas["Bob"].scratch.greetings > 0
+
+    def test_checkpoints_align_all_personas(self):
+        server = _make_server(SPECS)
+        seen = []
+
+        def on_checkpoint(steps_run):
+            seen.append((steps_run, server.step,
+                         {n: len(p.scratch.log) for n, p
+                          in server.personas.items()
+                          if n in ("Carol", "Dave")}))
+
+        PipelinedStepScheduler(server).run(
+            10, checkpoint_every=4, on_checkpoint=on_checkpoint)
+        assert [s[:2] for s in seen] == [(4, 4), (8, 8)]
+        # チェックポイント時点で全員が同じステップに揃っている。
+        assert seen[0][2] == {"Carol": 4, "Dave": 4}
+        assert server.step == 10
+
+    def test_unrelated_persona_does_not_wait(self):
+        lock = threading.Lock()
+
+        class LockedList(list):
+            def append(self, item):
+                with lock:
+                    super().append(item)
+
+        trace = LockedList()
+        server = _make_server(SPECS, trace)
+        PipelinedStepScheduler(server).run(3)
+        t0 = datetime.datetime(2023, 2, 13, 8, 0)
+        t1 = t0 + datetime.timedelta(seconds=10)
+        # Carol は遅い Dave の step 0 の phase A 完了を待たずに step 1 を始める。
+        assert (trace.index(("a_start", "Carol", t1))
+                < trace.index(("a_end", "Dave", t0)))
+
+    def test_empty_run(self):
+        server = _make_server(SPECS)
+        PipelinedStepScheduler(server).run(0)
+        assert server.step == 0